@@ -14,6 +14,9 @@ from .datasets import (
     Scanpaths,
     Stimuli,
     FileStimuli,
+    HDF5Stimuli,
+    PackedStimuli,
+    pack_stimuli,
     create_nonfixations,
     create_subset,
     remove_out_of_stimulus_fixations,
@@ -68,6 +71,7 @@ from .precomputed_models import (
     HDF5Model,
     export_model_to_hdf5,
 )
+from .evaluation import evaluate
 
 from .external_models import (
     AIM,
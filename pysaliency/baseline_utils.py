@@ -134,21 +134,20 @@ class ScikitLearnImageSubjectCrossValidationGenerator(object):
         self.fixations = fixations
 
     def __iter__(self):
+        fixation_indices = self.fixations.fixation_indices_by_stimulus
         for n in range(len(self.stimuli)):
+            image_inds = fixation_indices[n]
+            image_subjects = self.fixations.subject[image_inds]
             for s in range(self.fixations.subject_count):
-                image_inds = self.fixations.n == n
-                subject_inds = self.fixations.subject == s
-                train_inds, test_inds = image_inds & ~subject_inds, image_inds & subject_inds
-                if test_inds.sum() == 0 or train_inds.sum() == 0:
+                subject_inds = image_subjects == s
+                # scikit at some point loads all indices from all crossvalidation folds into memory
+                # if we used binary masks, this would use a lot of memory, hence
+                # we use indices here
+                train_inds, test_inds = image_inds[~subject_inds], image_inds[subject_inds]
+                if len(test_inds) == 0 or len(train_inds) == 0:
                     #print("Skipping")
                     continue
 
-                # scikit at some point loads all indices from all crossvalidation folds into memory
-                # if we use the binary masks, this will use a lot of memory, hence
-                # we convert to indices here
-                train_inds = np.nonzero(train_inds)[0]
-                test_inds = np.nonzero(test_inds)[0]
-
                 yield train_inds, test_inds
 
     def __len__(self):
@@ -163,24 +162,20 @@ class ScikitLearnWithinImageCrossValidationGenerator(object):
         self.rng = np.random.RandomState(seed=random_seed)
 
     def __iter__(self):
+        fixation_indices = self.fixations.fixation_indices_by_stimulus
         for n in range(len(self.stimuli)):
-            image_inds = self.fixations.n == n
-            _image_inds = np.nonzero(image_inds)[0]
+            image_inds = fixation_indices[n]
+            _image_inds = image_inds.copy()
             self.rng.shuffle(_image_inds)
             chunks = np.array_split(_image_inds, self.chunks_per_image)
             for chunk in chunks:
                 if not len(chunk):
                     continue
-                test_inds = np.zeros_like(self.fixations.n)
-                test_inds[chunk] = 1
-                test_inds = test_inds > 0.5
-                train_inds = image_inds & ~test_inds
-
                 # scikit at some point loads all indices from all crossvalidation folds into memory
-                # if we use the binary masks, this will use a lot of memory, hence
-                # we convert to indices here
-                train_inds = np.nonzero(train_inds)[0]
-                test_inds = np.nonzero(test_inds)[0]
+                # if we used binary masks, this would use a lot of memory, hence
+                # we use sorted indices here
+                test_inds = np.sort(chunk)
+                train_inds = np.setdiff1d(image_inds, test_inds, assume_unique=True)
 
                 yield train_inds, test_inds
 
@@ -439,18 +434,18 @@ class GoldModel(Model):
         self.eps = eps
         self.keep_aspect = keep_aspect
         self.xs, self.ys = normalize_fixations(stimuli, fixations, keep_aspect=self.keep_aspect, verbose=verbose)
+        self.fixation_indices = fixations.fixation_indices_by_stimulus
         self.shape_cache = {}
 
     def _log_density(self, stimulus):
         shape = stimulus.shape[0], stimulus.shape[1]
 
         stimulus_id = get_image_hash(stimulus)
-        stimulus_index = self.stimuli.stimulus_ids.index(stimulus_id)
+        stimulus_index = self.stimuli.stimulus_index(stimulus_id)
 
-        #fixations = self.fixations[self.fixations.n == stimulus_index]
-        inds = self.fixations.n == stimulus_index
+        inds = self.fixation_indices[stimulus_index]
 
-        if not inds.sum():
+        if not len(inds):
             return UniformModel().log_density(stimulus)
 
         ZZ = np.zeros(shape)
@@ -487,17 +482,18 @@ class KDEGoldModel(Model):
             fixations, normalize=self.stimuli,
             keep_aspect=self.keep_aspect, add_shape=False, verbose=False)
         self.stimulus_indices = fixations.n
+        self.fixation_indices = fixations.fixation_indices_by_stimulus
         self.shape_cache = {}
 
     def _log_density(self, stimulus):
         shape = stimulus.shape[0], stimulus.shape[1]
 
         stimulus_id = get_image_hash(stimulus)
-        stimulus_index = self.stimuli.stimulus_ids.index(stimulus_id)
+        stimulus_index = self.stimuli.stimulus_index(stimulus_id)
 
-        inds = self.stimulus_indices == stimulus_index
+        inds = self.fixation_indices[stimulus_index]
 
-        if not inds.sum():
+        if not len(inds):
             return UniformModel().log_density(stimulus)
 
         X = self.X[inds]
@@ -563,6 +559,7 @@ class CrossvalidatedBaselineModel(Model):
         self.bandwidth = bandwidth
         self.eps = eps
         self.xs, self.ys = normalize_fixations(stimuli, fixations)
+        self.fixation_indices = fixations.fixation_indices_by_stimulus
         #self.kde = KernelDensity(kernel='gaussian', bandwidth=bandwidth).fit(np.vstack([self.xs, self.ys]).T)
         self.shape_cache = {}
 
@@ -570,10 +567,9 @@ class CrossvalidatedBaselineModel(Model):
         shape = stimulus.shape[0], stimulus.shape[1]
 
         stimulus_id = get_image_hash(stimulus)
-        stimulus_index = self.stimuli.stimulus_ids.index(stimulus_id)
+        stimulus_index = self.stimuli.stimulus_index(stimulus_id)
 
-        #fixations = self.fixations[self.fixations.n == stimulus_index]
-        inds = self.fixations.n != stimulus_index
+        inds = self.fixation_indices.other_indices(stimulus_index)
 
         ZZ = np.zeros(shape)
 
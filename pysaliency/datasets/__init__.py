@@ -6,8 +6,20 @@ import numpy as np
 from boltons.cacheutils import cached
 
 from .fixations import Fixations, FixationTrains, ScanpathFixations, scanpaths_from_fixations
+from .packed_stimuli import PackedStimuli, pack_stimuli
 from .scanpaths import Scanpaths, concatenate_scanpaths
-from .stimuli import FileStimuli, ObjectStimuli, Stimuli, StimuliStimulus, Stimulus, as_stimulus, check_prediction_shape, get_image_hash
+from .stimuli import (
+    FileStimuli,
+    HDF5Stimuli,
+    ObjectStimuli,
+    Stimuli,
+    StimuliStimulus,
+    Stimulus,
+    StimulusLoader,
+    as_stimulus,
+    check_prediction_shape,
+    get_image_hash,
+)
 from .utils import concatenate_attributes, decode_string, get_merged_attribute_list
 
 
@@ -97,7 +109,7 @@ def concatenate_stimuli(stimuli):
         attributes[key] = concatenate_attributes(s.attributes[key] for s in stimuli)
 
     if all(isinstance(s, FileStimuli) for s in stimuli):
-        return FileStimuli(sum([s.filenames for s in stimuli], []), attributes=attributes)
+        return FileStimuli(sum([s.filenames for s in stimuli], []), shapes=sum([list(s.shapes) for s in stimuli], []), attributes=attributes)
     else:
         return ObjectStimuli(sum([s.stimulus_objects for s in stimuli], []), attributes=attributes)
 
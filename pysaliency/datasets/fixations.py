@@ -12,6 +12,53 @@ from .scanpaths import Scanpaths
 from .utils import _load_attribute_dict_from_hdf5, concatenate_attributes, decode_string, get_merged_attribute_list, hdf5_wrapper
 
 
+class FixationIndicesByStimulus(object):
+    """Groups fixation indices by stimulus in a CSR-like structure.
+
+    `order` contains all fixation indices stably sorted by their stimulus index,
+    and the fixations of stimulus `n` are `order[offsets[n]:offsets[n+1]]`.
+    Indexing with a stimulus index returns the indices of all fixations on
+    this stimulus in their original order, without scanning all fixations.
+    """
+    def __init__(self, n):
+        self.n = np.array(n, dtype=int)
+        if len(self.n) and self.n.min() < 0:
+            raise ValueError("Stimulus indices must not be negative")
+
+        self.order = np.argsort(self.n, kind='stable')
+        self.counts = np.bincount(self.n)
+        self.offsets = np.zeros(len(self.counts) + 1, dtype=int)
+        np.cumsum(self.counts, out=self.offsets[1:])
+
+    def __len__(self):
+        """number of stimulus indices up to the largest one with fixations"""
+        return len(self.counts)
+
+    def __getitem__(self, stimulus_index):
+        if not 0 <= stimulus_index < len(self.counts):
+            return self.order[:0]
+        return self.order[self.offsets[stimulus_index]:self.offsets[stimulus_index + 1]]
+
+    def count(self, stimulus_index):
+        """number of fixations on the given stimulus"""
+        if not 0 <= stimulus_index < len(self.counts):
+            return 0
+        return self.counts[stimulus_index]
+
+    def other_indices(self, stimulus_index):
+        """indices of all fixations which are *not* on the given stimulus, sorted by stimulus index"""
+        if not 0 <= stimulus_index < len(self.counts):
+            return self.order
+        return np.concatenate((
+            self.order[:self.offsets[stimulus_index]],
+            self.order[self.offsets[stimulus_index + 1]:]
+        ))
+
+    def matches(self, n):
+        """whether this index has been built from the given stimulus indices"""
+        return len(n) == len(self.n) and np.array_equal(n, self.n)
+
+
 class Fixations(object):
     """Capsules the fixations of a dataset and provides different methods
        of accessing them, e.g. in fixation trains, as conditional fixations
@@ -280,6 +327,19 @@ class Fixations(object):
     def subject_count(self):
         return int(self.subject.max())+1
 
+    @property
+    def fixation_indices_by_stimulus(self) -> FixationIndicesByStimulus:
+        """ indices of the fixations grouped by stimulus, see `FixationIndicesByStimulus`.
+
+        The grouping is computed once and cached. It is rebuilt automatically
+        whenever `n` changes.
+        """
+        index = getattr(self, '_fixation_indices_by_stimulus', None)
+        if index is None or not index.matches(self.n):
+            index = FixationIndicesByStimulus(self.n)
+            self._fixation_indices_by_stimulus = index
+        return index
+
     def copy(self):
         cfix = Fixations(self.x.copy(), self.y.copy(), self.t.copy(),
                          self.x_hist.copy(), self.y_hist.copy(), self.t_hist.copy(),
@@ -0,0 +1,161 @@
+"""
+Persistent index of metadata of stimulus files.
+
+Some metadata of stimulus files, most importantly the stimulus ids, can only be computed
+by decoding the images, and even reading the shapes requires opening every file.
+`FileMetadataIndex` stores such metadata in a JSON lines file next to the dataset, such
+that later runs can reuse it. Each entry records the size and the modification time of
+its stimulus file and is ignored once the file changed.
+
+New entries are appended to the index file, such that several processes can populate the
+same index. If the index file can't be written (e.g. on read-only storage), the metadata
+is only kept in memory. When the index file contains superseded lines, it is compacted
+to one line per stimulus file after reading it. Entries which other processes append
+during the compaction might get lost, they are computed again when they are needed.
+"""
+
+import json
+import os
+import threading
+import uuid
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class FileMetadataIndex(object):
+    """ Metadata of stimulus files, stored in the JSON lines file `location`
+
+    Filenames are stored relative to the directory of `location`, such that the
+    index stays valid when the whole dataset directory is moved.
+    """
+    def __init__(self, location):
+        self.location = os.path.abspath(location)
+        self._entries = None
+        self._writable = True
+        self._lock = threading.RLock()
+
+    @property
+    def directory(self):
+        return os.path.dirname(self.location)
+
+    def _key(self, filename):
+        return os.path.relpath(os.path.abspath(filename), self.directory)
+
+    @staticmethod
+    def _stat(filename):
+        stat = os.stat(filename)
+        return stat.st_size, stat.st_mtime_ns
+
+    @property
+    def entries(self):
+        """ the valid and outdated entries of the index by relative filename """
+        with self._lock:
+            if self._entries is None:
+                entries = {}
+                line_count = 0
+                if os.path.exists(self.location):
+                    with open(self.location, 'rb') as f:
+                        for line in f:
+                            line_count += 1
+                            try:
+                                entry = json.loads(line.decode('utf-8'))
+                            except ValueError:
+                                # partially written line of a process that crashed
+                                continue
+                            self._apply_entry(entries, entry)
+                self._entries = entries
+                if line_count > len(entries):
+                    self._compact()
+            return self._entries
+
+    def _compact(self):
+        """ rewrite the index file with one line per stimulus file """
+        if not self._writable:
+            return
+        data = ''.join(json.dumps(dict(entry, filename=key)) + '\n' for key, entry in self._entries.items()).encode('utf-8')
+        temp_filename = os.path.join(self.directory, '.{}.{}.tmp'.format(os.path.basename(self.location), uuid.uuid4().hex))
+        try:
+            with open(temp_filename, 'wb') as f:
+                f.write(data)
+            os.replace(temp_filename, self.location)
+        except OSError:
+            # e.g. read-only storage, the index stays valid without compaction
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+
+    @staticmethod
+    def _apply_entry(entries, entry):
+        entry = dict(entry)
+        key = entry.pop('filename')
+        old_entry = entries.get(key)
+        if old_entry is not None and (old_entry['size'], old_entry['mtime_ns']) == (entry['size'], entry['mtime_ns']):
+            old_entry.update(entry)
+        else:
+            entries[key] = entry
+
+    def get(self, filename, field):
+        """ the value of `field` for `filename`, or None if it is unknown or the file changed since """
+        entry = self.entries.get(self._key(filename))
+        if entry is None or field not in entry:
+            return None
+        try:
+            if (entry['size'], entry['mtime_ns']) != self._stat(filename):
+                return None
+        except OSError:
+            return None
+        return entry[field]
+
+    def update(self, filename, **fields):
+        """ store `fields` for `filename` """
+        self.update_many([(filename, fields)])
+
+    def update_many(self, items, n_jobs=1):
+        """ store the fields for many files at once, `items` is an iterable of `(filename, fields)`
+
+        The sizes and modification times of the files are read in `n_jobs` threads
+        (`None`: chosen by `concurrent.futures.ThreadPoolExecutor`).
+        """
+        items = list(items)
+        if n_jobs != 1 and len(items) > 1:
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                stats = list(executor.map(self._stat, [filename for filename, _ in items]))
+        else:
+            stats = [self._stat(filename) for filename, _ in items]
+
+        new_entries = []
+        for (filename, fields), (size, mtime_ns) in zip(items, stats):
+            new_entries.append(dict(fields, filename=self._key(filename), size=size, mtime_ns=mtime_ns))
+
+        with self._lock:
+            entries = self.entries
+            for entry in new_entries:
+                self._apply_entry(entries, entry)
+
+            if not self._writable or not new_entries:
+                return
+            data = ''.join(json.dumps(entry) + '\n' for entry in new_entries).encode('utf-8')
+            try:
+                with open(self.location, 'ab') as f:
+                    if fcntl is not None:
+                        # keep the lines of concurrent writers apart, closing the file releases the lock
+                        fcntl.flock(f, fcntl.LOCK_EX)
+                    f.write(data)
+            except OSError as e:
+                self._writable = False
+                warnings.warn("Can't write metadata index {}, keeping metadata only in memory: {}".format(self.location, e))
+
+    def __getstate__(self):
+        # the entries are read again by the receiving process
+        state = dict(self.__dict__)
+        state['_entries'] = None
+        state.pop('_lock')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__ = dict(state)
+        self._lock = threading.RLock()
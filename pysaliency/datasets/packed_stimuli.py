@@ -0,0 +1,179 @@
+"""
+Packed stimulus archives.
+
+`pack_stimuli` writes all stimuli into a single file: the raw data of all stimuli as one
+contiguous blob, followed by a JSON table with the offset, shape and dtype of each stimulus,
+the stimulus ids and the attributes. `PackedStimuli` memory maps the blob and returns views
+into it, such that opening an archive doesn't read any image data and all processes using
+the same archive share the stimuli in the page cache. Pickling `PackedStimuli` (e.g. to send
+them to worker processes) only transfers the filename and the stimulus indices.
+
+The data of each stimulus starts at a multiple of `ALIGNMENT` bytes, such that the views are
+aligned for all dtypes.
+"""
+
+import json
+import os
+import struct
+import uuid
+
+import numpy as np
+from tqdm import tqdm
+
+from ..utils import LazyList
+from .stimuli import Stimuli, StimuliStimulus
+
+ALIGNMENT = 64
+PACKED_STIMULI_VERSION = '1.0'
+
+_MAGIC = b'PYSALPK1'
+_FOOTER = struct.Struct('<Q8s')
+
+
+def _encode_attribute(value):
+    if isinstance(value, np.ndarray):
+        return {'dtype': value.dtype.str, 'values': value.tolist()}
+    return {'values': [item.tolist() if isinstance(item, (np.ndarray, np.generic)) else item for item in value]}
+
+
+def _decode_attribute(value):
+    if 'dtype' in value:
+        return np.array(value['values'], dtype=np.dtype(value['dtype']))
+    return value['values']
+
+
+def pack_stimuli(stimuli, filename, verbose=False):
+    """ Write `stimuli` into the packed stimulus archive `filename` and return them as `PackedStimuli`.
+
+    The file is written atomically, i.e. other processes never see a partially written archive.
+    """
+    directory, basename = os.path.split(os.path.abspath(filename))
+    temp_filename = os.path.join(directory, '.{}.{}.tmp'.format(basename, uuid.uuid4().hex))
+
+    offsets = []
+    shapes = []
+    dtypes = []
+    stimulus_ids = []
+    position = 0
+    try:
+        with open(temp_filename, 'wb') as f:
+            for stimulus in tqdm(stimuli.iter_stimuli(), total=len(stimuli), disable=not verbose):
+                stimulus = np.ascontiguousarray(stimulus)
+                if stimulus.dtype.hasobject:
+                    raise TypeError("Can't pack stimuli of dtype {}".format(stimulus.dtype))
+
+                padding = -position % ALIGNMENT
+                f.write(b'\0' * padding)
+                position += padding
+
+                offsets.append(position)
+                shapes.append(list(stimulus.shape))
+                dtypes.append(stimulus.dtype.str)
+                stimulus_ids.append(stimuli.stimulus_ids[len(stimulus_ids)])
+
+                f.write(stimulus.tobytes())
+                position += stimulus.nbytes
+
+            table = json.dumps({
+                'version': PACKED_STIMULI_VERSION,
+                'data_size': position,
+                'offsets': offsets,
+                'shapes': shapes,
+                'dtypes': dtypes,
+                'stimulus_ids': stimulus_ids,
+                '__attributes__': list(stimuli.__attributes__),
+                'attributes': {key: _encode_attribute(value) for key, value in stimuli.attributes.items()},
+            }).encode('utf8')
+            f.write(table)
+            f.write(_FOOTER.pack(len(table), _MAGIC))
+            # make sure the data is on disk before the archive becomes visible
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+    return PackedStimuli(filename)
+
+
+def read_packed_stimuli_table(filename):
+    """ the table of contents of the packed stimulus archive `filename` """
+    with open(filename, 'rb') as f:
+        f.seek(-_FOOTER.size, os.SEEK_END)
+        table_length, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+        if magic != _MAGIC:
+            raise ValueError("{} is no packed stimulus archive".format(filename))
+        f.seek(-_FOOTER.size - table_length, os.SEEK_END)
+        table = json.loads(f.read(table_length).decode('utf8'))
+
+    if table['version'] != PACKED_STIMULI_VERSION:
+        raise ValueError("Invalid version! Expected {}, got {}".format(PACKED_STIMULI_VERSION, table['version']))
+
+    return table
+
+
+class PackedStimuli(Stimuli):
+    """
+    Stimuli stored in a packed stimulus archive written by `pack_stimuli`.
+
+    The stimuli are read-only views into the memory mapped archive. `indices` selects
+    a subset of the stimuli in the archive (default: all stimuli). Subsets of `PackedStimuli`
+    use the same archive, and pickled `PackedStimuli` only contain `filename` and `indices`.
+    """
+    def __init__(self, filename, indices=None):
+        self.filename = os.path.abspath(filename)
+        self._data = None
+
+        table = read_packed_stimuli_table(self.filename)
+        if indices is None:
+            indices = range(len(table['offsets']))
+        self.indices = [int(i) for i in indices]
+
+        self._data_size = table['data_size']
+        self._offsets = [table['offsets'][i] for i in self.indices]
+        self._dtypes = [np.dtype(table['dtypes'][i]) for i in self.indices]
+        self.shapes = [tuple(table['shapes'][i]) for i in self.indices]
+
+        # views don't need to be cached
+        self.stimuli = LazyList(self.load_stimulus, len(self.indices), cache=False)
+        self.sizes = LazyList(lambda n: (self.shapes[n][0], self.shapes[n][1]),
+                              length=len(self.stimuli))
+        stimulus_ids = [table['stimulus_ids'][i] for i in self.indices]
+        self.stimulus_ids = LazyList(stimulus_ids.__getitem__, length=len(stimulus_ids))
+        self.stimulus_objects = [StimuliStimulus(self, n) for n in range(len(self.stimuli))]
+
+        self.__attributes__ = list(table['__attributes__'])
+        self.attributes = {key: _decode_attribute(value) for key, value in table['attributes'].items()}
+        if len(self.indices) != len(table['offsets']) or self.indices != sorted(self.indices):
+            self.attributes = self._get_attribute_for_stimulus_subset(self.indices)
+
+    @property
+    def data(self):
+        """ the memory mapped data of all stimuli in the archive """
+        if self._data is None:
+            if self._data_size:
+                self._data = np.memmap(self.filename, dtype=np.uint8, mode='r', shape=(self._data_size,))
+            else:
+                # empty files can't be memory mapped
+                self._data = np.zeros(0, dtype=np.uint8)
+        return self._data
+
+    def load_stimulus(self, n):
+        offset = self._offsets[n]
+        dtype = self._dtypes[n]
+        shape = self.shapes[n]
+        size = int(np.prod(shape)) * dtype.itemsize
+        return self.data[offset:offset + size].view(dtype).reshape(shape)
+
+    def __getitem__(self, index):
+        subset_indices = self._subset_indices(index)
+        if subset_indices is not None:
+            return type(self)(self.filename, indices=[self.indices[i] for i in subset_indices])
+        else:
+            return self.stimulus_objects[index]
+
+    def __reduce__(self):
+        # the receiving process maps the archive again
+        return type(self), (self.filename, self.indices)
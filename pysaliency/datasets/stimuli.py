@@ -1,8 +1,11 @@
 import json
 import os
+import threading
+import zlib
 from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha1
-from typing import List, Union
+from typing import Dict, List, Union
 
 import numpy as np
 
@@ -14,9 +17,26 @@ from PIL import Image
 from tqdm import tqdm
 
 from ..utils import LazyList
+from .metadata_index import FileMetadataIndex
 from .utils import create_hdf5_dataset, decode_string, hdf5_wrapper
 
 
+def _fits_into_single_chunk(data):
+    # hdf5 chunks have to be smaller than 4 GiB
+    return data.ndim > 0 and 0 < data.nbytes < 2 ** 32
+
+
+def _deflate_chunk(data, compression_opts, shuffle):
+    """ compress `data` as the hdf5 shuffle (optional) and deflate filters would do """
+    data = np.ascontiguousarray(data)
+    if shuffle and data.dtype.itemsize > 1:
+        # first all first bytes of the items, then all second bytes, ...
+        chunk = data.reshape(-1).view(np.uint8).reshape(-1, data.dtype.itemsize).T.tobytes()
+    else:
+        chunk = data.tobytes()
+    return zlib.compress(chunk, compression_opts)
+
+
 def get_image_hash(img):
     """
     Calculate a unique hash for the given image.
@@ -28,6 +48,21 @@ def get_image_hash(img):
     return sha1(np.ascontiguousarray(img)).hexdigest()
 
 
+def read_image_shape(filename):
+    """ Shape of the image stored in `filename` without decoding the image data.
+
+    Returns (height, width) for single channel images and (height, width, channels) otherwise.
+    """
+    with Image.open(filename) as img:
+        size = img.size
+        mode = img.mode
+    if len(mode) > 1:
+        # PIL uses (width, height), we use (height, width)
+        return (size[1], size[0], len(mode))
+    else:
+        return (size[1], size[0])
+
+
 class Stimulus(object):
     """
     Manages a stimulus.
@@ -62,6 +97,13 @@ class Stimulus(object):
             self._size = self.stimulus_data.shape[0], self.stimulus_data.shape[1]
         return self._size
 
+    def downscaled_stimulus_data(self, max_size):
+        """ The stimulus data for callers which downscale the stimulus such that its larger side
+        is `max_size` pixels. The data might be decoded at a lower resolution than `size`,
+        but not lower than needed for `max_size` (see `FileStimuli.load_stimulus`).
+        """
+        return self.stimulus_data
+
 
 def as_stimulus(img_or_stimulus: Union[np.ndarray, Stimulus]) -> Stimulus:
     if isinstance(img_or_stimulus, Stimulus):
@@ -94,6 +136,132 @@ class StimuliStimulus(Stimulus):
     def size(self):
         return self.stimuli.sizes[self.index]
 
+    def downscaled_stimulus_data(self, max_size):
+        return self.stimuli.downscaled_stimulus(self.index, max_size)
+
+
+# default number of images that `StimulusLoader` decodes ahead. Decoding ahead starts background
+# threads, therefore it is disabled by default as `pysaliency.parallel.PREFETCH_COUNT`.
+STIMULUS_PREFETCH_COUNT = 0
+
+
+class LoaderStimulus(StimuliStimulus):
+    """
+    Stimulus of a `StimulusLoader`, whose image is decoded ahead by the loader
+    """
+    def __init__(self, loader, position):
+        super().__init__(loader.stimuli, loader.indices[position])
+        self.loader = loader
+        self.position = position
+
+    @property
+    def stimulus_data(self):
+        return self.loader.stimulus_data(self.position)
+
+    @property
+    def stimulus_id(self):
+        # avoid decoding the image a second time if it is decoded already
+        self.loader.wait(self.position)
+        return self.stimuli.stimulus_ids[self.index]
+
+
+class StimulusLoader(Sequence):
+    """
+    Stimulus objects for the stimuli `indices` (default: all stimuli) of `stimuli`,
+    whose images are decoded ahead in a thread pool.
+
+    Once the image of a stimulus is accessed, the images of the next `prefetch_count`
+    stimuli (default: `STIMULUS_PREFETCH_COUNT`) are decoded in `n_jobs` threads
+    (default: one per prefetched image), as long as the stimuli are accessed in order.
+    Accessing only the stimulus ids doesn't start decoding, such that models which
+    find their predictions in a cache don't wait for images they don't need.
+
+    With `prefetch_count=0` (the default unless `STIMULUS_PREFETCH_COUNT` is changed), the loader
+    returns the stimulus objects of `stimuli` and starts no threads. Use the loader as context manager
+    or call `close` to stop the threads.
+    """
+    def __init__(self, stimuli, indices=None, prefetch_count=None, n_jobs=None):
+        if indices is None:
+            indices = range(len(stimuli))
+        if prefetch_count is None:
+            prefetch_count = STIMULUS_PREFETCH_COUNT
+        self.stimuli = stimuli
+        self.indices = list(indices)
+        self.prefetch_count = prefetch_count
+        self.n_jobs = n_jobs or prefetch_count
+        self._lock = threading.Lock()
+        self._executor = None
+        self._futures = {}
+        self._next_position = 0
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, position):
+        if not self.prefetch_count:
+            return self.stimuli.stimulus_objects[self.indices[position]]
+        return LoaderStimulus(self, position)
+
+    def _load(self, position):
+        return self.stimuli._load_cached_stimulus(self.indices[position])
+
+    def stimulus_data(self, position):
+        """ the image of the stimulus at `position`, starting to decode the next images if accessed in order """
+        with self._lock:
+            future = self._futures.pop(position, None)
+            for old_position in [old_position for old_position in self._futures if old_position < position]:
+                self._futures.pop(old_position).cancel()
+
+            if self.prefetch_count and position == self._next_position:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.n_jobs)
+                for next_position in range(position + 1, min(position + 1 + self.prefetch_count, len(self))):
+                    if next_position not in self._futures:
+                        self._futures[next_position] = self._executor.submit(self._load, next_position)
+            self._next_position = position + 1
+
+        if future is not None:
+            return future.result()
+        return self._load(position)
+
+    def wait(self, position):
+        """ wait until the image at `position` is decoded, if it is being decoded """
+        with self._lock:
+            future = self._futures.get(position)
+        if future is not None:
+            future.result()
+
+    def close(self):
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures = {}
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        if getattr(self, '_executor', None) is not None:
+            self.close()
+
+    def __getstate__(self):
+        # threads and pending images stay in this process
+        state = dict(self.__dict__)
+        state['_executor'] = None
+        state['_futures'] = {}
+        state.pop('_lock')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__ = dict(state)
+        self._lock = threading.Lock()
+
 
 class Stimuli(Sequence):
     """
@@ -149,6 +317,22 @@ class Stimuli(Sequence):
 
         return sub_attributes
 
+    def _subset_indices(self, index):
+        """ the indices of the stimuli selected by the slice, list, index array or boolean mask `index`,
+        or None if `index` selects a single stimulus """
+        if isinstance(index, slice):
+            return np.arange(len(self))[index]
+
+        if isinstance(index, (list, np.ndarray)):
+            index = np.asarray(index)
+            if index.dtype == bool:
+                if not len(index) == len(self.stimuli):
+                    raise ValueError(f"Boolean index has to have the same length as the stimuli list but got {len(index)} and {len(self.stimuli)}")
+                index = np.nonzero(index)[0]
+            return index
+
+        return None
+
     def __getitem__(self, index):
         if isinstance(index, slice):
             attributes = self._get_attribute_for_stimulus_subset(index)
@@ -175,21 +359,110 @@ class Stimuli(Sequence):
         else:
             return self.stimulus_objects[index]
 
+    def stimulus_loader(self, indices=None, prefetch_count=None, n_jobs=None):
+        """ `StimulusLoader` for the stimuli `indices` (default: all stimuli).
+
+        The stimuli are kept in memory, so nothing is decoded ahead.
+        """
+        return StimulusLoader(self, indices, prefetch_count=0)
+
+    def iter_stimuli(self, indices=None, prefetch_count=None, n_jobs=None):
+        """ Iterate over the images of the stimuli `indices` (default: all stimuli) in order.
+
+        For `FileStimuli`, the next `prefetch_count` images are decoded in `n_jobs`
+        threads while the current image is processed (see `StimulusLoader`).
+        """
+        with self.stimulus_loader(indices, prefetch_count=prefetch_count, n_jobs=n_jobs) as loader:
+            for stimulus in loader:
+                yield stimulus.stimulus_data
+
+    def load_batch(self, indices, n_jobs=None):
+        """ The images of the stimuli `indices` as list. `FileStimuli` decode them in `n_jobs` threads. """
+        return [self.stimuli[n] for n in indices]
+
+    def _load_cached_stimulus(self, n):
+        return self.stimuli[n]
+
+    def downscaled_stimulus(self, n, max_size):
+        """ The image of stimulus `n` for callers which downscale it such that its larger
+        side is `max_size` pixels (see `Stimulus.downscaled_stimulus_data`).
+        """
+        return self.stimuli[n]
+
+    def stimulus_index(self, stimulus_id):
+        """ Index of the (first) stimulus with the given stimulus id.
+
+        Unlike `stimulus_ids.index(stimulus_id)`, the ids are computed at most once
+        and kept in a dictionary, such that repeated lookups take constant time.
+        Raises ValueError if there is no such stimulus.
+        """
+        index_map = self.__dict__.setdefault('_stimulus_index_map', {})
+        if stimulus_id in index_map:
+            return index_map[stimulus_id]
+
+        # continue where the last lookup stopped, such that each id is computed only once
+        for n in range(self.__dict__.get('_stimulus_index_scanned', 0), len(self)):
+            self._stimulus_index_scanned = n + 1
+            current_id = self.stimulus_ids[n]
+            index_map.setdefault(current_id, n)
+            if current_id == stimulus_id:
+                return n
+
+        raise ValueError("Stimulus id '{}' not found in stimuli!".format(stimulus_id))
+
+    def set_stimulus_ids(self, stimulus_ids: Dict[int, str]):
+        """ Set the known ids `{index: stimulus_id}` of some stimuli (e.g. of the same images in other
+        stimuli), such that they don't have to be computed from the images. """
+        for n, stimulus_id in stimulus_ids.items():
+            if not 0 <= n < len(self):
+                raise IndexError("Stimulus index {} out of range".format(n))
+            self.stimulus_ids._cache[n] = stimulus_id
+
     def _propagate_stimulus_ids(self, sub_stimuli: "Stimuli", index: List[int]):
-        for new_index, old_index in enumerate(index):
-            if old_index in self.stimulus_ids._cache:
-                sub_stimuli.stimulus_ids._cache[new_index] = self.stimulus_ids._cache[old_index]
+        sub_stimuli.set_stimulus_ids({new_index: self.stimulus_ids._cache[old_index]
+                                      for new_index, old_index in enumerate(index)
+                                      if old_index in self.stimulus_ids._cache})
 
     @hdf5_wrapper(mode='w')
-    def to_hdf5(self, target, verbose=False, compression='gzip', compression_opts=9):
+    def to_hdf5(self, target, verbose=False, compression='gzip', compression_opts=None, shuffle=False, n_jobs=None):
         """ Write stimuli to hdf5 file or hdf5 group
+
+        Each stimulus is stored as a single chunk, such that reading a stimulus
+        decompresses exactly one chunk. With `'gzip'` compression, the stimuli are
+        loaded and compressed in `n_jobs` threads (default: one per CPU) and the
+        compressed chunks are written directly to the file. Lower `compression_opts`
+        and the `shuffle` filter are usually much faster than the default gzip level 9 at
+        a similar size. Other compression filters (e.g. the fast `'lzf'`, which takes no
+        `compression_opts`) are applied by h5py in the calling thread.
         """
+        from ..parallel import prefetch
 
         target.attrs['type'] = np.bytes_('Stimuli')
         target.attrs['version'] = np.bytes_('1.1')
 
-        for n, stimulus in enumerate(tqdm(self.stimuli, disable=not verbose)):
-            target.create_dataset(str(n), data=stimulus, compression=compression, compression_opts=compression_opts)
+        if n_jobs is None:
+            n_jobs = os.cpu_count() or 1
+
+        if compression == 'gzip' and compression_opts is None:
+            compression_opts = 9
+
+        def _load_and_compress(n):
+            stimulus = np.asarray(self._load_cached_stimulus(n))
+            if compression == 'gzip' and _fits_into_single_chunk(stimulus):
+                return stimulus, _deflate_chunk(stimulus, compression_opts, shuffle)
+            return stimulus, None
+
+        stimuli = prefetch(_load_and_compress, range(len(self)), prefetch_count=2 * n_jobs, n_jobs=n_jobs)
+        for n, (stimulus, chunk) in enumerate(tqdm(stimuli, total=len(self), disable=not verbose)):
+            if not compression or not _fits_into_single_chunk(stimulus):
+                target.create_dataset(str(n), data=stimulus, compression=compression, compression_opts=compression_opts, shuffle=shuffle)
+            elif chunk is None:
+                target.create_dataset(str(n), data=stimulus, chunks=stimulus.shape,
+                                      compression=compression, compression_opts=compression_opts, shuffle=shuffle)
+            else:
+                dataset = target.create_dataset(str(n), shape=stimulus.shape, dtype=stimulus.dtype, chunks=stimulus.shape,
+                                                 compression=compression, compression_opts=compression_opts, shuffle=shuffle)
+                dataset.id.write_direct_chunk((0,) * stimulus.ndim, chunk)
 
         self._attributes_to_hdf5(target)
 
@@ -197,8 +470,12 @@ class Stimuli(Sequence):
 
     @classmethod
     @hdf5_wrapper(mode='r')
-    def read_hdf5(cls, source):
-        """ Read stimuli from hdf5 file or hdf5 group """
+    def read_hdf5(cls, source, lazy=False):
+        """ Read stimuli from hdf5 file or hdf5 group
+
+        If `lazy` is True, an `HDF5Stimuli` object is returned, which reads the
+        stimuli from the hdf5 file only when they are accessed.
+        """
 
         data_type = decode_string(source.attrs['type'])
         data_version = decode_string(source.attrs['version'])
@@ -209,6 +486,9 @@ class Stimuli(Sequence):
         if data_version not in ['1.0', '1.1']:
             raise ValueError("Invalid version! Expected '1.0' or '1.1', got", data_version)
 
+        if lazy:
+            return HDF5Stimuli(source.file.filename, group=source.name)
+
         size = source.attrs['size']
         stimuli = []
 
@@ -275,26 +555,75 @@ class ObjectStimuli(Stimuli):
         raise NotImplementedError()
 
 
-class FileStimuli(Stimuli):
+# default memory limit for the decoded stimuli that `FileStimuli` keep in memory
+FILE_STIMULI_CACHE_BYTES = 2 ** 30
+
+
+class LazyStimuliMixin(object):
+    """
+    Stimuli which decode stimulus `n` with `load_stimulus(n)` when it is accessed
+    and keep the decoded stimuli in `self.stimuli`, a `LazyList` with a bounded cache.
+    """
+    @property
+    def cached(self):
+        return self.stimuli.cache
+
+    @cached.setter
+    def cached(self, value):
+        self.stimuli.cache = value
+
+    @property
+    def cache_bytes(self):
+        return self.stimuli.cache_bytes
+
+    def _load_cached_stimulus(self, n):
+        # unlike self.stimuli[n], this doesn't block other threads while decoding
+        if n in self.stimuli._cache:
+            return self.stimuli[n]
+        stimulus = self.load_stimulus(n)
+        if self.cached:
+            self.stimuli._cache[n] = stimulus
+        return stimulus
+
+    def stimulus_loader(self, indices=None, prefetch_count=None, n_jobs=None):
+        """ `StimulusLoader` for the stimuli `indices` (default: all stimuli), which decodes
+        the next `prefetch_count` images in `n_jobs` threads.
+        """
+        return StimulusLoader(self, indices, prefetch_count=prefetch_count, n_jobs=n_jobs)
+
+    def load_batch(self, indices, n_jobs=None):
+        """ The images of the stimuli `indices` as list, decoded in `n_jobs` threads
+        (default: chosen by `concurrent.futures.ThreadPoolExecutor`).
+        """
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            return list(executor.map(self._load_cached_stimulus, indices))
+
+
+class FileStimuli(LazyStimuliMixin, Stimuli):
     """
     Manage a list of stimuli that are saved as files.
     """
-    def __init__(self, filenames, cached=True, shapes=None, attributes=None):
+    # FileStimuli pickled by older versions have no metadata index
+    metadata_index = None
+
+    def __init__(self, filenames, cached=True, shapes=None, attributes=None, metadata_index=None, n_jobs=None,
+                 cache_bytes=FILE_STIMULI_CACHE_BYTES):
         """
         Create a stimuli object that reads it's stimuli from files.
 
         The stimuli are loaded lazy: each stimulus will be opened not
         before it is accessed. At creation time, all files are opened
         to read their dimensions, however the actual image data won't
-        be read.
+        be read. The headers are read in `n_jobs` threads and, with a
+        `metadata_index`, the shapes are stored in the index such that
+        the files don't have to be opened again as long as they don't change.
 
         .. note ::
 
             To calculate the stimulus_ids, the stimuli have to be
-            loaded. Therefore it might be a good idea to load all
-            stimuli and pickle the `FileStimuli` afterwarts. Then
-            the ids are pickled but the stimuli will be reloaded
-            when needed again.
+            loaded. Use a `metadata_index` to store the stimulus ids
+            for later runs and `compute_stimulus_ids` to compute
+            all of them at once in parallel.
 
         Parameters
         ----------
@@ -302,24 +631,27 @@ class FileStimuli(Stimuli):
             filenames of the stimuli
         cache : bool, defaults to True
             whether loaded stimuli should be cached. The cache is excluded from pickling.
+        cache_bytes : int or None, defaults to `FILE_STIMULI_CACHE_BYTES` (1 GiB)
+            maximal total size of the cached stimuli. The least recently used stimuli are
+            removed from the cache once it grows larger. `None` doesn't limit the cache size.
+        metadata_index : string or FileMetadataIndex, optional
+            index file in which the shapes and stimulus ids are stored once they have been computed
+            (see `pysaliency.datasets.metadata_index`).
+        n_jobs : int, optional
+            number of threads used to read the shapes of the stimuli (default: chosen by
+            `concurrent.futures.ThreadPoolExecutor`). Ignored if `shapes` are given.
         """
         self.filenames = filenames
-        self.stimuli = LazyList(self.load_stimulus, len(self.filenames), cache=cached)
+        if isinstance(metadata_index, (str, os.PathLike)):
+            metadata_index = FileMetadataIndex(metadata_index)
+        self.metadata_index = metadata_index
+        self.stimuli = LazyList(self.load_stimulus, len(self.filenames), cache=cached, cache_bytes=cache_bytes)
         if shapes is None:
-            self.shapes = []
-            for f in filenames:
-                img = Image.open(f)
-                size = img.size
-                if len(img.mode) > 1:
-                    # PIL uses (width, height), we use (height, width)
-                    self.shapes.append((size[1], size[0], len(img.mode)))
-                else:
-                    self.shapes.append((size[1], size[0]))
-                del img
+            self.shapes = self._read_shapes(n_jobs=n_jobs)
         else:
             self.shapes = shapes
 
-        self.stimulus_ids = LazyList(lambda n: get_image_hash(self.stimuli[n]),
+        self.stimulus_ids = LazyList(self._stimulus_id,
                                      length=len(self.stimuli),
                                      pickle_cache=True)
         self.stimulus_objects = [StimuliStimulus(self, n) for n in range(len(self.stimuli))]
@@ -333,32 +665,100 @@ class FileStimuli(Stimuli):
         else:
             self.attributes = {}
 
-    @property
-    def cached(self):
-        return self.stimuli.cache
-
-    @cached.setter
-    def cached(self, value):
-        self.stimuli.cache = value
+    def _read_shapes(self, n_jobs=None):
+        def _read_shape(filename):
+            # validating the index entry needs a stat of the file, hence it happens in the thread pool as well
+            if self.metadata_index is not None:
+                shape = self.metadata_index.get(filename, 'shape')
+                if shape is not None:
+                    return tuple(shape), False
+            return read_image_shape(filename), True
+
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(_read_shape, self.filenames))
+
+        shapes = [shape for shape, _ in results]
+
+        if self.metadata_index is not None:
+            self.metadata_index.update_many(
+                [(filename, {'shape': list(shape)}) for filename, (shape, is_new) in zip(self.filenames, results) if is_new],
+                n_jobs=n_jobs,
+            )
+
+        return shapes
+
+    def _stimulus_id(self, n):
+        if self.metadata_index is not None:
+            stimulus_id = self.metadata_index.get(self.filenames[n], 'stimulus_id')
+            if stimulus_id is not None:
+                return stimulus_id
+
+        stimulus_id = get_image_hash(self.stimuli[n])
+        if self.metadata_index is not None:
+            self.metadata_index.update(self.filenames[n], stimulus_id=stimulus_id)
+        return stimulus_id
+
+    def compute_stimulus_ids(self, n_jobs=None, verbose=False):
+        """ Compute all stimulus ids that are not known yet.
+
+        The missing stimuli are decoded in `n_jobs` threads (default: one per CPU)
+        without keeping them in the stimulus cache. With a `metadata_index`, ids stored
+        in the index are reused and new ids are stored in the index.
+        """
+        missing_indices = [n for n in range(len(self)) if n not in self.stimulus_ids._cache]
+
+        def _compute_stimulus_id(n):
+            # validating the index entry needs a stat of the file, hence it happens in the thread pool as well
+            if self.metadata_index is not None:
+                stimulus_id = self.metadata_index.get(self.filenames[n], 'stimulus_id')
+                if stimulus_id is not None:
+                    return stimulus_id, False
+            return get_image_hash(self.load_stimulus(n)), True
+
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(tqdm(executor.map(_compute_stimulus_id, missing_indices), total=len(missing_indices), disable=not verbose))
+
+        self.set_stimulus_ids({n: stimulus_id for n, (stimulus_id, _) in zip(missing_indices, results)})
+
+        if self.metadata_index is not None:
+            self.metadata_index.update_many(
+                [(self.filenames[n], {'stimulus_id': stimulus_id}) for n, (stimulus_id, is_new) in zip(missing_indices, results) if is_new],
+                n_jobs=n_jobs,
+            )
+
+    def load_stimulus(self, n, max_size=None):
+        """ Decode stimulus `n`.
+
+        If `max_size` is given, JPEG images are decoded at 1/2, 1/4 or 1/8 of their resolution
+        (see `PIL.Image.Image.draft`), as long as their larger side stays at least `max_size` pixels.
+        This is considerably faster for callers which downscale the image anyway. Other images
+        are decoded at full resolution.
+        """
+        if max_size is not None:
+            with Image.open(self.filenames[n]) as img:
+                width, height = img.size
+                if img.format == 'JPEG' and img.mode in ['L', 'RGB'] and max_size < max(width, height):
+                    factor = max_size / max(width, height)
+                    img.draft(img.mode, (int(np.ceil(width * factor)), int(np.ceil(height * factor))))
+                    return np.asarray(img)
 
-    def load_stimulus(self, n):
         return imread(self.filenames[n])
 
-    def __getitem__(self, index):
-        if isinstance(index, slice):
-            index = list(range(len(self)))[index]
-
-        if isinstance(index, (list, np.ndarray)):
-            index = np.asarray(index)
-            if index.dtype == bool:
-                if not len(index) == len(self.stimuli):
-                    raise ValueError(f"Boolean index has to have the same length as the stimuli list but got {len(index)} and {len(self.stimuli)}")
-                index = np.nonzero(index)[0]
+    def downscaled_stimulus(self, n, max_size):
+        if n in self.stimuli._cache:
+            # decoded at full resolution already
+            return self.stimuli[n]
+        return self.load_stimulus(n, max_size=max_size)
 
+    def __getitem__(self, index):
+        subset_indices = self._subset_indices(index)
+        if subset_indices is not None:
+            index = subset_indices
             filenames = [self.filenames[i] for i in index]
             shapes = [self.shapes[i] for i in index]
             attributes = self._get_attribute_for_stimulus_subset(index)
-            sub_stimuli = type(self)(filenames=filenames, shapes=shapes, attributes=attributes, cached=self.cached)
+            sub_stimuli = type(self)(filenames=filenames, shapes=shapes, attributes=attributes, cached=self.cached,
+                                     metadata_index=self.metadata_index, cache_bytes=self.cache_bytes)
 
             # populate stimulus_id cache with existing entries
             self._propagate_stimulus_ids(sub_stimuli, index)
@@ -406,8 +806,14 @@ class FileStimuli(Stimuli):
 
     @classmethod
     @hdf5_wrapper(mode='r')
-    def read_hdf5(cls, source, cached=True):
-        """ Read FileStimuli from hdf5 file or hdf5 group """
+    def read_hdf5(cls, source, cached=True, metadata_index=None, cache_bytes=FILE_STIMULI_CACHE_BYTES):
+        """ Read FileStimuli from hdf5 file or hdf5 group
+
+        If `metadata_index` is True, the stimulus ids are stored in an index file next
+        to the hdf5 file (`<hdf5 filename>.index.jsonl`) once they have been computed,
+        such that later runs don't have to decode the stimuli to compute them. It can
+        also be the filename of the index or a `FileMetadataIndex`.
+        """
 
         data_type = decode_string(source.attrs['type'])
         data_version = decode_string(source.attrs['version'])
@@ -432,11 +838,149 @@ class FileStimuli(Stimuli):
 
         __attributes__, attributes = cls._get_attributes_from_hdf5(source, data_version, '2.1')
 
-        stimuli = cls(filenames=filenames, cached=cached, shapes=shapes, attributes=attributes)
+        if metadata_index is True:
+            metadata_index = source.file.filename + '.index.jsonl'
+        elif metadata_index is False:
+            metadata_index = None
+
+        stimuli = cls(filenames=filenames, cached=cached, shapes=shapes, attributes=attributes, metadata_index=metadata_index,
+                      cache_bytes=cache_bytes)
 
         return stimuli
 
 
+class _HDF5File(object):
+    """ an hdf5 file which is opened for reading when it is first needed and opened again in other processes """
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        with self._lock:
+            if self._file is None or self._pid != os.getpid():
+                # hdf5 files must not be shared between processes
+                import h5py
+                self._file = h5py.File(self.filename, 'r')
+                self._pid = os.getpid()
+            return self._file
+
+    def close(self):
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._file.close()
+            self._file = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            # e.g. during interpreter shutdown
+            pass
+
+    def __getstate__(self):
+        # the hdf5 file is opened again by the receiving process
+        return {'filename': self.filename}
+
+    def __setstate__(self, state):
+        self.__init__(state['filename'])
+
+
+class HDF5Stimuli(LazyStimuliMixin, Stimuli):
+    """
+    Manage a list of stimuli that are saved in an hdf5 file by `Stimuli.to_hdf5`.
+
+    Only the shapes and attributes of the stimuli are read when the object is
+    created, the stimuli are read from the file only when they are accessed and
+    cached up to a total size of `cache_bytes` as in `FileStimuli`. The hdf5 file is
+    kept open and opened again in other processes (e.g. after forking or unpickling).
+    """
+    def __init__(self, filename, group='/', dataset_names=None, shapes=None, attributes=None, cached=True,
+                 cache_bytes=FILE_STIMULI_CACHE_BYTES):
+        """
+        Parameters
+        ----------
+        filename : string
+            hdf5 file
+        group : string, defaults to '/'
+            hdf5 group in which the stimuli are stored
+        dataset_names, shapes, attributes : optional
+            names of the hdf5 datasets of the stimuli, their shapes and the attributes of the
+            stimuli. Read from the hdf5 group if not given.
+        cached : bool, defaults to True
+            whether loaded stimuli should be cached. The cache is excluded from pickling.
+        cache_bytes : int or None, defaults to `FILE_STIMULI_CACHE_BYTES` (1 GiB)
+            maximal total size of the cached stimuli, see `FileStimuli`.
+        """
+        self.filename = os.path.abspath(filename)
+        self.group = group
+        self._file = _HDF5File(self.filename)
+
+        if dataset_names is None:
+            dataset_names = [str(n) for n in range(self._source().attrs['size'])]
+        self.dataset_names = list(dataset_names)
+
+        if shapes is None:
+            source = self._source()
+            shapes = [source[name].shape for name in self.dataset_names]
+        self.shapes = [tuple(shape) for shape in shapes]
+
+        if attributes is None:
+            source = self._source()
+            data_version = decode_string(source.attrs['version'])
+            __attributes__, attributes = self._get_attributes_from_hdf5(source, data_version, '1.1')
+
+        self.stimuli = LazyList(self.load_stimulus, len(self.dataset_names), cache=cached, cache_bytes=cache_bytes)
+        self.sizes = LazyList(lambda n: (self.shapes[n][0], self.shapes[n][1]),
+                              length=len(self.stimuli))
+        self.stimulus_ids = LazyList(lambda n: get_image_hash(self._load_cached_stimulus(n)),
+                                     length=len(self.stimuli),
+                                     pickle_cache=True)
+        self.stimulus_objects = [StimuliStimulus(self, n) for n in range(len(self.stimuli))]
+
+        self.attributes = attributes
+        self.__attributes__ = list(attributes.keys())
+
+    def _source(self):
+        return self._file.open()[self.group]
+
+    def load_stimulus(self, n):
+        return self._source()[self.dataset_names[n]][...]
+
+    def close(self):
+        """ Close the hdf5 file, also for all subsets of these stimuli. It is opened again once another stimulus is accessed. """
+        self._file.close()
+
+    def __getitem__(self, index):
+        subset_indices = self._subset_indices(index)
+        if subset_indices is not None:
+            index = subset_indices
+            sub_stimuli = type(self)(
+                self.filename,
+                group=self.group,
+                dataset_names=[self.dataset_names[i] for i in index],
+                shapes=[self.shapes[i] for i in index],
+                attributes=self._get_attribute_for_stimulus_subset(index),
+                cached=self.cached,
+                cache_bytes=self.cache_bytes,
+            )
+            # subsets read from the same open file
+            sub_stimuli._file = self._file
+
+            # populate stimulus_id cache with existing entries
+            self._propagate_stimulus_ids(sub_stimuli, index)
+
+            return sub_stimuli
+        else:
+            return self.stimulus_objects[index]
+
+    @classmethod
+    def read_hdf5(cls, source):
+        """ Read lazy stimuli from hdf5 file or hdf5 group written by `Stimuli.to_hdf5` """
+        return Stimuli.read_hdf5(source, lazy=True)
+
+
 def check_prediction_shape(prediction: np.ndarray, stimulus: Union[np.ndarray, Stimulus]):
     stimulus = as_stimulus(stimulus)
 
@@ -0,0 +1,557 @@
+"""
+Evaluating models on several metrics in a single pass over the stimuli.
+
+Besides `evaluate`, which returns the values of all metrics for each fixation and stimulus,
+`accumulate` returns mergeable partial aggregates (accumulators) of the metrics. Accumulators
+can be computed on shards of the stimuli, e.g. on different machines, pickled and merged with `+`.
+Their size only depends on the number of stimuli of the shard, not on the number of fixations.
+The merged accumulator results in the same values (up to rounding) as the metric methods on all stimuli:
+
+    accumulators = [accumulate_shard(model, stimuli, fixations, start, stop) for start, stop in shards]
+    merged = merge_accumulators(accumulators)
+    merged['NSS'].value(average='image')  # == model.NSS(stimuli, fixations, average='image')
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+from tqdm import tqdm
+
+from .datasets import Fixations, check_prediction_shape
+from .metrics import CC, NSS, SIM, convert_saliency_map_to_density, probabilistic_image_based_kl_divergence
+from .models import Model, UniformModel
+from .parallel import fixations_for_shard, map_shards, prefetch, stimuli_for_shard, stimulus_shards, use_parallel_evaluation
+from .roc import general_rocs_per_positive_sorted
+from .saliency_map_models import FullShuffledNonfixationProvider, SaliencyMapModel
+
+
+FIXATION_METRICS = ['AUC', 'sAUC', 'NSS', 'LL', 'IG']
+IMAGE_METRICS = ['CC', 'KLDiv', 'SIM']
+DATASET_METRICS = ['FixationKLDiv']
+PROBABILISTIC_METRICS = ['LL', 'IG']
+
+
+def _saliency_map(model, stimulus, log_density=None):
+    if isinstance(model, SaliencyMapModel):
+        return model.saliency_map(stimulus)
+    if log_density is None:
+        log_density = model.log_density(stimulus)
+    return np.exp(log_density)
+
+
+def _sorted_saliency_values(model, stimulus, saliency_map):
+    if isinstance(model, SaliencyMapModel):
+        return model._sorted_saliency_values(stimulus, saliency_map)
+    return np.sort(saliency_map.astype(float), axis=None)
+
+
+def _default_metrics(model, gold_standard):
+    metrics = ['AUC', 'sAUC', 'NSS']
+    if isinstance(model, Model):
+        metrics += PROBABILISTIC_METRICS
+    if gold_standard is not None:
+        metrics += IMAGE_METRICS
+    return metrics
+
+
+def _check_metrics(model, metrics, gold_standard, available_metrics):
+    for metric in metrics:
+        if metric not in available_metrics:
+            raise ValueError("Unknown metric {}".format(metric))
+        if metric in PROBABILISTIC_METRICS and not isinstance(model, Model):
+            raise ValueError("Metric {} requires a probabilistic model".format(metric))
+        if metric in IMAGE_METRICS and gold_standard is None:
+            raise ValueError("Metric {} requires a gold standard".format(metric))
+
+
+def _compute_values(model, stimuli, fixations, metrics, gold_standard, baseline_model, kl_minimum_value,
+                    shuffled_nonfixations, fixation_kl_nonfixations, verbose, fixation_kl_bins=10, fixation_kl_range=None):
+    """ compute the values of all metrics in one pass over the stimuli
+
+    returns the values of the fixation metrics for each fixation, the values of the image metrics
+    for each stimulus and the histograms of the saliency values at fixations and nonfixations needed
+    for 'FixationKLDiv' (or None) with `fixation_kl_bins` bins in the range `fixation_kl_range`
+    (by default the range of all saliency maps).
+    """
+    fixation_metrics = [metric for metric in metrics if metric in FIXATION_METRICS]
+    image_metrics = [metric for metric in metrics if metric in IMAGE_METRICS]
+    needs_saliency_map = any(metric not in PROBABILISTIC_METRICS for metric in metrics)
+    fixation_kl = 'FixationKLDiv' in metrics
+
+    if 'IG' in metrics and baseline_model is None:
+        baseline_model = UniformModel()
+
+    if shuffled_nonfixations is None:
+        shuffled_nonfixations = _full_shuffled_nonfixations(stimuli, fixations, metrics, fixation_kl_nonfixations)
+
+    fixation_values = {metric: np.full(len(fixations.x), np.nan) for metric in fixation_metrics}
+    image_values = {metric: np.full(len(stimuli), np.nan) for metric in image_metrics}
+    fixation_kl_values = None
+    if fixation_kl:
+        fixation_kl_values = _FixationKLHistograms(fixation_kl_bins, fixation_kl_range)
+        if isinstance(fixation_kl_nonfixations, Fixations):
+            nonfixation_indices = fixation_kl_nonfixations.fixation_indices_by_stimulus
+            nonfixations_x_int = fixation_kl_nonfixations.x_int
+            nonfixations_y_int = fixation_kl_nonfixations.y_int
+        elif fixation_kl_nonfixations not in ['uniform', 'shuffled']:
+            raise ValueError("Unknown nonfixations {}".format(fixation_kl_nonfixations))
+
+    fixation_indices = fixations.fixation_indices_by_stimulus
+    fixations_x_int = fixations.x_int
+    fixations_y_int = fixations.y_int
+
+    def _predictions(n, stimulus):
+        log_density = saliency_map = baseline_log_density = gold_saliency_map = None
+        if isinstance(model, Model):
+            log_density = model.log_density(stimulus)
+        if needs_saliency_map:
+            saliency_map = _saliency_map(model, stimulus, log_density=log_density)
+        if 'IG' in fixation_metrics and len(fixation_indices[n]):
+            baseline_log_density = baseline_model.log_density(stimulus)
+        if image_metrics:
+            gold_saliency_map = _saliency_map(gold_standard, stimulus)
+        return log_density, saliency_map, baseline_log_density, gold_saliency_map
+
+    indices = [n for n in range(len(stimuli)) if len(fixation_indices[n]) or image_metrics or fixation_kl]
+
+    def _prefetched_predictions():
+        with stimuli.stimulus_loader(indices) as stimulus_loader:
+            predictions = prefetch(lambda position: _predictions(indices[position], stimulus_loader[position]), range(len(indices)))
+            yield from zip(indices, predictions)
+
+    predictions = _prefetched_predictions()
+
+    for n, (log_density, saliency_map, baseline_log_density, gold_saliency_map) in tqdm(predictions, total=len(indices), disable=not verbose):
+        inds = fixation_indices[n]
+        stimulus = stimuli.stimulus_objects[n]
+        xs = fixations_x_int[inds]
+        ys = fixations_y_int[inds]
+
+        if log_density is not None:
+            check_prediction_shape(log_density, stimuli[n])
+
+        if needs_saliency_map:
+            check_prediction_shape(saliency_map, stimuli[n])
+
+        if len(inds):
+            if 'AUC' in fixation_metrics or 'sAUC' in fixation_metrics:
+                positives = np.asarray(saliency_map[ys, xs]).astype(float)
+            if 'AUC' in fixation_metrics:
+                sorted_negatives = _sorted_saliency_values(model, stimulus, saliency_map)
+                fixation_values['AUC'][inds] = general_rocs_per_positive_sorted(positives, sorted_negatives)
+            if 'sAUC' in fixation_metrics:
+                fixation_values['sAUC'][inds] = shuffled_nonfixations.rocs_per_positive(saliency_map, n, positives)
+            if 'NSS' in fixation_metrics:
+                fixation_values['NSS'][inds] = NSS(saliency_map, xs, ys)
+            if 'LL' in fixation_metrics or 'IG' in fixation_metrics:
+                log_likelihoods = log_density[ys, xs]
+            if 'LL' in fixation_metrics:
+                fixation_values['LL'][inds] = log_likelihoods
+            if 'IG' in fixation_metrics:
+                check_prediction_shape(baseline_log_density, stimuli[n])
+                fixation_values['IG'][inds] = (log_likelihoods - baseline_log_density[ys, xs]) / np.log(2)
+
+        if image_metrics:
+            check_prediction_shape(gold_saliency_map, stimuli[n])
+
+            if 'CC' in image_metrics:
+                image_values['CC'][n] = CC(saliency_map, gold_saliency_map)
+            if 'KLDiv' in image_metrics:
+                image_values['KLDiv'][n] = probabilistic_image_based_kl_divergence(
+                    np.log(convert_saliency_map_to_density(saliency_map, minimum_value=kl_minimum_value)),
+                    np.log(convert_saliency_map_to_density(gold_saliency_map, minimum_value=kl_minimum_value)),
+                )
+            if 'SIM' in image_metrics:
+                image_values['SIM'][n] = SIM(saliency_map, gold_saliency_map)
+
+        if fixation_kl:
+            # as in `SaliencyMapModel.fixation_based_KL_divergence`
+            if isinstance(fixation_kl_nonfixations, Fixations):
+                nonfix_inds = nonfixation_indices[n]
+                nonfixation_values = saliency_map[nonfixations_y_int[nonfix_inds], nonfixations_x_int[nonfix_inds]]
+            elif fixation_kl_nonfixations == 'uniform':
+                nonfixation_values = saliency_map.flatten()
+            else:
+                nonfixation_values = shuffled_nonfixations.negative_values(saliency_map, n)
+            fixation_kl_values.add(saliency_map, saliency_map[ys, xs], nonfixation_values)
+
+    if fixation_kl:
+        fixation_kl_values = fixation_kl_values.histograms()
+
+    return fixation_values, image_values, fixation_kl_values
+
+
+class _FixationKLHistograms(object):
+    """ histograms of the saliency values at fixations and nonfixations for the fixation based KL divergence
+
+    With a given `hist_range`, the values of each stimulus are added to the histograms right away. Otherwise
+    the range of the saliency maps is known only after all stimuli have been seen and the values are kept
+    until `histograms` is called.
+    """
+    def __init__(self, bins, hist_range=None):
+        self.bins = bins
+        self.hist_range = hist_range
+        self.saliency_min = np.inf
+        self.saliency_max = -np.inf
+        self.fixation_counts = np.zeros(bins, dtype=int)
+        self.nonfixation_counts = np.zeros(bins, dtype=int)
+        self.fixation_values = []
+        self.nonfixation_values = []
+
+    def _histogram(self, values, hist_range):
+        return np.histogram(values, bins=self.bins, range=hist_range)[0]
+
+    def add(self, saliency_map, fixation_values, nonfixation_values):
+        self.saliency_min = min(self.saliency_min, saliency_map.min())
+        self.saliency_max = max(self.saliency_max, saliency_map.max())
+        if self.hist_range is None:
+            self.fixation_values.append(fixation_values)
+            self.nonfixation_values.append(nonfixation_values)
+        else:
+            self.fixation_counts += self._histogram(fixation_values, self.hist_range)
+            self.nonfixation_counts += self._histogram(nonfixation_values, self.hist_range)
+
+    def histograms(self):
+        """ returns the histogram range and the histograms of the fixation and nonfixation values """
+        if self.hist_range is None:
+            hist_range = self.saliency_min, self.saliency_max
+            return (hist_range, self._histogram(np.hstack(self.fixation_values), hist_range),
+                    self._histogram(np.hstack(self.nonfixation_values), hist_range))
+        return self.hist_range, self.fixation_counts, self.nonfixation_counts
+
+
+def evaluate(model, stimuli, fixations, metrics=None, gold_standard=None, baseline_model=None,
+             kl_minimum_value=1e-20, verbose=False):
+    """ Evaluate a model on several metrics while loading each prediction only once.
+
+    Calling the metric methods of a model one after another loads or computes the prediction
+    for each stimulus once for every metric. This function iterates over the stimuli once and
+    computes all requested metrics from the same prediction. The results are identical
+    to the results of the respective metric methods:
+
+        'AUC': `SaliencyMapModel.AUCs` with uniform nonfixations
+        'sAUC': `SaliencyMapModel.AUCs` with shuffled nonfixations
+        'NSS': `SaliencyMapModel.NSSs`
+        'LL': `Model.log_likelihoods`
+        'IG': `Model.information_gains` with respect to `baseline_model`
+        'CC': `SaliencyMapModel.CCs` with respect to `gold_standard`
+        'KLDiv': `SaliencyMapModel.image_based_kl_divergences` with respect to `gold_standard`
+        'SIM': `SaliencyMapModel.SIMs` with respect to `gold_standard`
+
+    `model` can be a `SaliencyMapModel` or a `Model`. For a `Model`, the saliency map based
+    metrics use the predicted fixation density as saliency map (as `DensitySaliencyMapModel` does).
+    'LL' and 'IG' are only available for instances of `Model`. The same applies to `gold_standard`.
+
+    :type metrics : list of strings
+    :param metrics : The metrics to compute. By default, 'AUC', 'sAUC' and 'NSS', additionally 'LL' and 'IG'
+                     if `model` is a `Model` and 'CC', 'KLDiv' and 'SIM' if a `gold_standard` is given.
+
+    :type baseline_model : Model
+    :param baseline_model : Baseline for the information gain, by default `UniformModel()`.
+
+    :type kl_minimum_value : float
+    :param kl_minimum_value : `minimum_value` for 'KLDiv', see `SaliencyMapModel.image_based_kl_divergences`.
+
+    :rtype : tuple of two pandas DataFrames
+    :return : `(per_fixation, per_image)`. `per_fixation` contains one row for each fixation with the
+              stimulus index `n`, the subject (if known) and the values of all fixation based metrics.
+              `per_image` contains one row for each stimulus with the values of all image based metrics
+              and the average of all fixation based metrics over the fixations on this stimulus
+              (`NaN` for stimuli without fixations).
+    """
+    import pandas as pd
+
+    if metrics is None:
+        metrics = _default_metrics(model, gold_standard)
+
+    _check_metrics(model, metrics, gold_standard, FIXATION_METRICS + IMAGE_METRICS)
+
+    fixation_metrics = [metric for metric in metrics if metric in FIXATION_METRICS]
+    image_metrics = [metric for metric in metrics if metric in IMAGE_METRICS]
+
+    fixation_values, image_values, _ = _compute_values(
+        model, stimuli, fixations, metrics, gold_standard=gold_standard, baseline_model=baseline_model,
+        kl_minimum_value=kl_minimum_value, shuffled_nonfixations=None, fixation_kl_nonfixations=None,
+        verbose=verbose,
+    )
+
+    per_fixation = pd.DataFrame({'n': np.asarray(fixations.n)})
+    if fixations.subject is not None:
+        per_fixation['subject'] = np.asarray(fixations.subject)
+    for metric in fixation_metrics:
+        per_fixation[metric] = fixation_values[metric]
+
+    per_image = pd.DataFrame(image_values, index=pd.RangeIndex(len(stimuli), name='n'), columns=image_metrics)
+    if fixation_metrics:
+        image_averages = per_fixation.groupby('n')[fixation_metrics].mean()
+        per_image = per_image.join(image_averages.reindex(per_image.index))
+
+    return per_fixation, per_image
+
+
+class MetricAccumulator(object):
+    """ Partial aggregate of a metric on a shard of the stimuli, see `accumulate`.
+
+    Accumulators of different shards are merged with `+` (or `sum`), the value of the metric
+    is computed from the merged state with `value`.
+    """
+    def _check_compatible(self, other):
+        return type(other) is type(self)
+
+    def __radd__(self, other):
+        # allows to use `sum` on lists of accumulators
+        if isinstance(other, int) and other == 0:
+            return self
+        return NotImplemented
+
+
+def _check_unique(keys, name):
+    if len(np.unique(keys)) != len(keys):
+        raise ValueError("Merged accumulators contain some {} more than once, are the shards overlapping?".format(name))
+
+
+class FixationMetricAccumulator(MetricAccumulator):
+    """ Accumulator of a metric with one value per fixation ('AUC', 'sAUC', 'NSS', 'LL', 'IG').
+
+    Stores the sum and the number of the values of the fixations on each stimulus together with the
+    (global) index `n` of the stimulus, which allows to average over fixations and over stimuli.
+    """
+    def __init__(self, n, sums, counts):
+        self.n = np.asarray(n)
+        self.sums = np.asarray(sums, dtype=float)
+        self.counts = np.asarray(counts, dtype=int)
+        if not len(self.n) == len(self.sums) == len(self.counts):
+            raise ValueError("n, sums and counts must have the same length")
+
+    @classmethod
+    def from_values(cls, values, fixation_ns, stimulus_ns):
+        """ accumulate the values of fixations on the stimuli with indices `fixation_ns` (indices into `stimulus_ns`) """
+        sums = np.bincount(fixation_ns, weights=values, minlength=len(stimulus_ns))
+        counts = np.bincount(fixation_ns, minlength=len(stimulus_ns))
+        return cls(stimulus_ns, sums, counts)
+
+    def __add__(self, other):
+        if not self._check_compatible(other):
+            return NotImplemented
+        return FixationMetricAccumulator(
+            np.concatenate((self.n, other.n)),
+            np.concatenate((self.sums, other.sums)),
+            np.concatenate((self.counts, other.counts)),
+        )
+
+    def value(self, average='fixation'):
+        """ average over all fixations ('fixation') or over stimuli ('image'), see `average_values` """
+        _check_unique(self.n, 'stimuli')
+        if average == 'fixation':
+            return self.sums.sum() / self.counts.sum()
+        elif average == 'image':
+            fixated = self.counts > 0
+            return np.mean(self.sums[fixated] / self.counts[fixated])
+        else:
+            raise ValueError(average)
+
+
+class ImageMetricAccumulator(MetricAccumulator):
+    """ Accumulator of a metric with one value per stimulus ('CC', 'KLDiv', 'SIM').
+
+    Only `average='image'` is supported.
+    """
+    def __init__(self, values, n):
+        self.values = np.asarray(values)
+        self.n = np.asarray(n)
+        if not len(self.values) == len(self.n):
+            raise ValueError("values and n must have the same length")
+
+    def __add__(self, other):
+        if not self._check_compatible(other):
+            return NotImplemented
+        return ImageMetricAccumulator(
+            np.concatenate((self.values, other.values)),
+            np.concatenate((self.n, other.n)),
+        )
+
+    def value(self, average='image'):
+        """ average over all stimuli """
+        if average != 'image':
+            raise ValueError("Image based metrics can only be averaged over images, got {}".format(average))
+        _check_unique(self.n, 'stimuli')
+        order = np.argsort(self.n, kind='stable')
+        return np.mean(self.values[order])
+
+
+class FixationKLDivergenceAccumulator(MetricAccumulator):
+    """ Accumulator of the fixation based KL divergence ('FixationKLDiv').
+
+    Stores the histograms of the saliency values at fixations and nonfixations in the range `hist_range`.
+    Only accumulators with the same histogram range can be merged: for shards of a dataset, the range has to be
+    given to `accumulate` as `fixation_kl_range`, otherwise each shard uses the range of its own saliency maps.
+    """
+    def __init__(self, fixation_counts, nonfixation_counts, hist_range, eps=1e-20):
+        self.fixation_counts = np.asarray(fixation_counts)
+        self.nonfixation_counts = np.asarray(nonfixation_counts)
+        self.hist_range = tuple(hist_range)
+        self.eps = eps
+        if not len(self.fixation_counts) == len(self.nonfixation_counts):
+            raise ValueError("fixation_counts and nonfixation_counts must have the same number of bins")
+
+    @property
+    def bins(self):
+        return len(self.fixation_counts)
+
+    def _check_compatible(self, other):
+        if not super(FixationKLDivergenceAccumulator, self)._check_compatible(other):
+            return False
+        if (self.bins, self.hist_range, self.eps) != (other.bins, other.hist_range, other.eps):
+            raise ValueError("Only accumulators with the same bins, histogram range and eps can be merged, got {} and {}."
+                             " Use `fixation_kl_range` to accumulate shards with the same histogram range.".format(
+                                 (self.bins, self.hist_range, self.eps), (other.bins, other.hist_range, other.eps)))
+        return True
+
+    def __add__(self, other):
+        if not self._check_compatible(other):
+            return NotImplemented
+        return FixationKLDivergenceAccumulator(
+            self.fixation_counts + other.fixation_counts,
+            self.nonfixation_counts + other.nonfixation_counts,
+            self.hist_range, eps=self.eps,
+        )
+
+    def _density(self, counts):
+        # as `np.histogram(..., density=True)`
+        _, bin_edges = np.histogram([], bins=self.bins, range=self.hist_range)
+        return counts / np.array(np.diff(bin_edges), float) / counts.sum()
+
+    def value(self, average='fixation'):
+        """ the fixation based KL divergence, see `SaliencyMapModel.fixation_based_KL_divergence` """
+        if average != 'fixation':
+            raise ValueError("The fixation based KL divergence can only be averaged over fixations, got {}".format(average))
+
+        p_fix = self._density(self.fixation_counts)
+        p_fix += self.eps
+        p_fix /= p_fix.sum()
+        p_nonfix = self._density(self.nonfixation_counts)
+        p_nonfix += self.eps
+        p_nonfix /= p_nonfix.sum()
+
+        return (p_fix * (np.log(p_fix) - np.log(p_nonfix))).sum()
+
+
+def accumulate(model, stimuli, fixations, metrics=None, gold_standard=None, baseline_model=None,
+               kl_minimum_value=1e-20, fixation_kl_nonfixations='shuffled', fixation_kl_bins=10, fixation_kl_eps=1e-20,
+               fixation_kl_range=None, stimulus_offset=0, shuffled_nonfixations=None, verbose=False, n_jobs=None):
+    """ Compute mergeable accumulators of several metrics, see `MetricAccumulator`.
+
+    The metrics are computed in one pass over the stimuli as in `evaluate`. Additionally to the metrics of
+    `evaluate`, 'FixationKLDiv' (`SaliencyMapModel.fixation_based_KL_divergence` with the nonfixations
+    `fixation_kl_nonfixations`, `fixation_kl_bins` bins and `fixation_kl_eps`) is available. Its histograms
+    cover the range of the saliency maps of `stimuli`, unless a range is given as `fixation_kl_range`.
+
+    To compute accumulators on a shard of a dataset, either use `accumulate_shard` or pass the stimuli and
+    fixations of the shard together with `stimulus_offset`, the index of the first stimulus of the shard in
+    the dataset. For shuffled nonfixations, the shuffled nonfixations of the full dataset have to be passed
+    as `shuffled_nonfixations` (see `FullShuffledNonfixationProvider.for_shard`). To merge the 'FixationKLDiv'
+    accumulators of several shards, all shards need the same `fixation_kl_range`, e.g. the range of the
+    saliency maps of the full dataset.
+
+    :type n_jobs : int or concurrent.futures.Executor
+    :param n_jobs : If given, the stimuli are split into shards which are accumulated in parallel worker
+                    processes (see `pysaliency.parallel`) and merged. 'FixationKLDiv' then requires `fixation_kl_range`.
+
+    :rtype : dict
+    :return : the accumulator of each metric. `accumulators[metric].value(average=...)` results in the same
+              value (up to rounding) as the metric method of `model` with the same `average`.
+    """
+    if metrics is None:
+        metrics = _default_metrics(model, gold_standard)
+
+    _check_metrics(model, metrics, gold_standard, FIXATION_METRICS + IMAGE_METRICS + DATASET_METRICS)
+
+    kwargs = dict(
+        metrics=metrics, gold_standard=gold_standard, baseline_model=baseline_model, kl_minimum_value=kl_minimum_value,
+        fixation_kl_nonfixations=fixation_kl_nonfixations, fixation_kl_bins=fixation_kl_bins, fixation_kl_eps=fixation_kl_eps,
+        fixation_kl_range=fixation_kl_range,
+    )
+
+    if use_parallel_evaluation(n_jobs):
+        if stimulus_offset or shuffled_nonfixations is not None:
+            raise ValueError("n_jobs is only supported for accumulating the full dataset")
+        if 'FixationKLDiv' in metrics and fixation_kl_range is None:
+            raise ValueError("Accumulating 'FixationKLDiv' with n_jobs requires fixation_kl_range")
+        shuffled_nonfixations = _full_shuffled_nonfixations(stimuli, fixations, metrics, fixation_kl_nonfixations)
+        shard_arguments = [_shard_arguments(model, stimuli, fixations, start, stop, shuffled_nonfixations, **kwargs)
+                           for start, stop in stimulus_shards(len(stimuli), n_jobs)]
+        return merge_accumulators(map_shards(accumulate, shard_arguments, n_jobs=n_jobs, verbose=verbose))
+
+    fixation_values, image_values, fixation_kl_values = _compute_values(
+        model, stimuli, fixations, metrics, gold_standard=gold_standard, baseline_model=baseline_model,
+        kl_minimum_value=kl_minimum_value, shuffled_nonfixations=shuffled_nonfixations,
+        fixation_kl_nonfixations=fixation_kl_nonfixations, verbose=verbose,
+        fixation_kl_bins=fixation_kl_bins, fixation_kl_range=fixation_kl_range,
+    )
+
+    fixation_ns = np.asarray(fixations.n, dtype=int)
+    stimulus_ns = np.arange(len(stimuli)) + stimulus_offset
+
+    accumulators = {}
+    for metric, values in fixation_values.items():
+        accumulators[metric] = FixationMetricAccumulator.from_values(values, fixation_ns, stimulus_ns)
+    for metric, values in image_values.items():
+        accumulators[metric] = ImageMetricAccumulator(values, stimulus_ns)
+    if fixation_kl_values is not None:
+        hist_range, fixation_counts, nonfixation_counts = fixation_kl_values
+        accumulators['FixationKLDiv'] = FixationKLDivergenceAccumulator(
+            fixation_counts, nonfixation_counts, hist_range, eps=fixation_kl_eps,
+        )
+
+    return accumulators
+
+
+def merge_accumulators(accumulators):
+    """ merge the accumulators of several shards as returned by `accumulate` """
+    accumulators = list(accumulators)
+    return {metric: sum(shard_accumulators[metric] for shard_accumulators in accumulators) for metric in accumulators[0]}
+
+
+def _uses_shuffled_nonfixations(metrics, fixation_kl_nonfixations):
+    return 'sAUC' in metrics or ('FixationKLDiv' in metrics and isinstance(fixation_kl_nonfixations, str)
+                                 and fixation_kl_nonfixations == 'shuffled')
+
+
+def _full_shuffled_nonfixations(stimuli, fixations, metrics, fixation_kl_nonfixations):
+    if _uses_shuffled_nonfixations(metrics, fixation_kl_nonfixations):
+        return FullShuffledNonfixationProvider(stimuli, fixations)
+    return None
+
+
+def _shard_arguments(model, stimuli, fixations, start, stop, shuffled_nonfixations, metrics,
+                     fixation_kl_nonfixations='shuffled', **kwargs):
+    if shuffled_nonfixations is not None:
+        shuffled_nonfixations = shuffled_nonfixations.for_shard(start)
+
+    if isinstance(fixation_kl_nonfixations, Fixations):
+        fixation_kl_nonfixations = fixations_for_shard(fixation_kl_nonfixations, start, stop)
+
+    shard_kwargs = dict(
+        kwargs,
+        metrics=metrics,
+        fixation_kl_nonfixations=fixation_kl_nonfixations,
+        stimulus_offset=start,
+        shuffled_nonfixations=shuffled_nonfixations,
+    )
+
+    return (model, stimuli_for_shard(stimuli, start, stop), fixations_for_shard(fixations, start, stop)), shard_kwargs
+
+
+def accumulate_shard(model, stimuli, fixations, start, stop, **kwargs):
+    """ Compute the accumulators of the stimuli with indices `start` to `stop` of a dataset, see `accumulate`.
+
+    `stimuli` and `fixations` are the full dataset. Only the predictions for the stimuli of the shard
+    are computed, but shuffled nonfixations are taken from all fixations.
+    """
+    metrics = kwargs.pop('metrics', None)
+    if metrics is None:
+        metrics = _default_metrics(model, kwargs.get('gold_standard'))
+    shuffled_nonfixations = _full_shuffled_nonfixations(stimuli, fixations, metrics, kwargs.get('fixation_kl_nonfixations', 'shuffled'))
+
+    args, shard_kwargs = _shard_arguments(model, stimuli, fixations, start, stop, shuffled_nonfixations, metrics, **kwargs)
+    return accumulate(*args, **shard_kwargs)
@@ -2,6 +2,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 from abc import ABCMeta, abstractmethod
 
+from functools import partial
 from itertools import combinations
 
 from boltons.cacheutils import LRU
@@ -10,7 +11,7 @@ from scipy.ndimage import zoom
 from scipy.special import logsumexp
 from tqdm import tqdm
 
-from .saliency_map_models import (SaliencyMapModel, ScanpathSaliencyMapModel, handle_stimulus,
+from .saliency_map_models import (FingerprintMixin, SaliencyMapModel, ScanpathSaliencyMapModel, handle_stimulus,
                                   SubjectDependentSaliencyMapModel,
                                   DensitySaliencyMapModel,
                                   DisjointUnionMixin,
@@ -18,6 +19,7 @@ from .saliency_map_models import (SaliencyMapModel, ScanpathSaliencyMapModel, ha
                                   )
 from .datasets import Scanpaths, ScanpathFixations, check_prediction_shape, get_image_hash, as_stimulus
 from .metrics import probabilistic_image_based_kl_divergence, convert_saliency_map_to_density
+from .parallel import evaluate_fixation_metric, evaluate_stimulus_metric, prefetch_predictions, use_parallel_evaluation
 from .sampling_models import SamplingModelMixin
 from .utils import Cache, average_values, deprecated_class, remove_trailing_nans, iterator_chunks
 
@@ -126,7 +128,7 @@ def sample_from_image(densities, count=None, rst=None):
         return np.asarray(sample_xs), np.asarray(sample_ys)
 
 
-class ScanpathModel(SamplingModelMixin, object, metaclass=ABCMeta):
+class ScanpathModel(FingerprintMixin, SamplingModelMixin, metaclass=ABCMeta):
     """
     General probabilistic saliency model.
 
@@ -151,7 +153,10 @@ class ScanpathModel(SamplingModelMixin, object, metaclass=ABCMeta):
         """ returns conditional log density predictions for each fixation """
         return [self.conditional_log_density_for_fixation(stimuli, fixations, fixation_index) for fixation_index in tqdm(range(len(fixations)), disable=not verbose)]
 
-    def log_likelihoods(self, stimuli, fixations, verbose=False):
+    def log_likelihoods(self, stimuli, fixations, verbose=False, n_jobs=None):
+        if use_parallel_evaluation(n_jobs):
+            return evaluate_fixation_metric(partial(ScanpathModel.log_likelihoods, self), stimuli, fixations, n_jobs=n_jobs, verbose=verbose)
+
         log_likelihoods = np.empty(len(fixations.x))
         for i in tqdm(range(len(fixations.x)), disable=not verbose):
             conditional_log_density = self.conditional_log_density_for_fixation(stimuli, fixations, i)
@@ -160,21 +165,21 @@ class ScanpathModel(SamplingModelMixin, object, metaclass=ABCMeta):
 
         return log_likelihoods
 
-    def log_likelihood(self, stimuli, fixations, verbose=False, average='fixation'):
-        return average_values(self.log_likelihoods(stimuli, fixations, verbose=verbose), fixations, average=average)
+    def log_likelihood(self, stimuli, fixations, verbose=False, average='fixation', n_jobs=None):
+        return average_values(self.log_likelihoods(stimuli, fixations, verbose=verbose, n_jobs=n_jobs), fixations, average=average)
 
-    def information_gains(self, stimuli, fixations, baseline_model=None, verbose=False, average='fixation'):
+    def information_gains(self, stimuli, fixations, baseline_model=None, verbose=False, average='fixation', n_jobs=None):
         if average != 'fixation':
             raise NotImplementedError()
         if baseline_model is None:
             baseline_model = UniformModel()
 
-        own_log_likelihoods = self.log_likelihoods(stimuli, fixations, verbose=verbose)
-        baseline_log_likelihoods = baseline_model.log_likelihoods(stimuli, fixations, verbose=verbose)
+        own_log_likelihoods = self.log_likelihoods(stimuli, fixations, verbose=verbose, n_jobs=n_jobs)
+        baseline_log_likelihoods = baseline_model.log_likelihoods(stimuli, fixations, verbose=verbose, n_jobs=n_jobs)
         return (own_log_likelihoods - baseline_log_likelihoods) / np.log(2)
 
-    def information_gain(self, stimuli, fixations, baseline_model=None, verbose=False, average='fixation'):
-        return average_values(self.information_gains(stimuli, fixations, baseline_model, verbose=verbose), fixations, average=average)
+    def information_gain(self, stimuli, fixations, baseline_model=None, verbose=False, average='fixation', n_jobs=None):
+        return average_values(self.information_gains(stimuli, fixations, baseline_model, verbose=verbose, n_jobs=n_jobs), fixations, average=average)
 
     def _expand_sample_arguments(self, stimuli, train_counts, lengths=None, stimulus_indices=None):
         if isinstance(train_counts, int):
@@ -279,9 +284,13 @@ class Model(ScanpathModel):
 
     Inheriting classes have to implement `_log_density`.
     """
-    def __init__(self, cache_location=None, caching=True, memory_cache_size=None):
+    def __init__(self, cache_location=None, caching=True, memory_cache_size=None, memory_cache_bytes=None, disk_cache_bytes=None,
+                 mmap_mode=None, cache_backend='npy', cache_locking=False,
+                 storage_dtype=None):
         super(Model, self).__init__()
-        self._cache = Cache(cache_location, memory_cache_size=memory_cache_size)
+        self._cache = Cache(cache_location, memory_cache_size=memory_cache_size, memory_cache_bytes=memory_cache_bytes,
+                            disk_cache_bytes=disk_cache_bytes, mmap_mode=mmap_mode,
+                            cache_backend=cache_backend, locking=cache_locking, storage_dtype=storage_dtype)
         self.caching = caching
         #self._log_density_cache = Cache(cache_location)
         # This make the property `cache_location` work.
@@ -295,6 +304,11 @@ class Model(ScanpathModel):
     def cache_location(self, value):
         self._cache.cache_location = value
 
+    @property
+    def cache_stats(self):
+        """hits, misses and evictions of the prediction cache, see `pysaliency.utils.Cache.stats`"""
+        return self._cache.stats
+
     def conditional_log_density(self, stimulus, x_hist, y_hist, t_hist, attributes=None, out=None):
         return self.log_density(stimulus)
 
@@ -307,11 +321,17 @@ class Model(ScanpathModel):
         """
         stimulus = handle_stimulus(stimulus)
         if not self.caching:
-            return self._log_density(stimulus.stimulus_data)
-        stimulus_id = stimulus.stimulus_id
-        if not stimulus_id in self._cache:
-            self._cache[stimulus_id] = self._log_density(stimulus.stimulus_data)
-        return self._cache[stimulus_id]
+            return self._stimulus_log_density(stimulus)
+        return self._get_or_compute_cached(stimulus.stimulus_id, lambda: self._stimulus_log_density(stimulus))
+
+    def _stimulus_log_density(self, stimulus):
+        """
+        Compute the log density for the `Stimulus` object `stimulus`.
+
+        Models which don't need the stimulus data at full resolution can
+        overwrite this instead of `_log_density` (see `Stimulus.downscaled_stimulus_data`).
+        """
+        return self._log_density(stimulus.stimulus_data)
 
     @abstractmethod
     def _log_density(self, stimulus):
@@ -326,15 +346,20 @@ class Model(ScanpathModel):
         """
         raise NotImplementedError()
 
-    def log_likelihoods(self, stimuli, fixations, verbose=False):
+    def log_likelihoods(self, stimuli, fixations, verbose=False, n_jobs=None):
+        if use_parallel_evaluation(n_jobs):
+            return evaluate_fixation_metric(partial(Model.log_likelihoods, self), stimuli, fixations, n_jobs=n_jobs, verbose=verbose)
+
         log_likelihoods = np.empty(len(fixations.x))
-        for n in tqdm(range(len(stimuli)), disable=not verbose):
-            inds = fixations.n == n
-            if not inds.sum():
-                continue
-            log_density = self.log_density(stimuli[n])
+        fixation_indices = fixations.fixation_indices_by_stimulus
+        fixations_x_int = fixations.x_int
+        fixations_y_int = fixations.y_int
+        indices = [n for n in range(len(stimuli)) if len(fixation_indices[n])]
+        predictions = prefetch_predictions(self.log_density, stimuli, indices)
+        for n, log_density in tqdm(predictions, total=len(indices), disable=not verbose):
+            inds = fixation_indices[n]
             check_prediction_shape(log_density, stimuli[n])
-            this_log_likelihoods = log_density[fixations.y_int[inds], fixations.x_int[inds]]
+            this_log_likelihoods = log_density[fixations_y_int[inds], fixations_x_int[inds]]
             log_likelihoods[inds] = this_log_likelihoods
 
         return log_likelihoods
@@ -357,7 +382,7 @@ class Model(ScanpathModel):
         ig = (p_gold)*(np.logaddexp(log_p_model, np.log(eps))-np.logaddexp(log_p_baseline, np.log(eps)))
         return ig
 
-    def kl_divergences(self, stimuli, gold_standard, log_regularization=0, quotient_regularization=0, verbose=False):
+    def kl_divergences(self, stimuli, gold_standard, log_regularization=0, quotient_regularization=0, verbose=False, n_jobs=None):
         """Calculate KL Divergence between model and gold standard for each stimulus.
 
         This metric works only for probabilistic models.
@@ -370,12 +395,19 @@ class Model(ScanpathModel):
         assert isinstance(self, Model)
         assert isinstance(gold_standard, Model)
 
+        if use_parallel_evaluation(n_jobs):
+            return evaluate_stimulus_metric(partial(Model.kl_divergences, self), stimuli, n_jobs, gold_standard,
+                                            log_regularization=log_regularization,
+                                            quotient_regularization=quotient_regularization,
+                                            verbose=verbose)
+
         kl_divs = []
-        for s in tqdm(stimuli, disable=not verbose):
-            logp_model = self.log_density(s)
-            logp_gold = gold_standard.log_density(s)
-            check_prediction_shape(logp_model, s)
-            check_prediction_shape(logp_gold, s)
+        def _log_densities(stimulus):
+            return self.log_density(stimulus), gold_standard.log_density(stimulus)
+
+        for n, (logp_model, logp_gold) in tqdm(prefetch_predictions(_log_densities, stimuli), total=len(stimuli), disable=not verbose):
+            check_prediction_shape(logp_model, stimuli[n])
+            check_prediction_shape(logp_gold, stimuli[n])
             kl_divs.append(
                 probabilistic_image_based_kl_divergence(logp_model, logp_gold, log_regularization=log_regularization, quotient_regularization=quotient_regularization)
             )
@@ -386,7 +418,9 @@ class Model(ScanpathModel):
         """
             Set model parameters, if the model has parameters
 
-            This method has to reset caches etc., if the depend on the parameters
+            Parameters stored as public attributes change the `fingerprint` of the model
+            and therefore invalidate cached predictions. Other parameters have to reset
+            the caches.
         """
         if kwargs:
             raise ValueError('Unkown parameters!', kwargs)
@@ -400,6 +434,10 @@ class CachedModel(Model):
             raise ValueError("CachedModel needs a cache location!")
         super(CachedModel, self).__init__(cache_location=cache_location, **kwargs)
 
+    def _cache_key(self, stimulus_id):
+        # the precached densities are stored by stimulus id only
+        return stimulus_id
+
     def _log_density(self, stimulus):
         raise NotImplementedError()
 
@@ -410,7 +448,8 @@ class UniformModel(Model):
     def _log_density(self, stimulus):
         return np.zeros((stimulus.shape[0], stimulus.shape[1])) - np.log(stimulus.shape[0]) - np.log(stimulus.shape[1])
 
-    def log_likelihoods(self, stimuli, fixations, verbose=False):
+    def log_likelihoods(self, stimuli, fixations, verbose=False, n_jobs=None):
+        # this is already vectorized and doesn't need any predictions, so n_jobs is ignored
         stimulus_shapes = np.zeros((len(stimuli), 2), dtype=int)
         stimulus_indices = sorted(np.unique(fixations.n))
         for stimulus_index in stimulus_indices:
@@ -878,42 +917,70 @@ class SaliencyMapNormalizingModel(Model):
         return np.log(smap)
 
 
+def _zoom_stimulus(stimulus_data, stimulus_size, factor):
+    """ zoom `stimulus_data` to the size that zooming a stimulus of size `stimulus_size` by `factor` results in.
+
+    `stimulus_data` might have been decoded at a lower resolution than `stimulus_size`.
+    """
+    target_shape = [int(round(stimulus_size[0] * factor)), int(round(stimulus_size[1] * factor))]
+    factors = [target_shape[0] / stimulus_data.shape[0], target_shape[1] / stimulus_data.shape[1]]
+    if stimulus_data.ndim == 3:
+        factors.append(1.0)
+    return zoom(stimulus_data, factors, order=1, mode='nearest')
+
+
 class FixedStimulusSizeModel(Model):
-    """ model which scales images to have a fixed size before handing them to anothet model"""
-    def __init__(self, size, parent_model, verbose=False, **kwargs):
+    """ model which scales images to have a fixed size before handing them to anothet model
+
+    With `downscaled_decoding`, large JPEG stimuli of `FileStimuli` are decoded at a reduced
+    resolution which is still at least `size` (see `FileStimuli.load_stimulus`). This is
+    considerably faster, but the results differ slightly from resizing the full resolution stimuli.
+    With caching, the stimulus ids are needed as cache keys and computing them decodes the stimuli
+    at full resolution. Hence `downscaled_decoding` only helps if the stimulus ids are known already,
+    e.g. from the `metadata_index` of the `FileStimuli` or with `caching=False`.
+    """
+    def __init__(self, size, parent_model, verbose=False, downscaled_decoding=False, **kwargs):
         super(FixedStimulusSizeModel, self).__init__(**kwargs)
 
         self.size = size
         self.parent_model = parent_model
         self.verbose = verbose
+        self.downscaled_decoding = downscaled_decoding
+
+    def _stimulus_log_density(self, stimulus):
+        if not self.downscaled_decoding:
+            return super(FixedStimulusSizeModel, self)._stimulus_log_density(stimulus)
+        return self._resized_log_density(stimulus.downscaled_stimulus_data(self.size), stimulus.size)
 
     def _log_density(self, stimulus):
-        stimulus = self.ensure_color(stimulus)
+        return self._resized_log_density(stimulus, (stimulus.shape[0], stimulus.shape[1]))
+
+    def _resized_log_density(self, stimulus_data, stimulus_size):
+        stimulus_data = self.ensure_color(stimulus_data)
 
-        stimulus_size = stimulus.shape[0], stimulus.shape[1]
         max_size = max(stimulus_size)
         factor = self.size / max_size
 
-        if factor != 1.0:
+        if factor != 1.0 or stimulus_data.shape[:2] != tuple(stimulus_size):
             if self.verbose:
                 print("Resizing with factor", factor)
-            stimulus_for_parent_model = zoom(stimulus, [factor, factor, 1.0], order=1, mode='nearest')
+            stimulus_for_parent_model = _zoom_stimulus(stimulus_data, stimulus_size, factor)
         else:
-            stimulus_for_parent_model = stimulus
+            stimulus_for_parent_model = stimulus_data
 
         log_density = self.parent_model.log_density(stimulus_for_parent_model)
 
-        factor_y = stimulus.shape[0] / log_density.shape[0]
-        factor_x = stimulus.shape[1] / log_density.shape[1]
+        factor_y = stimulus_size[0] / log_density.shape[0]
+        factor_x = stimulus_size[1] / log_density.shape[1]
 
         if factor_y != 1.0 or factor_x != 1.0:
             if self.verbose:
-                print("Wrong shape, resizing log densities", stimulus.shape, log_density.shape)
+                print("Wrong shape, resizing log densities", stimulus_size, log_density.shape)
             log_density = zoom(log_density, [factor_y, factor_x], order=1, mode='nearest')
             log_density -= logsumexp(log_density)
 
-        assert log_density.shape[0] == stimulus.shape[0]
-        assert log_density.shape[1] == stimulus.shape[1]
+        assert log_density.shape[0] == stimulus_size[0]
+        assert log_density.shape[1] == stimulus_size[1]
 
         return log_density
 
@@ -928,8 +995,11 @@ class DVAAwareModel(Model):
 
     - dva: expected image resolution in pixel per dva for this model
     - parent_model_dva: image resolution expected by parent_model
+    - downscaled_decoding: if the images are downscaled, decode large JPEG stimuli of `FileStimuli`
+      at a reduced resolution. As for `FixedStimulusSizeModel`, this needs known stimulus ids
+      (e.g. from a `metadata_index`) or `caching=False`.
     """
-    def __init__(self, dva, parent_model, parent_model_dva, verbose=False, **kwargs):
+    def __init__(self, dva, parent_model, parent_model_dva, verbose=False, downscaled_decoding=False, **kwargs):
 
         super(DVAAwareModel, self).__init__(**kwargs)
 
@@ -937,38 +1007,41 @@ class DVAAwareModel(Model):
         self.parent_model = parent_model
         self.parent_model_dva = parent_model_dva
         self.verbose = verbose
+        self.downscaled_decoding = downscaled_decoding
 
         self.factor = self.parent_model_dva / self.dva
 
+    def _stimulus_log_density(self, stimulus):
+        if not self.downscaled_decoding or self.factor >= 1.0:
+            return super(DVAAwareModel, self)._stimulus_log_density(stimulus)
+        max_size = int(np.ceil(max(stimulus.size) * self.factor))
+        return self._resized_log_density(stimulus.downscaled_stimulus_data(max_size), stimulus.size)
+
     def _log_density(self, stimulus):
-        stimulus_data = as_stimulus(stimulus).stimulus_data
+        return self._resized_log_density(stimulus, (stimulus.shape[0], stimulus.shape[1]))
 
+    def _resized_log_density(self, stimulus_data, stimulus_size):
         if self.factor != 1.0:
             if self.verbose:
                 print("Resizing with factor", self.factor)
-            if stimulus_data.ndim == 2:
-                factors = [self.factor, self.factor]
-            else:
-                factors = [self.factor, self.factor, 1.0]
-
-            stimulus_for_parent_model = zoom(stimulus_data, factors, order=1, mode='nearest')
+            stimulus_for_parent_model = _zoom_stimulus(stimulus_data, stimulus_size, self.factor)
 
         else:
-            stimulus_for_parent_model = stimulus
+            stimulus_for_parent_model = stimulus_data
 
         log_density = self.parent_model.log_density(stimulus_for_parent_model)
 
-        factor_y = stimulus.shape[0] / log_density.shape[0]
-        factor_x = stimulus.shape[1] / log_density.shape[1]
+        factor_y = stimulus_size[0] / log_density.shape[0]
+        factor_x = stimulus_size[1] / log_density.shape[1]
 
         if factor_y != 1.0 or factor_x != 1.0:
             if self.verbose:
-                print("Wrong shape, resizing log densities", stimulus.shape, log_density.shape)
+                print("Wrong shape, resizing log densities", stimulus_size, log_density.shape)
             log_density = zoom(log_density, [factor_y, factor_x], order=1, mode='nearest')
             log_density -= logsumexp(log_density)
 
-        assert log_density.shape[0] == stimulus.shape[0]
-        assert log_density.shape[1] == stimulus.shape[1]
+        assert log_density.shape[0] == stimulus_size[0]
+        assert log_density.shape[1] == stimulus_size[1]
 
         return log_density
 
@@ -15,7 +15,7 @@ def fill_fixation_map(fixation_map, fixations, check_bounds=True):
     return _fill_fixation_map(fixation_map, fixations)
 
 
-@numba.jit(nopython=True)
+@numba.jit(nopython=True, cache=True)
 def _fill_fixation_map(fixation_map, fixations):
     """fixationmap: 2d array. fixations: Nx2 array of y, x positions"""
     for i in range(len(fixations)):
@@ -32,13 +32,30 @@ def auc_for_one_positive(positive, negatives):
     return _auc_for_one_positive(positive, np.asarray(negatives))
 
 
-@numba.jit(nopython=True)
+def auc_for_one_positive_excluding_itself(positive, values):
+    """ Computes the AUC score of one single positive sample against all `values` except for
+    one occurence of the positive itself, e.g. all pixels of a saliency map except for the fixated one.
+
+    The result is equal to `auc_for_one_positive(positive, remaining_values)`, but the remaining
+    values don't have to be copied.
+    """
+    values = np.asarray(values)
+    return (_auc_count_for_one_positive(positive, values.ravel()) - 0.5) / (values.size - 1)
+
+
+@numba.jit(nopython=True, cache=True)
 def _auc_for_one_positive(positive, negatives):
     """ Computes the AUC score of one single positive sample agains many negatives.
 
     The result is equal to general_roc([positive], negatives)[0], but computes much
     faster because one can save sorting the negatives.
     """
+    return _auc_count_for_one_positive(positive, negatives) / len(negatives)
+
+
+@numba.jit(nopython=True, cache=True)
+def _auc_count_for_one_positive(positive, negatives):
+    """ number of negatives smaller than the positive plus half the number of negatives equal to it """
     count = 0
     for negative in negatives:
         if negative < positive:
@@ -46,7 +63,7 @@ def _auc_for_one_positive(positive, negatives):
         elif negative == positive:
             count += 0.5
 
-    return count / len(negatives)
+    return count
 
 
 def general_roc_numba(positives, negatives, judd=0):
@@ -70,7 +87,7 @@ def general_roc_numba(positives, negatives, judd=0):
     return auc, hit_rates, false_positive_rates
 
 
-@numba.jit(nopython=True)
+@numba.jit(nopython=True, cache=True)
 def _general_roc_numba(all_values, sorted_positives, sorted_negatives, false_positive_rates, hit_rates):
     """calculate ROC score for given values of positive and negative
     distribution"""
@@ -102,7 +119,7 @@ def general_rocs_per_positive_numba(positives, negatives):
     return results
 
 
-@numba.jit(nopython=True)
+@numba.jit(nopython=True, cache=True)
 def _general_rocs_per_positive_numba(sorted_positives, sorted_negatives, sorted_inds, results):
     """calculate ROC scores for each positive against a list of negatives
     distribution. The mean over the result will equal the return value of `general_roc`."""
@@ -131,4 +148,54 @@ def _general_rocs_per_positive_numba(sorted_positives, sorted_negatives, sorted_
 
         last_theta = theta
 
-    return results
\ No newline at end of file
+    return results
+
+
+def _check_batch_offsets(values, offsets, name):
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if offsets.ndim != 1 or len(offsets) < 1 or offsets[0] != 0 or offsets[-1] != len(values) or np.any(np.diff(offsets) < 0):
+        raise ValueError("{name}_offsets have to start with 0, end with len({name}) and be non-decreasing".format(name=name))
+    return offsets
+
+
+def _prepare_batch(positives, positive_offsets, negatives, negative_offsets):
+    positives = np.ascontiguousarray(positives, dtype=np.float64)
+    negatives = np.ascontiguousarray(negatives, dtype=np.float64)
+    positive_offsets = _check_batch_offsets(positives, positive_offsets, 'positives')
+    negative_offsets = _check_batch_offsets(negatives, negative_offsets, 'negatives')
+    if len(positive_offsets) != len(negative_offsets):
+        raise ValueError("positives and negatives need the same number of groups")
+
+    return positives, positive_offsets, negatives, negative_offsets
+
+
+def general_rocs_per_positive_batch(positives, positive_offsets, negatives, negative_offsets):
+    """ calculate the ROC scores of each positive for many groups (e.g. images) of positives and negatives in one call.
+
+    The groups are given as flat arrays with offsets: group `k` consists of
+    `positives[positive_offsets[k]:positive_offsets[k+1]]` and `negatives[negative_offsets[k]:negative_offsets[k+1]]`.
+    Returns a flat array with the ROC score of each positive, equal to `general_rocs_per_positive_numba`
+    applied to each group. The groups are processed in parallel.
+    """
+    positives, positive_offsets, negatives, negative_offsets = _prepare_batch(positives, positive_offsets, negatives, negative_offsets)
+    if np.any((np.diff(positive_offsets) > 0) & (np.diff(negative_offsets) == 0)):
+        raise ValueError("Each group with positives needs at least one negative")
+
+    results = np.empty(len(positives))
+    return _general_rocs_per_positive_batch(positives, positive_offsets, negatives, negative_offsets, results)
+
+
+@numba.jit(nopython=True, parallel=True, cache=True)
+def _general_rocs_per_positive_batch(positives, positive_offsets, negatives, negative_offsets, results):
+    for k in numba.prange(len(positive_offsets) - 1):
+        if positive_offsets[k + 1] == positive_offsets[k]:
+            continue
+        these_positives = positives[positive_offsets[k]:positive_offsets[k + 1]]
+        sorted_negatives = np.sort(negatives[negative_offsets[k]:negative_offsets[k + 1]])
+        sorted_inds = np.argsort(these_positives)
+        sorted_positives = these_positives[sorted_inds]
+
+        _general_rocs_per_positive_numba(sorted_positives, sorted_negatives, sorted_inds,
+                                         results[positive_offsets[k]:positive_offsets[k + 1]])
+
+    return results
@@ -0,0 +1,324 @@
+"""
+Evaluating metrics in worker processes.
+
+The metric methods of the model classes accept an `n_jobs` argument. If it is given,
+the stimuli are split into contiguous shards and each shard is evaluated in a worker
+process. Each worker receives only the stimuli of its shard and the fixations on these
+stimuli and runs the serial implementation of the metric on them. Afterwards the
+results are merged back into the original order. Since every stimulus is evaluated
+exactly as in the serial case, the results are identical to the serial results.
+
+`n_jobs` can be either the number of worker processes (negative values count
+backwards from the number of CPUs as in joblib, i.e. `-1` uses all CPUs) or an existing
+`concurrent.futures.Executor` which will be used instead of starting a new process pool.
+
+Models, stimuli and fixations are sent to the workers using `dill`. In-memory caches of
+models are not transferred and predictions computed in the workers are not stored in the
+memory cache of the model in the main process. If the model has a `cache_location`,
+the workers will use it.
+
+Forking a process which already used the parallel numba kernels of `pysaliency.numba_utils`
+can deadlock. Therefore, in this case the worker processes are started with the `forkserver`
+start method where available, which requires scripts to guard their main code with
+`if __name__ == '__main__':` as on Windows and macOS.
+
+Independently of `n_jobs`, the serial metric loops can load the predictions for the next
+`PREFETCH_COUNT` stimuli in a background thread (see `prefetch`), such that reading
+predictions from disk, HDF5 files or archives overlaps with computing the metrics.
+Prefetching calls the models in another thread than the caller, which breaks models
+bound to a single thread (e.g. tensorflow 1 sessions). Therefore it is disabled by default,
+set e.g. `pysaliency.parallel.PREFETCH_COUNT = 2` to enable it for models which can be called
+from other threads. In the same way, `pysaliency.datasets.stimuli.STIMULUS_PREFETCH_COUNT` enables
+decoding the images of `FileStimuli` ahead in a thread pool (see `pysaliency.datasets.StimulusLoader`).
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import dill
+import numba
+import numpy as np
+from tqdm import tqdm
+
+from .datasets import FileStimuli, Fixations, HDF5Stimuli, PackedStimuli, Stimuli
+
+
+PREFETCH_COUNT = 0
+
+
+def use_parallel_evaluation(n_jobs):
+    """ whether `n_jobs` requests evaluation in worker processes """
+    if n_jobs is None:
+        return False
+    if isinstance(n_jobs, Executor):
+        return True
+    return _worker_count(n_jobs) > 1
+
+
+def _worker_count(n_jobs):
+    if isinstance(n_jobs, Executor):
+        # the executors of `concurrent.futures` don't expose their size publicly
+        return getattr(n_jobs, '_max_workers', None) or os.cpu_count() or 1
+    if n_jobs == 0:
+        raise ValueError("n_jobs must not be zero")
+    if n_jobs < 0:
+        return max((os.cpu_count() or 1) + 1 + n_jobs, 1)
+    return n_jobs
+
+
+def _mp_context():
+    try:
+        numba.threading_layer()
+    except ValueError:
+        # numba didn't start any threads yet, forking is safe
+        return None
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['pysaliency'])
+    return context
+
+
+def stimulus_shards(stimulus_count, n_jobs):
+    """ split the stimulus indices into contiguous, non-empty ranges, one for each worker """
+    boundaries = np.linspace(0, stimulus_count, num=min(_worker_count(n_jobs), stimulus_count) + 1).round().astype(int)
+    return [(start, stop) for start, stop in zip(boundaries[:-1], boundaries[1:]) if stop > start]
+
+
+def stimuli_for_shard(stimuli, start, stop):
+    """ get the stimuli with indices `start` to `stop` without references to the other stimuli """
+    indices = list(range(start, stop))
+    if isinstance(stimuli, (FileStimuli, HDF5Stimuli, PackedStimuli)):
+        return stimuli[indices]
+
+    # slicing non-file stimuli returns objects which reference the original
+    # stimuli, which would result in sending all stimuli to each worker.
+    attributes = stimuli._get_attribute_for_stimulus_subset(indices)
+    sub_stimuli = Stimuli([stimuli.stimuli[i] for i in indices], attributes=attributes)
+    sub_stimuli.set_stimulus_ids({new_index: stimuli.stimulus_ids[old_index] for new_index, old_index in enumerate(indices)})
+
+    return sub_stimuli
+
+
+def fixation_indices_for_shard(fixations, start, stop):
+    """ get the indices of all fixations on the stimuli with indices `start` to `stop` """
+    fixation_indices = fixations.fixation_indices_by_stimulus
+    stop = min(stop, len(fixation_indices))
+    if stop <= start:
+        return fixation_indices.order[:0]
+    return fixation_indices.order[fixation_indices.offsets[start]:fixation_indices.offsets[stop]]
+
+
+def fixations_for_shard(fixations, start, stop):
+    """ get the fixations on the stimuli with indices `start` to `stop`, with stimulus indices relative to `start` """
+    inds = fixation_indices_for_shard(fixations, start, stop)
+    shard_fixations = fixations[inds]
+    shard_fixations.n = np.asarray(shard_fixations.n) - start
+    return shard_fixations
+
+
+def _prepare_nonfixations(nonfixations, stimuli, fixations):
+    from .saliency_map_models import FullShuffledNonfixationProvider
+
+    if isinstance(nonfixations, str):
+        if nonfixations == 'shuffled':
+            return FullShuffledNonfixationProvider(stimuli, fixations)
+        return nonfixations
+    if isinstance(nonfixations, (Fixations, FullShuffledNonfixationProvider)):
+        return nonfixations
+    raise ValueError("Evaluating with n_jobs supports only nonfixations 'uniform', 'unfixated', 'shuffled' or Fixations, got {}".format(nonfixations))
+
+
+def _nonfixations_for_shard(nonfixations, start, stop):
+    if isinstance(nonfixations, str):
+        return nonfixations
+    if isinstance(nonfixations, Fixations):
+        return fixations_for_shard(nonfixations, start, stop)
+    return nonfixations.for_shard(start)
+
+
+def _evaluate_shard(payload):
+    method, args, kwargs = dill.loads(payload)
+    return method(*args, **kwargs)
+
+
+def map_shards(method, shard_arguments, n_jobs, verbose=False):
+    """ evaluate `method(*args, **kwargs)` for each `(args, kwargs)` in `shard_arguments` in worker processes
+
+    returns the list of results in the order of `shard_arguments`.
+    """
+    if isinstance(n_jobs, Executor):
+        executor = n_jobs
+        shutdown_executor = False
+    else:
+        executor = ProcessPoolExecutor(max_workers=_worker_count(n_jobs), mp_context=_mp_context())
+        shutdown_executor = True
+
+    try:
+        futures = [executor.submit(_evaluate_shard, dill.dumps((method, args, kwargs)))
+                   for args, kwargs in shard_arguments]
+        for _ in tqdm(as_completed(futures), total=len(futures), disable=not verbose):
+            pass
+        return [future.result() for future in futures]
+    finally:
+        if shutdown_executor:
+            executor.shutdown()
+
+
+def evaluate_fixation_metric(method, stimuli, fixations, n_jobs, verbose=False, **kwargs):
+    """ evaluate a metric `method(stimuli, fixations, **kwargs)` returning one value per fixation in worker processes """
+    if 'nonfixations' in kwargs:
+        kwargs['nonfixations'] = _prepare_nonfixations(kwargs['nonfixations'], stimuli, fixations)
+
+    shard_fixation_indices = []
+    shard_arguments = []
+    for start, stop in stimulus_shards(len(stimuli), n_jobs):
+        inds = fixation_indices_for_shard(fixations, start, stop)
+        if not len(inds):
+            continue
+
+        shard_kwargs = dict(kwargs)
+        if 'nonfixations' in kwargs:
+            shard_kwargs['nonfixations'] = _nonfixations_for_shard(kwargs['nonfixations'], start, stop)
+
+        shard_fixation_indices.append(inds)
+        shard_arguments.append((
+            (stimuli_for_shard(stimuli, start, stop), fixations_for_shard(fixations, start, stop)),
+            shard_kwargs,
+        ))
+
+    results = map_shards(method, shard_arguments, n_jobs=n_jobs, verbose=verbose)
+
+    if results and isinstance(results[0], tuple):
+        # metrics returning several values per fixation, e.g. AUC scores and their error bounds
+        return tuple(_merge_fixation_values([shard_results[k] for shard_results in results], shard_fixation_indices, len(fixations.x))
+                     for k in range(len(results[0])))
+
+    return _merge_fixation_values(results, shard_fixation_indices, len(fixations.x))
+
+
+def _merge_fixation_values(results, shard_fixation_indices, fixation_count):
+    values = np.empty(fixation_count)
+    for inds, shard_values in zip(shard_fixation_indices, results):
+        values[inds] = shard_values
+
+    return values
+
+
+def evaluate_image_metric(method, stimuli, fixations, n_jobs, verbose=False, **kwargs):
+    """ evaluate a metric `method(stimuli, fixations, **kwargs)` returning one value per stimulus in worker processes
+
+    Stimuli without fixations get a value of `np.nan`.
+    """
+    if 'nonfixations' in kwargs:
+        kwargs['nonfixations'] = _prepare_nonfixations(kwargs['nonfixations'], stimuli, fixations)
+
+    shards = stimulus_shards(len(stimuli), n_jobs)
+    shard_arguments = []
+    evaluated_shards = []
+    for start, stop in shards:
+        if not len(fixation_indices_for_shard(fixations, start, stop)):
+            continue
+
+        shard_kwargs = dict(kwargs)
+        if 'nonfixations' in kwargs:
+            shard_kwargs['nonfixations'] = _nonfixations_for_shard(kwargs['nonfixations'], start, stop)
+
+        evaluated_shards.append((start, stop))
+        shard_arguments.append((
+            (stimuli_for_shard(stimuli, start, stop), fixations_for_shard(fixations, start, stop)),
+            shard_kwargs,
+        ))
+
+    results = map_shards(method, shard_arguments, n_jobs=n_jobs, verbose=verbose)
+
+    if results and isinstance(results[0], tuple):
+        # metrics returning several values per stimulus, e.g. AUC scores and their error bounds
+        return tuple(_merge_image_values([shard_results[k] for shard_results in results], evaluated_shards, shards)
+                     for k in range(len(results[0])))
+
+    return _merge_image_values(results, evaluated_shards, shards)
+
+
+def _merge_image_values(results, evaluated_shards, shards):
+    results = dict(zip(evaluated_shards, results))
+
+    values = []
+    for start, stop in shards:
+        values.extend(results.get((start, stop), [np.nan] * (stop - start)))
+
+    return values
+
+
+def evaluate_stimulus_metric(method, stimuli, n_jobs, *args, verbose=False, **kwargs):
+    """ evaluate a metric `method(stimuli, *args, **kwargs)` returning one value per stimulus in worker processes """
+    shard_arguments = [
+        ((stimuli_for_shard(stimuli, start, stop),) + args, kwargs)
+        for start, stop in stimulus_shards(len(stimuli), n_jobs)
+    ]
+
+    results = map_shards(method, shard_arguments, n_jobs=n_jobs, verbose=verbose)
+
+    return [value for shard_values in results for value in shard_values]
+
+
+def prefetch(function, items, prefetch_count=None, n_jobs=1):
+    """ iterate over `function(item)` for all `items` while computing the next results in a background thread
+
+    While the caller processes a result, the results for the next `prefetch_count` items
+    (default: `PREFETCH_COUNT`) are already computed. All calls of `function` happen in one
+    background thread in the order of `items`, so `function` doesn't have to be thread safe
+    as long as the caller doesn't use the same objects in the meantime. With `prefetch_count=0`,
+    `function` is called in the calling thread.
+
+    With `n_jobs` larger than one, `function` is called in `n_jobs` threads and has to be
+    thread safe. The results are still returned in the order of `items`.
+    """
+    if prefetch_count is None:
+        prefetch_count = PREFETCH_COUNT
+
+    if not prefetch_count:
+        for item in items:
+            yield function(item)
+        return
+
+    futures = deque()
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        try:
+            for item in items:
+                futures.append(executor.submit(function, item))
+                if len(futures) > prefetch_count:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+        finally:
+            # the caller stopped early, don't compute the remaining results
+            for future in futures:
+                future.cancel()
+
+
+def prefetch_predictions(predict, stimuli, indices=None, prefetch_count=None):
+    """ yield `(n, predict(stimuli.stimulus_objects[n]))` for the stimulus indices `indices` (default: all stimuli)
+
+    The predictions are computed ahead in a background thread, see `prefetch`. The images
+    of `FileStimuli` are decoded ahead in a thread pool once the model accesses them
+    (see `pysaliency.datasets.StimulusLoader`). `stimuli` can also be a list of images,
+    which are passed to `predict` as they are.
+    """
+    if indices is None:
+        indices = range(len(stimuli))
+    indices = list(indices)
+
+    if not isinstance(stimuli, Stimuli):
+        yield from prefetch(lambda n: (n, predict(stimuli[n])), indices, prefetch_count=prefetch_count)
+        return
+
+    with stimuli.stimulus_loader(indices) as stimulus_loader:
+        def _predict(position):
+            return indices[position], predict(stimulus_loader[position])
+
+        yield from prefetch(_predict, range(len(indices)), prefetch_count=prefetch_count)
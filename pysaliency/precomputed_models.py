@@ -136,7 +136,7 @@ class SaliencyMapModelFromFiles(SaliencyMapModel):
         stimulus_id = get_image_hash(stimulus)
 
         try:
-            stimulus_index = self.stimuli.stimulus_ids.index(stimulus_id)
+            stimulus_index = self.stimuli.stimulus_index(stimulus_id)
         except IndexError as exc:
             raise IndexError("Stimulus id '{}' not found in stimuli!".format(stimulus_id)) from exc
 
@@ -218,7 +218,7 @@ class SaliencyMapModelFromFile(SaliencyMapModel):
 
     def _saliency_map(self, stimulus):
         stimulus_id = get_image_hash(stimulus)
-        stimulus_index = self.stimuli.stimulus_ids.index(stimulus_id)
+        stimulus_index = self.stimuli.stimulus_index(stimulus_id)
         smap = self._saliency_maps[stimulus_index]
         if smap.shape != (stimulus.shape[0], stimulus.shape[1]):
             raise ValueError('Wrong shape!')
@@ -277,7 +277,7 @@ class HDF5SaliencyMapModel(SaliencyMapModel):
 
     def _saliency_map(self, stimulus):
         stimulus_id = get_image_hash(stimulus)
-        stimulus_index = self.stimuli.stimulus_ids.index(stimulus_id)
+        stimulus_index = self.stimuli.stimulus_index(stimulus_id)
         stimulus_key = self.names[stimulus_index]
         smap = self.hdf5_file[stimulus_key][:]
         if not smap.shape == (stimulus.shape[0], stimulus.shape[1]):
@@ -369,7 +369,7 @@ class PredictionsFromArchiveMixin(object):
 
     def _prediction(self, stimulus):
         stimulus_id = get_image_hash(stimulus)
-        stimulus_index = self.stimuli.stimulus_ids.index(stimulus_id)
+        stimulus_index = self.stimuli.stimulus_index(stimulus_id)
         filename = self.files[stimulus_index]
         return self._load_file(filename)
 
@@ -1 +1,198 @@
+import numpy as np
+
 from .numba_utils import general_roc_numba as general_roc, general_rocs_per_positive_numba as general_rocs_per_positive
+
+
+def _less_and_equal_counts(thresholds, values):
+    """ for sorted unique `thresholds`, count the values smaller than and equal to each threshold """
+    # number of thresholds smaller than each value
+    inds = np.searchsorted(thresholds, values, side='left')
+    is_equal = inds < len(thresholds)
+    is_equal[is_equal] = thresholds[inds[is_equal]] == values[is_equal]
+
+    equal_counts = np.bincount(inds[is_equal], minlength=len(thresholds))
+    # a value is smaller than all thresholds from index `inds + is_equal` on
+    less_counts = np.cumsum(np.bincount(inds + is_equal, minlength=len(thresholds) + 1))[:len(thresholds)]
+
+    return less_counts, equal_counts
+
+
+def general_rocs_per_positive_excluding(positives, negatives, excluded_negatives):
+    """ calculate ROC scores for each positive against all `negatives` except for `excluded_negatives`.
+
+    `excluded_negatives` have to be a subset of `negatives`. The result equals
+    `general_rocs_per_positive(positives, remaining_negatives)`, but neither the negatives
+    have to be sorted nor do the remaining negatives have to be copied: instead, the counts
+    of smaller and equal negatives of the excluded negatives are subtracted from the
+    counts of all negatives.
+
+    If no negatives remain, all ROC scores are NaN.
+    """
+    positives = np.asarray(positives)
+    negatives = np.asarray(negatives)
+    excluded_negatives = np.asarray(excluded_negatives)
+
+    thresholds, inverse = np.unique(positives, return_inverse=True)
+
+    less_counts, equal_counts = _less_and_equal_counts(thresholds, negatives)
+    excluded_less_counts, excluded_equal_counts = _less_and_equal_counts(thresholds, excluded_negatives)
+    less_counts -= excluded_less_counts
+    equal_counts -= excluded_equal_counts
+
+    negative_count = len(negatives) - len(excluded_negatives)
+    if not negative_count:
+        return np.full(len(positives), np.nan)
+
+    return ((1.0 * less_counts + 0.5 * equal_counts) / negative_count)[inverse.ravel()]
+
+
+def general_rocs_per_positive_sorted(positives, sorted_negatives, excluded_negatives=None):
+    """ calculate ROC scores for each positive against a list of negatives which is already sorted ascendingly.
+
+    The result equals `general_rocs_per_positive(positives, sorted_negatives)`, but since the
+    negatives don't have to be sorted again, the counts of smaller and equal negatives are found by
+    binary search in O(len(positives) * log(len(sorted_negatives))).
+
+    If `excluded_negatives` (a subset of the negatives) are given, they are excluded from the negatives
+    as in `general_rocs_per_positive_excluding`. Without negatives, all ROC scores are NaN.
+    """
+    positives = np.asarray(positives)
+    less_counts = np.searchsorted(sorted_negatives, positives, side='left')
+    equal_counts = np.searchsorted(sorted_negatives, positives, side='right') - less_counts
+    negative_count = len(sorted_negatives)
+
+    if excluded_negatives is not None:
+        excluded_negatives = np.asarray(excluded_negatives)
+        thresholds, inverse = np.unique(positives, return_inverse=True)
+        excluded_less_counts, excluded_equal_counts = _less_and_equal_counts(thresholds, excluded_negatives)
+        less_counts = less_counts - excluded_less_counts[inverse.ravel()]
+        equal_counts = equal_counts - excluded_equal_counts[inverse.ravel()]
+        negative_count -= len(excluded_negatives)
+
+    if not negative_count:
+        return np.full(len(positives), np.nan)
+
+    return (1.0 * less_counts + 0.5 * equal_counts) / negative_count
+
+
+def sample_negatives(negatives, negatives_sample, random_state):
+    """ draw `negatives_sample` of the negatives uniformly without replacement.
+
+    If there are not more than `negatives_sample` negatives, all negatives are returned.
+    """
+    negatives = np.asarray(negatives)
+    if negatives_sample is None or len(negatives) <= negatives_sample:
+        return negatives
+    inds = random_state.choice(len(negatives), size=negatives_sample, replace=False)
+    return negatives[inds]
+
+
+def sampling_error_bound(negatives_count, negatives_sample, confidence=0.95):
+    """ bound on the error of ROC scores computed from `negatives_sample` sampled negatives
+    instead of all `negatives_count` negatives.
+
+    By the Dvoretzky-Kiefer-Wolfowitz inequality, the empirical distribution of the sampled
+    negatives deviates from the distribution of all negatives by at most this bound with the
+    given confidence, and so do AUC scores computed from it.
+    """
+    if negatives_sample is None or negatives_count <= negatives_sample:
+        return 0.0
+    return np.sqrt(np.log(2 / (1 - confidence)) / (2 * negatives_sample))
+
+
+def _histograms(positives, negatives, bins):
+    low = min(positives.min(), negatives.min())
+    high = max(positives.max(), negatives.max())
+    if low == high:
+        # all values are equal
+        return None, None, None
+
+    edges = np.linspace(low, high, bins + 1)
+    positive_hist, _ = np.histogram(positives, bins=edges)
+    negative_hist, _ = np.histogram(negatives, bins=edges)
+
+    return edges, positive_hist, negative_hist
+
+
+def binned_roc(positives, negatives, bins=1000):
+    """ calculate the ROC score from histograms of the positives and negatives with `bins` equally sized bins.
+
+    This uses only the bin edges as thresholds. Pairs of a positive and a negative in the same bin
+    count as ties, hence the error compared to `general_roc` is at most half the fraction of such pairs.
+
+    :return : (auc, error_bound)
+    """
+    positives = np.asarray(positives, dtype=float)
+    negatives = np.asarray(negatives, dtype=float)
+    edges, positive_hist, negative_hist = _histograms(positives, negatives, bins)
+
+    if edges is None:
+        return 0.5, 0.0
+
+    smaller_negatives = np.cumsum(negative_hist) - negative_hist
+    pair_count = len(positives) * len(negatives)
+    auc = np.sum(positive_hist * (smaller_negatives + 0.5 * negative_hist)) / pair_count
+    error_bound = 0.5 * np.sum(positive_hist * negative_hist) / pair_count
+
+    return auc, error_bound
+
+
+def binned_rocs_per_positive(positives, negatives, bins=1000):
+    """ calculate the ROC score of each positive from a histogram of the negatives, see `binned_roc`
+
+    :return : (rocs, error_bounds)
+    """
+    positives = np.asarray(positives, dtype=float)
+    negatives = np.asarray(negatives, dtype=float)
+    edges, _, negative_hist = _histograms(positives, negatives, bins)
+
+    if edges is None:
+        return np.full(len(positives), 0.5), np.zeros(len(positives))
+
+    # the last bin includes its right edge, as in `np.histogram`
+    positive_bins = np.clip(np.searchsorted(edges, positives, side='right') - 1, 0, len(negative_hist) - 1)
+    smaller_negatives = np.cumsum(negative_hist) - negative_hist
+
+    rocs = (smaller_negatives[positive_bins] + 0.5 * negative_hist[positive_bins]) / len(negatives)
+    error_bounds = 0.5 * negative_hist[positive_bins] / len(negatives)
+
+    return rocs, error_bounds
+
+
+def approximate_roc(positives, negatives, thresholds='all', bins=1000, negatives_sample=None, random_state=None):
+    """ calculate an approximate ROC score from sampled and/or binned negatives.
+
+    :type thresholds : string
+    :param thresholds : 'all', 'fixations' (as in `general_roc` with `judd=1`) or 'binned' (see `binned_roc`)
+
+    :type negatives_sample : int
+    :param negatives_sample : if given, use only this many uniformly sampled negatives (see `sampling_error_bound`)
+
+    :return : (auc, error_bound). The bound on the sampling error holds with a confidence of 95%.
+    """
+    sampled_negatives = sample_negatives(negatives, negatives_sample, random_state)
+    error_bound = sampling_error_bound(len(negatives), negatives_sample)
+
+    if thresholds == 'binned':
+        auc, binning_error_bound = binned_roc(positives, sampled_negatives, bins=bins)
+        return auc, error_bound + binning_error_bound
+
+    auc, _, _ = general_roc(np.asarray(positives, dtype=float), np.asarray(sampled_negatives, dtype=float),
+                            judd=int(thresholds == 'fixations'))
+    return auc, error_bound
+
+
+def approximate_rocs_per_positive(positives, negatives, thresholds='all', bins=1000, negatives_sample=None, random_state=None):
+    """ calculate approximate ROC scores of each positive from sampled and/or binned negatives, see `approximate_roc`
+
+    :return : (rocs, error_bounds)
+    """
+    sampled_negatives = sample_negatives(negatives, negatives_sample, random_state)
+    error_bound = sampling_error_bound(len(negatives), negatives_sample)
+
+    if thresholds == 'binned':
+        rocs, binning_error_bounds = binned_rocs_per_positive(positives, sampled_negatives, bins=bins)
+        return rocs, error_bound + binning_error_bounds
+
+    rocs = general_rocs_per_positive(np.asarray(positives, dtype=float), np.asarray(sampled_negatives, dtype=float))
+    return rocs, np.full(len(rocs), error_bound)
@@ -1,23 +1,47 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import copy
+import hashlib
 import os
+import warnings
+import zlib
 from abc import ABCMeta, abstractmethod
+from functools import partial
 from itertools import combinations
 from tempfile import TemporaryDirectory
 
 import numpy as np
-from boltons.cacheutils import LRU, cached
+from boltons.cacheutils import LRU
 from imageio import imsave
 from scipy.io import loadmat
 from scipy.ndimage import gaussian_filter, zoom
 from tqdm import tqdm
 
 from .datasets import Fixations, Stimulus, check_prediction_shape, get_image_hash
+from .datasets.fixations import FixationIndicesByStimulus
 from .metrics import CC, NSS, SIM
-from .numba_utils import auc_for_one_positive, fill_fixation_map
-from .roc import general_roc, general_rocs_per_positive
+from .numba_utils import (
+    auc_for_one_positive,
+    auc_for_one_positive_excluding_itself,
+    fill_fixation_map,
+    general_rocs_per_positive_batch,
+)
+from .parallel import (evaluate_fixation_metric, evaluate_image_metric, evaluate_stimulus_metric, prefetch_predictions,
+                       use_parallel_evaluation)
+from .roc import (
+    approximate_roc,
+    approximate_rocs_per_positive,
+    general_roc,
+    general_rocs_per_positive,
+    general_rocs_per_positive_excluding,
+    general_rocs_per_positive_sorted,
+)
 from .sampling_models import SamplingModelMixin
-from .utils import Cache, average_values, deprecated_class, remove_trailing_nans, run_matlab_cmd
+from .utils import Cache, average_values, deprecated_class, remove_trailing_nans, run_matlab_cmd, update_fingerprint
+
+
+# number of saliency maps for which `SaliencyMapModel.sorted_saliency_values` keeps the sorted values by default
+SORTED_SALIENCY_VALUES_CACHE_SIZE = 32
 
 
 def handle_stimulus(stimulus):
@@ -46,44 +70,245 @@ def normalize_saliency_map(saliency_map, cdf, cdf_bins):
     return smap
 
 
+class ShuffledAUCEngine(object):
+    """ Computes shuffled nonfixations and shuffled AUC scores.
+
+    For shuffled AUC, the nonfixations of a stimulus are the fixations on all other
+    stimuli, rescaled to the size of the stimulus. Instead of rescaling the other fixations
+    for each stimulus, the engine rescales all fixations once for each stimulus size, such that
+    stimuli of the same size share the same rescaled fixations, and excludes the fixations
+    on the stimulus itself by index. Shuffled AUC scores are computed from the counts of
+    smaller and equal nonfixation values, such that the nonfixations never have to be copied.
+
+    `max_cache_bytes` bounds only the memory of the cached rescaled fixations (the coordinates of
+    all fixations for each cached stimulus size). It doesn't include the saliency maps and the
+    saliency values of the nonfixations of the current stimulus, nor the caches of the model
+    (e.g. `SaliencyMapModel.sorted_saliency_values`, bounded by its `memory_cache_size` and
+    `memory_cache_bytes`).
+    """
+    def __init__(self, stimuli, fixations, max_cache_bytes=1024**3):
+        self.xs = np.asarray(fixations.x)
+        self.ys = np.asarray(fixations.y)
+        self.ns = np.asarray(fixations.n)
+        self.widths = np.asarray([s[1] for s in stimuli.sizes]).astype(float)
+        self.heights = np.asarray([s[0] for s in stimuli.sizes]).astype(float)
+        self.max_cache_bytes = max_cache_bytes
+        self._fixation_indices = fixations.fixation_indices_by_stimulus
+        self._setup()
+
+    def _setup(self):
+        if getattr(self, '_fixation_indices', None) is None:
+            self._fixation_indices = FixationIndicesByStimulus(self.ns)
+
+        # sizes of the stimuli of all fixations
+        self._fixation_widths = self.widths[self.ns]
+        self._fixation_heights = self.heights[self.ns]
+
+        bytes_per_size = 2 * len(self.xs) * np.dtype(np.int32).itemsize
+        cache_size = int(self.max_cache_bytes // max(bytes_per_size, 1))
+        self.cache = LRU(cache_size) if cache_size else None
+
+    def rescaled_fixations(self, n):
+        """ x and y coordinates of all fixations rescaled to the size of stimulus `n` """
+        size = (self.heights[n], self.widths[n])
+        if self.cache is not None and size in self.cache:
+            return self.cache[size]
+
+        xs = (self.xs.astype(float) * (size[1] / self._fixation_widths)).astype(np.int32)
+        ys = (self.ys.astype(float) * (size[0] / self._fixation_heights)).astype(np.int32)
+
+        if self.cache is not None:
+            self.cache[size] = xs, ys
+
+        return xs, ys
+
+    def nonfixations_for_image(self, n):
+        """ x and y coordinates of the shuffled nonfixations for stimulus `n` """
+        xs, ys = self.rescaled_fixations(n)
+        inds = self._fixation_indices.other_indices(n)
+        return xs[inds], ys[inds]
+
+    def _values_for_image(self, saliency_map, n):
+        xs, ys = self.rescaled_fixations(n)
+        values = np.asarray(saliency_map[ys, xs]).astype(float)
+        excluded_values = values[self._fixation_indices[n]]
+        return values, excluded_values
+
+    def negative_values(self, saliency_map, n):
+        """ saliency values of the shuffled nonfixations for stimulus `n` """
+        values, _ = self._values_for_image(saliency_map, n)
+        return np.delete(values, self._fixation_indices[n])
+
+    def rocs_per_positive(self, saliency_map, n, positives):
+        """ shuffled AUC score of each positive value for stimulus `n` with the given saliency map,
+        the same as `general_rocs_per_positive(positives, negative_values(saliency_map, n))`.
+        """
+        values, excluded_values = self._values_for_image(saliency_map, n)
+        return general_rocs_per_positive_excluding(np.asarray(positives, dtype=float), values, excluded_values)
+
+    def __getstate__(self):
+        # derived arrays and cached fixations are recomputed after unpickling
+        state = dict(self.__dict__)
+        for key in ['_fixation_indices', '_fixation_widths', '_fixation_heights', 'cache']:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__ = dict(state)
+        self._setup()
+
+
 class FullShuffledNonfixationProvider(object):
-    def __init__(self, stimuli, fixations, max_fixations_in_cache=500*1000*1000):
+    """ Provides the shuffled nonfixations for all stimuli, see `ShuffledAUCEngine`.
+
+    `max_cache_bytes` bounds the memory of the rescaled fixations cached by the engine.
+    `max_fixations_in_cache` is supported for backwards compatibility and overrides
+    `max_cache_bytes` with the size of the given number of cached fixations.
+    """
+    def __init__(self, stimuli, fixations, max_fixations_in_cache=None, max_cache_bytes=1024**3):
+        if max_fixations_in_cache is not None:
+            max_cache_bytes = max_fixations_in_cache * 2 * np.dtype(np.int32).itemsize
         self.stimuli = stimuli
         self.fixations = fixations
-        cache_size = int(max_fixations_in_cache / len(self.fixations.x))
-        self.cache = LRU(cache_size)
-        self.nonfixations_for_image = cached(self.cache)(self._nonfixations_for_image)
-        self.widths = np.asarray([s[1] for s in stimuli.sizes]).astype(float)
-        self.heights = np.asarray([s[0] for s in stimuli.sizes]).astype(float)
+        self.engine = ShuffledAUCEngine(stimuli, fixations, max_cache_bytes=max_cache_bytes)
+        self.stimulus_offset = 0
 
-    def _nonfixations_for_image(self, n):
-        inds = ~(self.fixations.n == n)
-        xs = (self.fixations.x[inds].copy()).astype(float)
-        ys = (self.fixations.y[inds].copy()).astype(float)
+    def for_shard(self, stimulus_offset):
+        """ get a provider for a shard of the stimuli starting at index `stimulus_offset`, see `pysaliency.parallel` """
+        provider = copy.copy(self)
+        provider.stimuli = None
+        provider.fixations = None
+        provider.stimulus_offset = self.stimulus_offset + stimulus_offset
+        return provider
 
-        other_ns = self.fixations.n[inds]
-        xs *= self.stimuli.sizes[n][1]/self.widths[other_ns]
-        ys *= self.stimuli.sizes[n][0]/self.heights[other_ns]
+    def nonfixations_for_image(self, n):
+        return self.engine.nonfixations_for_image(n + self.stimulus_offset)
 
-        return xs.astype(int), ys.astype(int)
+    def negative_values(self, saliency_map, n):
+        return self.engine.negative_values(saliency_map, n + self.stimulus_offset)
+
+    def rocs_per_positive(self, saliency_map, n, positives):
+        return self.engine.rocs_per_positive(saliency_map, n + self.stimulus_offset, positives)
 
     def __call__(self, stimuli, fixations, i):
-        assert stimuli is self.stimuli
+        if self.stimuli is not None:
+            assert stimuli is self.stimuli
         n = fixations.n[i]
         return self.nonfixations_for_image(n)
 
+    def __getstate__(self):
+        # the engine contains everything needed to compute the nonfixations, which
+        # keeps the provider small when sending it to worker processes.
+        state = dict(self.__dict__)
+        state['stimuli'] = None
+        state['fixations'] = None
+        return state
+
+
+def _random_state_for_stimulus(random_seed, stimulus):
+    """ random state for sampling negatives which depends only on the seed and the stimulus,
+    but not on the index of the stimulus in the evaluated stimuli """
+    return np.random.RandomState([random_seed, zlib.crc32(str(stimulus.stimulus_id).encode())])
+
+
+def _fixated_indices(shape, ys, xs):
+    """Return the linear indices of all pixels that have been fixated at least once."""
+    return np.unique(np.ravel_multi_index((np.asarray(ys, dtype=int), np.asarray(xs, dtype=int)), shape))
+
+
+class _UnfixatedValues(object):
+    """Selects the saliency values that have not been fixated at least once.
+
+    Keeps one boolean mask per image shape which is reused for all saliency maps of this
+    shape instead of allocating a new fixation map for each call. The masks live as long as
+    the instance, which the metric methods create for a single evaluation.
+    """
+    def __init__(self):
+        self.masks = {}
+
+    def __call__(self, saliency_map, ys, xs):
+        inds = _fixated_indices(saliency_map.shape, ys, xs)
+        mask = self.masks.get(saliency_map.shape)
+        if mask is None:
+            mask = self.masks[saliency_map.shape] = np.ones(saliency_map.size, dtype=bool)
+
+        mask[inds] = False
+        try:
+            return np.asarray(saliency_map).ravel()[mask]
+        finally:
+            mask[inds] = True
+
 
 def _get_unfixated_values(saliency_map, ys, xs):
     """Return all saliency values that have not been fixated at leat once."""
-    fixation_map = np.zeros(saliency_map.shape)
-    fill_fixation_map(
-        fixation_map,
-        np.array([ys, xs]).T
-    )
-    return saliency_map[fixation_map == 0].flatten()
+    return _UnfixatedValues()(saliency_map, ys, xs)
 
 
-class ScanpathSaliencyMapModel(object, metaclass=ABCMeta):
+class FingerprintMixin(object):
+    """
+    Gives models a stable `fingerprint` built from their class, their parameters and
+    the fingerprints of their parent models.
+
+    The parameters are all public attributes of the model (see `_fingerprint_parameters`).
+    The fingerprint is computed from the current values of the parameters whenever it is
+    needed, such that it also changes if a parameter array is modified in place. This costs
+    hashing all parameter arrays for each cached prediction.
+    If a parameter can't be fingerprinted (see `pysaliency.utils.update_fingerprint`),
+    the fingerprint is None and the predictions are cached by stimulus id only. Since such
+    predictions can be stale once the model changes, a warning is issued if they are stored
+    in a `cache_location`.
+
+    Predictions which earlier versions of pysaliency stored in a `cache_location` by stimulus id
+    only are still used (with a warning) as long as there is no prediction for the fingerprint.
+    """
+    _fingerprint_excluded_parameters = ('caching', 'verbose')
+
+    def _fingerprint_parameters(self):
+        """the parameters that determine the predictions of the model"""
+        return {key: value for key, value in vars(self).items()
+                if not key.startswith('_') and key not in self._fingerprint_excluded_parameters}
+
+    @property
+    def fingerprint(self):
+        """hex digest identifying the predictions of this model, or None"""
+        sha = hashlib.sha1()
+        try:
+            update_fingerprint(sha, (type(self).__module__, type(self).__qualname__, self._fingerprint_parameters()),
+                               owner=self)
+        except TypeError:
+            return None
+        return sha.hexdigest()
+
+    def _cache_key(self, stimulus_id):
+        """key of the prediction for `stimulus_id` in the cache of the model"""
+        fingerprint = self.fingerprint
+        if fingerprint != getattr(self, '_cache_fingerprint', fingerprint) and hasattr(self, '_cache'):
+            # the predictions in memory belong to other parameters, the cache files are kept
+            self._cache.clear()
+        self._cache_fingerprint = fingerprint
+        if fingerprint is None:
+            if getattr(self, 'cache_location', None) is not None and not getattr(self, '_warned_missing_fingerprint', False):
+                self._warned_missing_fingerprint = True
+                warnings.warn("{} can't be fingerprinted, its predictions in {} are cached by stimulus id only and won't"
+                              " be recomputed when the model changes".format(type(self).__name__, self.cache_location))
+            return stimulus_id
+        return '{}-{}'.format(fingerprint, stimulus_id)
+
+    def _get_or_compute_cached(self, stimulus_id, compute):
+        """the cached prediction for `stimulus_id`, computed with `compute()` if it is not cached"""
+        key = self._cache_key(stimulus_id)
+        if key != stimulus_id and self._cache.cache_location is not None and key not in self._cache and stimulus_id in self._cache:
+            # stored by an earlier version of pysaliency, which didn't know about fingerprints
+            if not getattr(self, '_warned_legacy_cache_key', False):
+                self._warned_legacy_cache_key = True
+                warnings.warn("Using predictions of {} which have been cached in {} by stimulus id only by an earlier version"
+                              " of pysaliency. Delete them if they were computed with other parameters.".format(
+                                  type(self).__name__, self._cache.cache_location))
+            return self._cache[stimulus_id]
+        return self._cache.get_or_compute(key, compute)
+
+
+class ScanpathSaliencyMapModel(FingerprintMixin, metaclass=ABCMeta):
     """
     Most general saliency model class. The model is neither
     assumed to be time-independet nor to be a probabilistic
@@ -112,7 +337,7 @@ class ScanpathSaliencyMapModel(object, metaclass=ABCMeta):
         """ returns conditional log density predictions for each fixation """
         return [self.conditional_saliency_map_for_fixation(stimuli, fixations, fixation_index) for fixation_index in tqdm(range(len(fixations)), disable=not verbose)]
 
-    def AUCs(self, stimuli, fixations, nonfixations='uniform', verbose=False):
+    def AUCs(self, stimuli, fixations, nonfixations='uniform', verbose=False, n_jobs=None):
         """
         Calulate AUC scores for fixations
 
@@ -129,11 +354,18 @@ class ScanpathSaliencyMapModel(object, metaclass=ABCMeta):
                                   fixations-object: For each image, use the fixations in this fixation
                                                     object as nonfixations
 
+        :type n_jobs : int or concurrent.futures.Executor
+        :param n_jobs : If given, the stimuli are evaluated in parallel worker processes
+                        (see `pysaliency.parallel`).
+
         :rtype : ndarray
         :return : list of AUC scores for each fixation,
                   ordered as in `fixations.x` (average=='fixation' or None)
                   or by image numbers (average=='image')
         """
+        if use_parallel_evaluation(n_jobs):
+            return evaluate_fixation_metric(partial(ScanpathSaliencyMapModel.AUCs, self), stimuli, fixations, n_jobs=n_jobs, nonfixations=nonfixations, verbose=verbose)
+
         rocs_per_fixation = []
         rocs = {}
         out = None
@@ -144,10 +376,13 @@ class ScanpathSaliencyMapModel(object, metaclass=ABCMeta):
         if isinstance(nonfixations, Fixations):
             nonfix_xs = []
             nonfix_ys = []
+            nonfixation_indices = nonfixations.fixation_indices_by_stimulus
+            nonfixations_x_int = nonfixations.x_int
+            nonfixations_y_int = nonfixations.y_int
             for n in range(fixations.n.max() + 1):
-                inds = nonfixations.n == n
-                nonfix_xs.append(nonfixations.x_int[inds].copy())
-                nonfix_ys.append(nonfixations.y_int[inds].copy())
+                inds = nonfixation_indices[n]
+                nonfix_xs.append(nonfixations_x_int[inds])
+                nonfix_ys.append(nonfixations_y_int[inds])
 
         if nonfixations == 'shuffled':
             nonfixations = FullShuffledNonfixationProvider(stimuli, fixations)
@@ -158,27 +393,30 @@ class ScanpathSaliencyMapModel(object, metaclass=ABCMeta):
 
             positive = out[fixations.y_int[i], fixations.x_int[i]]
             if nonfixations == 'uniform':
-                negatives = out.flatten()
+                negatives = out.ravel()
             elif nonfixations == 'unfixated':
-                negatives = _get_unfixated_values(
-                    out,
-                    [fixations.y_int[i]], [fixations.x_int[i]]
-                )
+                # the only fixated pixel is the one of the positive itself
+                negatives = None
+                this_roc = auc_for_one_positive_excluding_itself(positive, out)
             elif nonfix_xs is not None:
                 n = fixations.n[i]
                 negatives = out[nonfix_ys[n], nonfix_xs[n]]
+            elif isinstance(nonfixations, FullShuffledNonfixationProvider):
+                negatives = None
+                this_roc, = nonfixations.rocs_per_positive(out, fixations.n[i], [positive])
             elif callable(nonfixations):
                 _nonfix_xs, _nonfix_ys = nonfixations(stimuli, fixations, i)
                 negatives = out[_nonfix_ys.astype(int), _nonfix_xs.astype(int)]
             else:
                 raise ValueError("Don't know how to handle nonfixations {}".format(nonfixations))
 
-            this_roc = auc_for_one_positive(positive, negatives)
+            if negatives is not None:
+                this_roc = auc_for_one_positive(positive, negatives)
             rocs.setdefault(fixations.n[i], []).append(this_roc)
             rocs_per_fixation.append(this_roc)
         return np.asarray(rocs_per_fixation)
 
-    def AUC(self, stimuli, fixations, nonfixations='uniform', average='fixation', verbose=False):
+    def AUC(self, stimuli, fixations, nonfixations='uniform', average='fixation', verbose=False, n_jobs=None):
         """
         Calulate AUC scores for fixations
 
@@ -201,21 +439,28 @@ class ScanpathSaliencyMapModel(object, metaclass=ABCMeta):
                              'image': average over images
                              'fixation' or None: Return AUC score for each fixation separately
 
+        :type n_jobs : int or concurrent.futures.Executor
+        :param n_jobs : If given, the stimuli are evaluated in parallel worker processes
+                        (see `pysaliency.parallel`).
+
         :rtype : ndarray
         :return : list of AUC scores for each fixation,
                   ordered as in `fixations.x` (average=='fixation' or None)
                   or by image numbers (average=='image')
         """
-        aucs = self.AUCs(stimuli, fixations, nonfixations=nonfixations, verbose=verbose)
+        aucs = self.AUCs(stimuli, fixations, nonfixations=nonfixations, verbose=verbose, n_jobs=n_jobs)
         return average_values(aucs, fixations, average=average)
 
-    def sAUCs(self, stimuli, fixations, verbose=False):
-        return self.AUCs(stimuli, fixations, nonfixations='shuffled', verbose=verbose)
+    def sAUCs(self, stimuli, fixations, verbose=False, n_jobs=None):
+        return self.AUCs(stimuli, fixations, nonfixations='shuffled', verbose=verbose, n_jobs=n_jobs)
 
-    def sAUC(self, stimuli, fixations, average='fixation', verbose=False):
-        return self.AUC(stimuli, fixations, nonfixations='shuffled', average=average, verbose=verbose)
+    def sAUC(self, stimuli, fixations, average='fixation', verbose=False, n_jobs=None):
+        return self.AUC(stimuli, fixations, nonfixations='shuffled', average=average, verbose=verbose, n_jobs=n_jobs)
+
+    def NSSs(self, stimuli, fixations, verbose=False, n_jobs=None):
+        if use_parallel_evaluation(n_jobs):
+            return evaluate_fixation_metric(partial(ScanpathSaliencyMapModel.NSSs, self), stimuli, fixations, n_jobs=n_jobs, verbose=verbose)
 
-    def NSSs(self, stimuli, fixations, verbose=False):
         values = np.empty(len(fixations.x))
         out = None
 
@@ -225,15 +470,17 @@ class ScanpathSaliencyMapModel(object, metaclass=ABCMeta):
             values[i] = NSS(out, fixations.x_int[i], fixations.y_int[i])
         return values
 
-    def NSS(self, stimuli, fixations, average='fixation', verbose=False):
-        nsss = self.NSSs(stimuli, fixations, verbose=verbose)
+    def NSS(self, stimuli, fixations, average='fixation', verbose=False, n_jobs=None):
+        nsss = self.NSSs(stimuli, fixations, verbose=verbose, n_jobs=n_jobs)
         return average_values(nsss, fixations, average=average)
 
     def set_params(self, **kwargs):
         """
         Set model parameters, if the model has parameters
 
-        This method has to reset caches etc., if the depend on the parameters
+        Parameters stored as public attributes change the `fingerprint` of the model
+        and therefore invalidate cached predictions. Other parameters have to reset
+        the caches.
         """
         if kwargs:
             raise ValueError('Unkown parameters!', kwargs)
@@ -247,8 +494,14 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
     """
 
     def __init__(self, cache_location = None, caching=True,
-                 memory_cache_size=None):
-        self._cache = Cache(cache_location, memory_cache_size=memory_cache_size)
+                 memory_cache_size=None, memory_cache_bytes=None, disk_cache_bytes=None,
+                 mmap_mode=None, cache_backend='npy', cache_locking=False,
+                 storage_dtype=None):
+        self._cache = Cache(cache_location, memory_cache_size=memory_cache_size, memory_cache_bytes=memory_cache_bytes,
+                            disk_cache_bytes=disk_cache_bytes, mmap_mode=mmap_mode,
+                            cache_backend=cache_backend, locking=cache_locking, storage_dtype=storage_dtype)
+        self._sorted_saliency_values_cache = Cache(memory_cache_size=memory_cache_size or SORTED_SALIENCY_VALUES_CACHE_SIZE,
+                                                   memory_cache_bytes=memory_cache_bytes)
         self.caching = caching
 
     @property
@@ -259,6 +512,11 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
     def cache_location(self, value):
         self._cache.cache_location = value
 
+    @property
+    def cache_stats(self):
+        """hits, misses and evictions of the prediction cache, see `pysaliency.utils.Cache.stats`"""
+        return self._cache.stats
+
     def saliency_map(self, stimulus):
         """
         Get saliency map for given stimulus.
@@ -269,10 +527,37 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
         stimulus = handle_stimulus(stimulus)
         if not self.caching:
             return self._saliency_map(stimulus.stimulus_data)
-        stimulus_id = stimulus.stimulus_id
-        if not stimulus_id in self._cache:
-            self._cache[stimulus_id] = self._saliency_map(stimulus.stimulus_data)
-        return self._cache[stimulus_id]
+        return self._get_or_compute_cached(stimulus.stimulus_id, lambda: self._saliency_map(stimulus.stimulus_data))
+
+    def sorted_saliency_values(self, stimulus):
+        """
+        Get all values of the saliency map for given stimulus as float, sorted ascendingly.
+
+        This is used to compute AUC scores with uniform nonfixations by binary search
+        instead of sorting the saliency map again for each evaluation. If caching is
+        enabled, the sorted values of the saliency maps in the memory cache are kept next to
+        them, for at most `memory_cache_size` (default: `SORTED_SALIENCY_VALUES_CACHE_SIZE`)
+        saliency maps.
+        """
+        stimulus = handle_stimulus(stimulus)
+        return self._sorted_saliency_values(stimulus, self.saliency_map(stimulus))
+
+    def _sorted_saliency_values(self, stimulus, saliency_map):
+        cache = getattr(self, '_sorted_saliency_values_cache', None)
+        if not self.caching or cache is None:
+            return np.sort(saliency_map.astype(float), axis=None)
+
+        key = self._cache_key(stimulus.stimulus_id)
+        # the sorted values are only valid as long as the cached saliency map didn't change
+        cached = cache.get_from_memory(key)
+        if cached is not None and cached[0] is saliency_map:
+            return cached[1]
+
+        sorted_values = np.sort(saliency_map.astype(float), axis=None)
+        # saliency maps which are not kept in memory will be loaded as new objects next time
+        if self._cache.get_from_memory(key) is saliency_map:
+            cache[key] = saliency_map, sorted_values
+        return sorted_values
 
     @abstractmethod
     def _saliency_map(self, stimulus):
@@ -290,7 +575,8 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
     def conditional_saliency_map(self, stimulus, *args, **kwargs):
         return self.saliency_map(stimulus)
 
-    def AUCs(self, stimuli, fixations, nonfixations='uniform', verbose=False):
+    def AUCs(self, stimuli, fixations, nonfixations='uniform', verbose=False, n_jobs=None,
+             thresholds='all', bins=1000, negatives_sample=None, random_seed=42, return_error_bounds=False):
         """
         Calulate AUC scores for fixations
 
@@ -307,12 +593,41 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
                                   fixations-object: For each image, use the fixations in this fixation
                                                     object as nonfixations
 
+        :type n_jobs : int or concurrent.futures.Executor
+        :param n_jobs : If given, the stimuli are evaluated in parallel worker processes
+                        (see `pysaliency.parallel`).
+
+        :type thresholds : string
+        :param thresholds : 'all' computes exact AUC scores. 'binned' approximates them using a histogram of the
+                            negatives with `bins` equally sized bins, i.e. counts all negatives in the bin of a fixation
+                            as ties.
+
+        :type negatives_sample : int
+        :param negatives_sample : If given, approximate the AUC scores using only this many negatives of each image,
+                                  sampled uniformly without replacement (seeded with `random_seed` and the stimulus id).
+
+        :type return_error_bounds : bool
+        :param return_error_bounds : If True, additionally return a bound on the approximation error of each AUC
+                                     score (see `pysaliency.roc.approximate_rocs_per_positive`). The bound on the sampling
+                                     error holds with a confidence of 95%.
+
         :rtype : ndarray
         :return : list of AUC scores for each fixation,
                   ordered as in `fixations.x` (average=='fixation' or None)
                   or by image numbers (average=='image')
         """
+        if thresholds not in ['all', 'binned']:
+            raise ValueError("Unknown value of `thresholds`: {}".format(thresholds))
+        approximate = thresholds == 'binned' or negatives_sample is not None
+
+        if use_parallel_evaluation(n_jobs):
+            return evaluate_fixation_metric(partial(SaliencyMapModel.AUCs, self), stimuli, fixations, n_jobs=n_jobs,
+                                            nonfixations=nonfixations, verbose=verbose, thresholds=thresholds, bins=bins,
+                                            negatives_sample=negatives_sample, random_seed=random_seed,
+                                            return_error_bounds=return_error_bounds)
+
         rocs_per_fixation = np.empty(len(fixations.x))
+        error_bounds = np.zeros(len(fixations.x))
 
         nonfix_ys = None
         nonfix_xs = None
@@ -320,32 +635,67 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
         if isinstance(nonfixations, Fixations):
             nonfix_xs = []
             nonfix_ys = []
+            nonfixation_indices = nonfixations.fixation_indices_by_stimulus
+            nonfixations_x_int = nonfixations.x_int
+            nonfixations_y_int = nonfixations.y_int
             for n in range(fixations.n.max()+1):
-                inds = nonfixations.n == n
-                nonfix_xs.append(nonfixations.x_int[inds].copy())
-                nonfix_ys.append(nonfixations.y_int[inds].copy())
+                inds = nonfixation_indices[n]
+                nonfix_xs.append(nonfixations_x_int[inds])
+                nonfix_ys.append(nonfixations_y_int[inds])
 
         if nonfixations == 'shuffled':
             nonfixations = FullShuffledNonfixationProvider(stimuli, fixations)
 
-        for n in tqdm(range(len(stimuli)), total=len(stimuli), disable=not verbose):
-            inds = fixations.n == n
-            if not inds.sum():
-                continue
-            out = self.saliency_map(stimuli.stimulus_objects[n])
+        fixation_indices = fixations.fixation_indices_by_stimulus
+        fixations_x_int = fixations.x_int
+        fixations_y_int = fixations.y_int
+
+        batch_inds = []
+        batch_positives = []
+        batch_negatives = []
+        unfixated_values = _UnfixatedValues()
+
+        indices = [n for n in range(len(stimuli)) if len(fixation_indices[n])]
+        predictions = prefetch_predictions(self.saliency_map, stimuli, indices)
+        for n, out in tqdm(predictions, total=len(indices), disable=not verbose):
+            inds = fixation_indices[n]
+            stimulus = stimuli.stimulus_objects[n]
             check_prediction_shape(out, stimuli[n])
-            positives = np.asarray(out[fixations.y_int[inds], fixations.x_int[inds]])
+            positives = np.asarray(out[fixations_y_int[inds], fixations_x_int[inds]])
             if nonfixations == 'uniform':
-                negatives = out.flatten()
+                if approximate:
+                    negatives = out.flatten()
+                else:
+                    sorted_negatives = self._sorted_saliency_values(handle_stimulus(stimulus), out)
+                    rocs_per_fixation[inds] = general_rocs_per_positive_sorted(positives.astype(float), sorted_negatives)
+                    continue
             elif nonfixations == 'unfixated':
-                negatives = _get_unfixated_values(
-                    out,
-                    fixations.y_int[inds], fixations.x_int[inds]
-                )
+                if approximate:
+                    negatives = unfixated_values(out, fixations_y_int[inds], fixations_x_int[inds])
+                else:
+                    sorted_values = self._sorted_saliency_values(handle_stimulus(stimulus), out)
+                    fixated_values = out.ravel()[_fixated_indices(out.shape, fixations_y_int[inds], fixations_x_int[inds])]
+                    rocs_per_fixation[inds] = general_rocs_per_positive_sorted(
+                        positives.astype(float), sorted_values, excluded_negatives=fixated_values.astype(float)
+                    )
+                    continue
             elif nonfix_xs is not None:
-                negatives = out[nonfix_ys[n], nonfix_xs[n]]
+                if approximate:
+                    negatives = out[nonfix_ys[n], nonfix_xs[n]]
+                else:
+                    # the nonfixation values are small, so all images are evaluated in one batch below
+                    batch_inds.append(inds)
+                    batch_positives.append(positives.astype(float))
+                    batch_negatives.append(out[nonfix_ys[n], nonfix_xs[n]].astype(float))
+                    continue
+            elif isinstance(nonfixations, FullShuffledNonfixationProvider):
+                if approximate:
+                    negatives = nonfixations.negative_values(out, n)
+                else:
+                    rocs_per_fixation[inds] = nonfixations.rocs_per_positive(out, n, positives.astype(float))
+                    continue
             elif callable(nonfixations):
-                _nonfix_xs, _nonfix_ys = nonfixations(stimuli, fixations, np.nonzero(inds)[0][0])
+                _nonfix_xs, _nonfix_ys = nonfixations(stimuli, fixations, inds[0])
                 negatives = out[_nonfix_ys.astype(int), _nonfix_xs.astype(int)]
             else:
                 raise TypeError("Cannot handle nonfixations {}".format(nonfixations))
@@ -353,12 +703,27 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
             positives = positives.astype(float)
             negatives = negatives.astype(float)
 
-            rocs = general_rocs_per_positive(positives, negatives)
+            if approximate:
+                rocs, error_bounds[inds] = approximate_rocs_per_positive(
+                    positives, negatives, thresholds=thresholds, bins=bins, negatives_sample=negatives_sample,
+                    random_state=_random_state_for_stimulus(random_seed, stimulus),
+                )
+            else:
+                rocs = general_rocs_per_positive(positives, negatives)
             rocs_per_fixation[inds] = rocs
 
+        if batch_inds:
+            rocs_per_fixation[np.hstack(batch_inds)] = general_rocs_per_positive_batch(
+                np.hstack(batch_positives), np.cumsum([0] + [len(values) for values in batch_positives]),
+                np.hstack(batch_negatives), np.cumsum([0] + [len(values) for values in batch_negatives]),
+            )
+
+        if return_error_bounds:
+            return rocs_per_fixation, error_bounds
         return rocs_per_fixation
 
-    def AUC_per_image(self, stimuli, fixations, nonfixations='uniform', thresholds='all', verbose=False):
+    def AUC_per_image(self, stimuli, fixations, nonfixations='uniform', thresholds='all', verbose=False, n_jobs=None,
+                      bins=1000, negatives_sample=None, random_seed=42, return_error_bounds=False):
         """
         Calulate AUC scores per image for fixations
 
@@ -375,17 +740,37 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
                                   fixations-object: For each image, use the fixations in this fixation
                                                     object as nonfixations
 
-        :type thresholds: string, either of 'all' or 'fixations'
+        :type thresholds: string, either of 'all', 'fixations' or 'binned'
                           'all' uses all saliency values as threshold, computing the true performance of the saliency
                           map as a binary classifier on the given fixations and nonfixations
                           'fixations' uses only the fixated values as done in AUC_Judd.
+                          'binned' approximates 'all' by using only the edges of `bins` equally sized bins as thresholds.
+
+        :type n_jobs : int or concurrent.futures.Executor
+        :param n_jobs : If given, the stimuli are evaluated in parallel worker processes
+                        (see `pysaliency.parallel`).
+
+        :type negatives_sample : int
+        :param negatives_sample : If given, approximate the AUC scores using only this many negatives of each image,
+                                  sampled uniformly without replacement (seeded with `random_seed` and the stimulus id).
+
+        :type return_error_bounds : bool
+        :param return_error_bounds : If True, additionally return a bound on the approximation error of each AUC
+                                     score (see `pysaliency.roc.approximate_roc`). The bound on the sampling
+                                     error holds with a confidence of 95%.
 
         :rtype : ndarray
         :return : list of AUC scores for each image,
                   or by image numbers (average=='image')
         """
-        rocs_per_image = []
+        if use_parallel_evaluation(n_jobs):
+            return evaluate_image_metric(partial(SaliencyMapModel.AUC_per_image, self), stimuli, fixations, n_jobs=n_jobs,
+                                         nonfixations=nonfixations, thresholds=thresholds, verbose=verbose, bins=bins,
+                                         negatives_sample=negatives_sample, random_seed=random_seed,
+                                         return_error_bounds=return_error_bounds)
+
         out = None
+        unfixated_values = _UnfixatedValues()
 
         nonfix_xs = None
         nonfix_ys = None
@@ -394,52 +779,74 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
             judd = 0
         elif thresholds == 'fixations':
             judd = 1
-        else:
+        elif thresholds != 'binned':
             raise ValueError("Unknown value of `thresholds`: {}".format(thresholds))
+        approximate = thresholds == 'binned' or negatives_sample is not None
 
         if isinstance(nonfixations, Fixations):
             nonfix_xs = []
             nonfix_ys = []
+            nonfixation_indices = nonfixations.fixation_indices_by_stimulus
+            nonfixations_x_int = nonfixations.x_int
+            nonfixations_y_int = nonfixations.y_int
             for n in range(fixations.n.max() + 1):
-                inds = nonfixations.n == n
-                nonfix_xs.append(nonfixations.x_int[inds].copy())
-                nonfix_ys.append(nonfixations.y_int[inds].copy())
+                inds = nonfixation_indices[n]
+                nonfix_xs.append(nonfixations_x_int[inds])
+                nonfix_ys.append(nonfixations_y_int[inds])
 
         if nonfixations == 'shuffled':
             nonfixations = FullShuffledNonfixationProvider(stimuli, fixations)
 
-        for n in tqdm(range(len(stimuli)), disable=not verbose):
-            inds = fixations.n == n
-            if not inds.sum():
-                rocs_per_image.append(np.nan)
-                continue
+        fixation_indices = fixations.fixation_indices_by_stimulus
+        fixations_x_int = fixations.x_int
+        fixations_y_int = fixations.y_int
+
+        # stimuli without fixations keep a score of nan
+        rocs_per_image = [np.nan] * len(stimuli)
+        error_bounds = [np.nan] * len(stimuli)
 
-            out = self.saliency_map(stimuli.stimulus_objects[n])
+        indices = [n for n in range(len(stimuli)) if len(fixation_indices[n])]
+        predictions = prefetch_predictions(self.saliency_map, stimuli, indices)
+
+        for n, out in tqdm(predictions, total=len(indices), disable=not verbose):
+            inds = fixation_indices[n]
+            stimulus = stimuli.stimulus_objects[n]
             check_prediction_shape(out, stimuli[n])
 
-            positives = np.asarray(out[fixations.y_int[inds], fixations.x_int[inds]])
+            positives = np.asarray(out[fixations_y_int[inds], fixations_x_int[inds]])
             if nonfixations == 'uniform':
                 negatives = out.flatten()
             elif nonfixations == 'unfixated':
-                negatives = _get_unfixated_values(
-                    out,
-                    fixations.y_int[inds], fixations.x_int[inds]
-                )
+                negatives = unfixated_values(out, fixations_y_int[inds], fixations_x_int[inds])
             elif nonfix_xs is not None:
                 negatives = out[nonfix_ys[n], nonfix_xs[n]]
+            elif isinstance(nonfixations, FullShuffledNonfixationProvider):
+                negatives = nonfixations.negative_values(out, n)
             elif callable(nonfixations):
-                _nonfix_xs, _nonfix_ys = nonfixations(stimuli, fixations, np.nonzero(inds)[0][0])
+                _nonfix_xs, _nonfix_ys = nonfixations(stimuli, fixations, inds[0])
                 negatives = out[_nonfix_ys.astype(int), _nonfix_xs.astype(int)]
             else:
                 raise TypeError("Cannot handle nonfixations {}".format(nonfixations))
 
             positives = positives.astype(float)
             negatives = negatives.astype(float)
-            this_roc, _, _ = general_roc(positives, negatives, judd=judd)
-            rocs_per_image.append(this_roc)
+            if approximate:
+                this_roc, this_error_bound = approximate_roc(
+                    positives, negatives, thresholds=thresholds, bins=bins, negatives_sample=negatives_sample,
+                    random_state=_random_state_for_stimulus(random_seed, stimulus),
+                )
+            else:
+                this_roc, _, _ = general_roc(positives, negatives, judd=judd)
+                this_error_bound = 0.0
+            rocs_per_image[n] = this_roc
+            error_bounds[n] = this_error_bound
+
+        if return_error_bounds:
+            return rocs_per_image, error_bounds
         return rocs_per_image
 
-    def AUC(self, stimuli, fixations, nonfixations='uniform', average='fixation', thresholds='all', verbose=False):
+    def AUC(self, stimuli, fixations, nonfixations='uniform', average='fixation', thresholds='all', verbose=False, n_jobs=None,
+            bins=1000, negatives_sample=None, random_seed=42, return_error_bound=False):
         """
         Calulate AUC scores for fixations
 
@@ -462,10 +869,23 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
                              'image': average over images
                              'fixation' or None: Return AUC score for each fixation separately
 
-        :type thresholds: string, either of 'all' or 'fixations'
+        :type thresholds: string, either of 'all', 'fixations' or 'binned'
                           'all' uses all saliency values as threshold, computing the true performance of the saliency
                           map as a binary classifier on the given fixations and nonfixations
                           'fixations' uses only the fixated values as done in AUC_Judd.
+                          'binned' approximates 'all' by using only the edges of `bins` equally sized bins as thresholds.
+
+        :type n_jobs : int or concurrent.futures.Executor
+        :param n_jobs : If given, the stimuli are evaluated in parallel worker processes
+                        (see `pysaliency.parallel`).
+
+        :type negatives_sample : int
+        :param negatives_sample : If given, approximate the AUC scores using only this many negatives of each image,
+                                  see `AUC_per_image`.
+
+        :type return_error_bound : bool
+        :param return_error_bound : If True, additionally return a bound on the approximation error, i.e. the
+                                    average of the bounds of the AUC scores of all images.
 
         :rtype : ndarray
         :return : list of AUC scores for each fixation,
@@ -474,17 +894,23 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
         """
         if average not in ['fixation', 'image']:
             raise NotImplementedError()
-        aucs = np.asarray(self.AUC_per_image(stimuli, fixations, nonfixations=nonfixations, thresholds=thresholds, verbose=verbose))
+        aucs, error_bounds = self.AUC_per_image(stimuli, fixations, nonfixations=nonfixations, thresholds=thresholds, verbose=verbose,
+                                                n_jobs=n_jobs, bins=bins, negatives_sample=negatives_sample, random_seed=random_seed,
+                                                return_error_bounds=True)
+        aucs = np.asarray(aucs)
+        error_bounds = np.asarray(error_bounds)
         if average == 'fixation':
+            counts = fixations.fixation_indices_by_stimulus.counts
             weights = np.zeros_like(aucs)
-            for n in set(fixations.n):
-                weights[n] = (fixations.n == n).mean()
+            weights[:len(counts)] = counts / len(fixations.n)
             weights /= weights.sum()
 
             # take care of nans due to no fixations
             aucs[weights == 0] = 0
+            error_bounds[weights == 0] = 0
 
-            return np.average(aucs, weights=weights)
+            auc = np.average(aucs, weights=weights)
+            error_bound = np.average(error_bounds, weights=weights)
         elif average == 'image':
             stimulus_indices = set(fixations.n)
             nan_value_indices = np.nonzero(np.isnan(aucs))[0]
@@ -492,13 +918,27 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
             if stimulus_indices.intersection(nan_value_indices):
                 raise ValueError("Some images with fixations returned AUC of nan, which should not happen")
 
+            error_bounds = error_bounds[~np.isnan(aucs)]
             aucs = aucs[~np.isnan(aucs)]
 
-            return np.mean(aucs)
+            auc = np.mean(aucs)
+            error_bound = np.mean(error_bounds)
         else:
             raise ValueError(average)
 
-    def AUC_Judd(self, stimuli, fixations, jitter=True, noise_size=1.0/10000000, random_seed=42, verbose=False):
+        if return_error_bound:
+            return auc, error_bound
+        return auc
+
+    def AUC_Judd(self, stimuli, fixations, jitter=True, noise_size=1.0/10000000, random_seed=42, verbose=False, n_jobs=None,
+                 negatives_sample=None, return_error_bound=False):
+        """
+        Calculate the AUC score as defined by Judd et al., i.e. with the unfixated pixels as nonfixations,
+        the fixated values as thresholds and averaged over images.
+
+        If `negatives_sample` is given, the score is approximated using only this many unfixated pixels
+        of each image, see `AUC_per_image`.
+        """
         if jitter:
             model = RandomNoiseSaliencyMapModel(
                 self,
@@ -513,7 +953,11 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
             average='image',
             nonfixations='unfixated',
             thresholds='fixations',
-            verbose=verbose
+            verbose=verbose,
+            n_jobs=n_jobs,
+            negatives_sample=negatives_sample,
+            random_seed=random_seed,
+            return_error_bound=return_error_bound,
         )
 
     def fixation_based_KL_divergence(self, stimuli, fixations, nonfixations='shuffled', bins=10, eps=1e-20):
@@ -549,31 +993,41 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
         saliency_min = np.inf
         saliency_max = -np.inf
 
-        for n in range(len(stimuli.stimuli)):
-            saliency_map = self.saliency_map(stimuli[n])
+        fixation_indices = fixations.fixation_indices_by_stimulus
+        fixations_x_int = fixations.x_int
+        fixations_y_int = fixations.y_int
+
+        if nonfixations == 'shuffled':
+            widths = np.asarray([s[1] for s in stimuli.sizes]).astype(float)
+            heights = np.asarray([s[0] for s in stimuli.sizes]).astype(float)
+            fixations_n = np.asarray(fixations.n)
+        elif nonfixations != 'uniform':
+            nonfixation_indices = nonfixations.fixation_indices_by_stimulus
+            nonfixations_x_int = nonfixations.x_int
+            nonfixations_y_int = nonfixations.y_int
+
+        for n, saliency_map in prefetch_predictions(self.saliency_map, stimuli):
             check_prediction_shape(saliency_map, stimuli[n])
             saliency_min = min(saliency_min, saliency_map.min())
             saliency_max = max(saliency_max, saliency_map.max())
 
-            f = fixations[fixations.n == n]
-            fixation_values.append(saliency_map[f.y_int, f.x_int])
+            inds = fixation_indices[n]
+            fixation_values.append(saliency_map[fixations_y_int[inds], fixations_x_int[inds]])
             if nonfixations == 'uniform':
                 nonfixation_values.append(saliency_map.flatten())
             elif nonfixations == 'shuffled':
-                f = fixations[fixations.n != n]
-                widths = np.asarray([s[1] for s in stimuli.sizes]).astype(float)
-                heights = np.asarray([s[0] for s in stimuli.sizes]).astype(float)
-                xs = (f.x.copy())
-                ys = (f.y.copy())
-                other_ns = f.n
+                other_inds = fixation_indices.other_indices(n)
+                xs = fixations.x[other_inds]
+                ys = fixations.y[other_inds]
+                other_ns = fixations_n[other_inds]
 
                 xs *= stimuli.sizes[n][1]/widths[other_ns]
                 ys *= stimuli.sizes[n][0]/heights[other_ns]
 
                 nonfixation_values.append(saliency_map[ys.astype(int), xs.astype(int)])
             else:
-                nonfix = nonfixations[nonfixations.n == n]
-                nonfixation_values.append(saliency_map[nonfix.y_int, nonfix.x_int])
+                nonfix_inds = nonfixation_indices[n]
+                nonfixation_values.append(saliency_map[nonfixations_y_int[nonfix_inds], nonfixations_x_int[nonfix_inds]])
 
         fixation_values = np.hstack(fixation_values)
         nonfixation_values = np.hstack(nonfixation_values)
@@ -589,7 +1043,7 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
 
         return (p_fix * (np.log(p_fix) - np.log(p_nonfix))).sum()
 
-    def image_based_kl_divergences(self, stimuli, gold_standard, minimum_value=1e-20, log_regularization=0, quotient_regularization=0, convert_gold_standard=True, verbose=False):
+    def image_based_kl_divergences(self, stimuli, gold_standard, minimum_value=1e-20, log_regularization=0, quotient_regularization=0, convert_gold_standard=True, verbose=False, n_jobs=None):
         """Calculate image-based KL-Divergences between model and gold standard for each stimulus
 
         This metric computes the KL-Divergence between model predictions and a gold standard
@@ -617,10 +1071,11 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
             prob_gold_standard,
             log_regularization=log_regularization,
             quotient_regularization=quotient_regularization,
-            verbose=verbose
+            verbose=verbose,
+            n_jobs=n_jobs,
         )
 
-    def image_based_kl_divergence(self, stimuli, gold_standard, minimum_value=1e-20, log_regularization=0, quotient_regularization=0, convert_gold_standard=True, verbose=False):
+    def image_based_kl_divergence(self, stimuli, gold_standard, minimum_value=1e-20, log_regularization=0, quotient_regularization=0, convert_gold_standard=True, verbose=False, n_jobs=None):
         """Calculate image-based KL-Divergences between model and gold standard averaged over stimuli
 
         for more details, see `image_based_kl_divergences`.
@@ -630,7 +1085,8 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
                                                        convert_gold_standard=convert_gold_standard,
                                                        log_regularization=log_regularization,
                                                        quotient_regularization=quotient_regularization,
-                                                       verbose=verbose))
+                                                       verbose=verbose,
+                                                       n_jobs=n_jobs))
 
     def KLDivs(self, *args, **kwargs):
         """Alias for image_based_kl_divergence"""
@@ -640,61 +1096,72 @@ class SaliencyMapModel(ScanpathSaliencyMapModel):
         """Alias for image_based_kl_divergence"""
         return self.image_based_kl_divergence(*args, **kwargs)
 
-    def CCs(self, stimuli, other, verbose=False):
+    def CCs(self, stimuli, other, verbose=False, n_jobs=None):
         """ Calculate Correlation Coefficient Metric against some other model
 
         Returns performances for each stimulus. For performance over dataset,
         see `CC`
         """
+        if use_parallel_evaluation(n_jobs):
+            return np.asarray(evaluate_stimulus_metric(partial(SaliencyMapModel.CCs, self), stimuli, n_jobs, other, verbose=verbose))
+
         coeffs = []
 
-        for s in tqdm(stimuli, disable=not verbose):
-            saliency_map_self = self.saliency_map(s)
-            saliency_map_other = other.saliency_map(s)
+        def _saliency_maps(stimulus):
+            return self.saliency_map(stimulus), other.saliency_map(stimulus)
 
-            check_prediction_shape(saliency_map_self, s)
-            check_prediction_shape(saliency_map_other, s)
+        for n, (saliency_map_self, saliency_map_other) in tqdm(prefetch_predictions(_saliency_maps, stimuli), total=len(stimuli), disable=not verbose):
+            check_prediction_shape(saliency_map_self, stimuli[n])
+            check_prediction_shape(saliency_map_other, stimuli[n])
 
             coeffs.append(CC(saliency_map_self, saliency_map_other))
 
         return np.asarray(coeffs)
 
-    def CC(self, stimuli, other, verbose=False):
-        return self.CCs(stimuli, other, verbose=verbose).mean()
+    def CC(self, stimuli, other, verbose=False, n_jobs=None):
+        return self.CCs(stimuli, other, verbose=verbose, n_jobs=n_jobs).mean()
+
+    def NSSs(self, stimuli, fixations, verbose=False, n_jobs=None):
+        if use_parallel_evaluation(n_jobs):
+            return evaluate_fixation_metric(partial(SaliencyMapModel.NSSs, self), stimuli, fixations, n_jobs=n_jobs, verbose=verbose)
 
-    def NSSs(self, stimuli, fixations, verbose=False):
         values = np.empty(len(fixations.x))
-        for n, s in enumerate(tqdm(stimuli, disable=not verbose)):
-            inds = fixations.n == n
-            if not inds.sum():
-                continue
-            smap = self.saliency_map(s).copy()
-            check_prediction_shape(smap, s)
-            values[inds] = NSS(smap, fixations.x_int[inds], fixations.y_int[inds])
+        fixation_indices = fixations.fixation_indices_by_stimulus
+        fixations_x_int = fixations.x_int
+        fixations_y_int = fixations.y_int
+        indices = [n for n in range(len(stimuli)) if len(fixation_indices[n])]
+        predictions = prefetch_predictions(self.saliency_map, stimuli, indices)
+        for n, smap in tqdm(predictions, total=len(indices), disable=not verbose):
+            inds = fixation_indices[n]
+            smap = smap.copy()
+            check_prediction_shape(smap, stimuli[n])
+            values[inds] = NSS(smap, fixations_x_int[inds], fixations_y_int[inds])
 
         return values
 
-    def SIMs(self, stimuli, other, verbose=False):
+    def SIMs(self, stimuli, other, verbose=False, n_jobs=None):
         """ Calculate Similarity Metric against some other model
 
         Returns performances for each stimulus. For performance over dataset,
         see `SIM`
         """
+        if use_parallel_evaluation(n_jobs):
+            return np.asarray(evaluate_stimulus_metric(partial(SaliencyMapModel.SIMs, self), stimuli, n_jobs, other, verbose=verbose))
 
         values = []
-        for s in tqdm(stimuli, disable=not verbose):
-            smap1 = self.saliency_map(s)
-            smap2 = other.saliency_map(s)
+        def _saliency_maps(stimulus):
+            return self.saliency_map(stimulus), other.saliency_map(stimulus)
 
-            check_prediction_shape(smap1, s)
-            check_prediction_shape(smap2, s)
+        for n, (smap1, smap2) in tqdm(prefetch_predictions(_saliency_maps, stimuli), total=len(stimuli), disable=not verbose):
+            check_prediction_shape(smap1, stimuli[n])
+            check_prediction_shape(smap2, stimuli[n])
 
             values.append(SIM(smap1, smap2))
 
         return np.asarray(values)
 
-    def SIM(self, stimuli, other, verbose=False):
-        return self.SIMs(stimuli, other, verbose=verbose).mean()
+    def SIM(self, stimuli, other, verbose=False, n_jobs=None):
+        return self.SIMs(stimuli, other, verbose=verbose, n_jobs=n_jobs).mean()
 
     def __add__(self, other):
         if not isinstance(other, SaliencyMapModel):
@@ -729,6 +1196,10 @@ class CachedSaliencyMapModel(SaliencyMapModel):
             raise ValueError("CachedSaliencyMapModel needs a cache location!")
         super(CachedSaliencyMapModel, self).__init__(cache_location=cache_location, **kwargs)
 
+    def _cache_key(self, stimulus_id):
+        # the precached saliency maps are stored by stimulus id only
+        return stimulus_id
+
     def _saliency_map(self, stimulus):
         raise NotImplementedError()
 
@@ -860,10 +1331,11 @@ class FixationMap(SaliencyMapModel):
 
         self.xs = {}
         self.ys = {}
+        fixation_indices = fixations.fixation_indices_by_stimulus
         for n in range(len(stimuli)):
-            f = fixations[fixations.n == n]
-            self.xs[stimuli.stimulus_ids[n]] = f.x.copy()
-            self.ys[stimuli.stimulus_ids[n]] = f.y.copy()
+            inds = fixation_indices[n]
+            self.xs[stimuli.stimulus_ids[n]] = fixations.x[inds]
+            self.ys[stimuli.stimulus_ids[n]] = fixations.y[inds]
 
         self.kernel_size = kernel_size
         self.convolution_mode = convolution_mode
@@ -990,8 +1462,10 @@ class StimulusDependentSaliencyMapModel(SaliencyMapModel):
 
 
 class ExpSaliencyMapModel(SaliencyMapModel):
-    def __init__(self, parent_model):
-        super(ExpSaliencyMapModel, self).__init__(caching=False)
+    def __init__(self, parent_model, **kwargs):
+        if 'caching' not in kwargs:
+            kwargs['caching'] = False
+        super(ExpSaliencyMapModel, self).__init__(**kwargs)
         self.parent_model = parent_model
 
     def _saliency_map(self, stimulus):
@@ -1012,8 +1486,10 @@ class BluringSaliencyMapModel(SaliencyMapModel):
 
 
 class DigitizeMapModel(SaliencyMapModel):
-    def __init__(self, parent_model, bins=256, return_ints=True):
-        super(DigitizeMapModel, self).__init__(caching=False)
+    def __init__(self, parent_model, bins=256, return_ints=True, **kwargs):
+        if 'caching' not in kwargs:
+            kwargs['caching'] = False
+        super(DigitizeMapModel, self).__init__(**kwargs)
         self.parent_model = parent_model
         self.bins = bins
         self.return_ints = return_ints
@@ -1079,7 +1555,9 @@ class RandomNoiseSaliencyMapModel(LambdaSaliencyMapModel):
 class DensitySaliencyMapModel(SaliencyMapModel):
     """Uses fixation density as predicted by a probabilistic model as saliency maps"""
     def __init__(self, parent_model, **kwargs):
-        super(DensitySaliencyMapModel, self).__init__(caching=False, **kwargs)
+        if 'caching' not in kwargs:
+            kwargs['caching'] = False
+        super(DensitySaliencyMapModel, self).__init__(**kwargs)
         self.parent_model = parent_model
 
     def _saliency_map(self, stimulus):
@@ -1089,7 +1567,9 @@ class DensitySaliencyMapModel(SaliencyMapModel):
 class LogDensitySaliencyMapModel(SaliencyMapModel):
     """Uses fixation log density as predicted by a probabilistic model as saliency maps"""
     def __init__(self, parent_model, **kwargs):
-        super(LogDensitySaliencyMapModel, self).__init__(caching=False, **kwargs)
+        if 'caching' not in kwargs:
+            kwargs['caching'] = False
+        super(LogDensitySaliencyMapModel, self).__init__(**kwargs)
         self.parent_model = parent_model
 
     def _saliency_map(self, stimulus):
@@ -1099,7 +1579,9 @@ class LogDensitySaliencyMapModel(SaliencyMapModel):
 class EqualizedSaliencyMapModel(SaliencyMapModel):
     """Equalizes saliency maps to have uniform histogram"""
     def __init__(self, parent_model, **kwargs):
-        super(EqualizedSaliencyMapModel, self).__init__(caching=False, **kwargs)
+        if 'caching' not in kwargs:
+            kwargs['caching'] = False
+        super(EqualizedSaliencyMapModel, self).__init__(**kwargs)
         self.parent_model = parent_model
 
     def _saliency_map(self, stimulus):
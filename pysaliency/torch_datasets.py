@@ -48,6 +48,9 @@ class ImageDataset(torch.utils.data.Dataset):
         self.transform = transform
         self.average = average
 
+        # decodes the next images ahead while the dataset is read in order (see `STIMULUS_PREFETCH_COUNT`)
+        self._stimulus_loader = stimuli.stimulus_loader()
+
         self.cached = cached
         if cached:
             self._cache = {}
@@ -69,7 +72,7 @@ class ImageDataset(torch.utils.data.Dataset):
 
     def __getitem__(self, key):
         if not self.cached or key not in self._cache:
-            image = np.array(self.stimuli.stimuli[key])
+            image = np.array(self._stimulus_loader[key].stimulus_data)
 
             predictions = {}
             for model_name, model in self.models.items():
@@ -116,6 +119,16 @@ class ImageDataset(torch.utils.data.Dataset):
     def __len__(self):
         return len(self.stimuli)
 
+    def close(self):
+        """ stop the threads decoding the images ahead """
+        self._stimulus_loader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 
 class FixationMaskTransform(object):
     def __call__(self, item):
@@ -6,12 +6,14 @@ import os as _os
 import shutil
 import subprocess as sp
 import sys as _sys
+import threading
+import types
 import warnings
 import warnings as _warnings
+from collections import OrderedDict
 from collections.abc import MutableMapping, Sequence
 from contextlib import ExitStack, contextmanager
 from functools import partial
-from glob import iglob
 from itertools import chain, count, filterfalse, groupby
 from tempfile import mkdtemp
 
@@ -23,6 +25,8 @@ from PIL import Image
 from scipy.interpolate import griddata
 from tqdm import tqdm
 
+from .cache_backends import CACHE_BACKENDS, STORAGE_DTYPES, decode_from_storage, encode_for_storage
+
 
 def build_padded_2d_array(arrays, max_length=None, padding_value=np.nan):
     if max_length is None:
@@ -102,7 +106,7 @@ class LazyList(Sequence):
         As `LazyList` stores the generator function, pickling it
         will usually fail. To pickle a `LazyList`, use `dill`.
     """
-    def __init__(self, generator, length, cache=True, cache_size=None, pickle_cache=False):
+    def __init__(self, generator, length, cache=True, cache_size=None, pickle_cache=False, cache_bytes=None):
         """
         Parameters
         ----------
@@ -120,6 +124,10 @@ class LazyList(Sequence):
         @type  pickle_cache: bool, defaults to `False`
         @param pickle_cache: Whether the cache should be saved when
                              pickling the object.
+
+        @type  cache_bytes: int or `None`
+        @param cache_bytes: If given, the cached items are additionally limited
+                            to a total size of `cache_bytes` (see `ByteLRU`).
         """
         self.generator = generator
         self.length = length
@@ -131,7 +139,13 @@ class LazyList(Sequence):
             else:
                 cache_size = 1000000
         self.cache_size = cache_size
-        self._cache = LRU(max_size=cache_size, on_miss=self.generator)
+        self.cache_bytes = cache_bytes
+        self._cache = self._new_cache(cache_size)
+
+    def _new_cache(self, max_size, values=None):
+        if self.cache_bytes is not None:
+            return ByteLRU(max_size=max_size, max_bytes=self.cache_bytes, values=values, on_miss=self.generator)
+        return LRU(max_size=max_size, values=values, on_miss=self.generator)
 
     def __len__(self):
         return self.length
@@ -165,11 +179,10 @@ class LazyList(Sequence):
         else:
             actual_cache_size = 1
 
-        if not '_cache' in state:
-            state['_cache'] = LRU(max_size=actual_cache_size, on_miss=state['generator'])
-        else:
-            state['_cache'] = LRU(max_size=actual_cache_size, values=state['_cache'], on_miss=state['generator'])
+        values = state.pop('_cache', None)
         self.__dict__ = dict(state)
+        self.__dict__.setdefault('cache_bytes', None)
+        self._cache = self._new_cache(actual_cache_size, values=values)
 
     @property
     def cache(self):
@@ -293,66 +306,342 @@ def download_file_from_google_drive(id, destination):
     gdown.download(id=id, output=destination, quiet=False)
 
 
+def nbytes(value):
+    """size of an array (or a tuple or list of arrays) in bytes"""
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(item) for item in value)
+    if isinstance(value, np.memmap):
+        # memory mapped files live in the page cache, which is shared by all processes
+        return 0
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    return _sys.getsizeof(value)
+
+
+def update_fingerprint(sha, value, owner=None):
+    """Feed a stable representation of `value` into the hashlib object `sha`
+
+    Supported are None, numbers, strings, numpy arrays, tuples, lists, dicts and sets
+    thereof, functions (by their code, constants and closures), bound methods and
+    partials. Objects with a `fingerprint` attribute (e.g. models) are represented by
+    their fingerprint. A bound method
+    of `owner` is represented only by its function to avoid infinite recursions.
+
+    Raises TypeError for values that can't be fingerprinted.
+    """
+    def update(*parts):
+        sha.update(repr(parts).encode('utf8'))
+
+    def recurse(item):
+        update_fingerprint(sha, item, owner=owner)
+
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes, np.generic)):
+        update(type(value).__name__, value)
+    elif isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise TypeError("Can't fingerprint arrays of objects")
+        update('ndarray', value.dtype.str, value.shape)
+        sha.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (tuple, list)):
+        update(type(value).__name__, len(value))
+        for item in value:
+            recurse(item)
+    elif isinstance(value, dict):
+        update('dict', len(value))
+        for key in sorted(value, key=repr):
+            recurse(key)
+            recurse(value[key])
+    elif isinstance(value, (set, frozenset)):
+        update('set', len(value))
+        for item in sorted(value, key=repr):
+            recurse(item)
+    elif hasattr(value, 'fingerprint') and not isinstance(value, type):
+        fingerprint = value.fingerprint
+        if fingerprint is None:
+            raise TypeError("{} has no fingerprint".format(value))
+        update('fingerprint', fingerprint)
+    elif isinstance(value, types.MethodType):
+        update('method')
+        if value.__self__ is not owner:
+            recurse(value.__self__)
+        recurse(value.__func__)
+    elif isinstance(value, types.FunctionType):
+        update('function', value.__module__, value.__qualname__)
+        recurse(value.__code__)
+        recurse(value.__defaults__)
+        recurse(value.__kwdefaults__)
+        recurse([cell.cell_contents for cell in value.__closure__ or ()])
+    elif isinstance(value, types.CodeType):
+        update('code', value.co_code, value.co_names)
+        recurse(tuple(value.co_consts))
+    elif isinstance(value, partial):
+        update('partial')
+        recurse(value.func)
+        recurse(value.args)
+        recurse(value.keywords)
+    elif isinstance(value, np.ufunc):
+        update('ufunc', value.__name__)
+    elif isinstance(value, type) or (callable(value) and hasattr(value, '__module__') and hasattr(value, '__qualname__')):
+        # classes, builtin functions and numpy's array function dispatchers
+        update('callable', value.__module__, value.__qualname__)
+    else:
+        raise TypeError("Can't fingerprint {}".format(type(value)))
+
+
+class ByteLRU(MutableMapping):
+    """Mapping which evicts the least recently used items once it contains
+    more than `max_size` items or once the total size of its items (see `nbytes`)
+    exceeds `max_bytes`. Items which are larger than `max_bytes` are not stored at all.
+
+    If `on_miss` is given, missing items are computed with `on_miss(key)` and stored
+    (like `boltons.cacheutils.LRU`).
+    """
+    def __init__(self, max_size=None, max_bytes=None, values=None, on_miss=None):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.on_miss = on_miss
+        self._items = OrderedDict()
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+        self.evictions = 0
+        if values:
+            self.update(values)
+
+    def __getitem__(self, key):
+        with self._lock:
+            try:
+                value, _ = self._items[key]
+            except KeyError:
+                if self.on_miss is None:
+                    raise
+            else:
+                self._items.move_to_end(key)
+                return value
+
+        # computed outside of the lock, such that other items can be used in the meantime
+        value = self.on_miss(key)
+        self[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        size = nbytes(value)
+        with self._lock:
+            if key in self._items:
+                del self[key]
+
+            if self.max_bytes is not None and size > self.max_bytes:
+                self.evictions += 1
+                return
+
+            self._items[key] = value, size
+            self.total_bytes += size
+
+            while ((self.max_size is not None and len(self._items) > self.max_size)
+                   or (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def __delitem__(self, key):
+        with self._lock:
+            _, size = self._items.pop(key)
+            self.total_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.total_bytes = 0
+
+    def __contains__(self, key):
+        # doesn't count as usage
+        return key in self._items
+
+    def __iter__(self):
+        return iter(list(self._items.keys()))
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_lock')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__ = dict(state)
+        self.__dict__.setdefault('on_miss', None)
+        self._lock = threading.RLock()
+
+
+# number of memory mapped items kept in the memory cache of a `Cache` by default
+MMAP_MEMORY_CACHE_SIZE = 128
+
+
 class Cache(MutableMapping):
     """Cache that supports saving the items to files
 
     Set `cache_location` to save all newly set
     items to .npy files in cache_location.
 
+    `cache_backend` selects how the items are stored in `cache_location`: `'npy'` stores
+    one .npy file per item, `'sharded'` packs the items into a few large files
+    (see `pysaliency.utils.cache_backends`).
+
+    The items kept in memory can be limited to the `memory_cache_size` most recently used
+    items and/or to a total size of `memory_cache_bytes`. The files in `cache_location`
+    can be limited to a total size of `disk_cache_bytes`, in which case the least recently
+    used files are deleted (only for the `'npy'` backend).
+
+    `stats` counts hits in memory and on disk, misses and evictions.
+
+    With `mmap_mode` (e.g. `'r'`), items in `cache_location` are memory mapped (see `numpy.load`)
+    instead of being loaded into memory. Memory mapped items don't count towards
+    `memory_cache_bytes` and processes using the same `cache_location` share them in the page cache.
+    Since every memory map keeps a file descriptor open, the memory cache then keeps at most
+    `memory_cache_size` (default: `MMAP_MEMORY_CACHE_SIZE`) items. With `mmap_mode='r'`, the
+    returned items are read-only and modifying them in place raises an error. Use `mmap_mode='c'`
+    for items that can be modified without changing the files.
+
+    With `storage_dtype` (`'float32'`, `'float16'` or `'uint16'`), floating point items are stored
+    in `cache_location` with less precision to save disk space and I/O. Items are returned as they
+    have been stored, also when they are set. See `pysaliency.utils.cache_backends.encode_for_storage`
+    for the resulting errors of the values and metrics.
+
+    Items are written atomically to `cache_location`, such that several processes can share it.
+    With `locking`, `get_or_compute` makes sure that only one process computes a missing item
+    while the other processes wait for its result.
+
     .. warning ::
         Items that have been set before setting `cache_location` won't
         be saved to files!
 
     """
     def __init__(self, cache_location=None, pickle_cache=False,
-                 memory_cache_size=None):
-        if memory_cache_size:
-            self._cache = LRU(max_size=memory_cache_size)
-        else:
-            self._cache = {}
+                 memory_cache_size=None, memory_cache_bytes=None, disk_cache_bytes=None, mmap_mode=None,
+                 cache_backend='npy', locking=False, storage_dtype=None):
+        if cache_backend not in CACHE_BACKENDS:
+            raise ValueError("Unknown cache backend {}".format(cache_backend))
+        if storage_dtype is not None and storage_dtype not in STORAGE_DTYPES:
+            raise ValueError("Unknown storage dtype {}".format(storage_dtype))
+        self.memory_cache_size = memory_cache_size
+        self.mmap_mode = mmap_mode
+        self.memory_cache_bytes = memory_cache_bytes
+        self.disk_cache_bytes = disk_cache_bytes
+        self.cache_backend = cache_backend
+        self.locking = locking
+        self.storage_dtype = storage_dtype
+        self._cache = self._new_memory_cache()
         self.cache_location = cache_location
         self.pickle_cache = pickle_cache
+        self._reset_stats()
+        self._backend = None
+
+    def _new_memory_cache(self):
+        max_size = self.memory_cache_size or None
+        if max_size is None and self.mmap_mode is not None:
+            max_size = MMAP_MEMORY_CACHE_SIZE
+        if max_size is not None or self.memory_cache_bytes is not None:
+            return ByteLRU(max_size=max_size, max_bytes=self.memory_cache_bytes)
+        return {}
+
+    def _reset_stats(self):
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    @property
+    def backend(self):
+        """the backend storing the items in `cache_location` (or None)"""
+        if self.cache_location is None:
+            return None
+        if self._backend is None or self._backend.location != self.cache_location:
+            self._backend = CACHE_BACKENDS[self.cache_backend](self.cache_location, mmap_mode=self.mmap_mode,
+                                                               max_bytes=self.disk_cache_bytes)
+        return self._backend
+
+    @property
+    def stats(self):
+        """counts of hits in memory and on disk, misses and evictions from memory and disk"""
+        stats = dict(self._stats)
+        stats['evictions'] = getattr(self._cache, 'evictions', 0)
+        stats['disk_evictions'] = self._backend.evictions if self._backend is not None else 0
+        if isinstance(self._cache, ByteLRU):
+            stats['memory_bytes'] = self._cache.total_bytes
+        else:
+            stats['memory_bytes'] = sum(nbytes(value) for value in self._cache.values())
+        return stats
 
     def clear(self):
         """ Clear memory cache"""
-        self._cache = {}
+        self._cache = self._new_memory_cache()
 
     def filename(self, key):
         return os.path.join(self.cache_location, '{}.npy'.format(key))
 
+    def __contains__(self, key):
+        if key in self._cache:
+            return True
+        return self.backend is not None and key in self.backend
+
     def __getitem__(self, key):
-        if not key in self._cache:
-            if self.cache_location is not None:
-                filename = self.filename(key)
-                if os.path.exists(filename):
-                    value = np.load(filename)
-                    self._cache[key] = value
-                else:
-                    raise KeyError('Key {} neither in cache nor on disk'.format(key))
-        return self._cache[key]
+        if key in self._cache:
+            self._stats['memory_hits'] += 1
+            return self._cache[key]
+        if self.backend is not None:
+            try:
+                value = decode_from_storage(self.backend.load(key))
+            except KeyError:
+                pass
+            else:
+                self._cache[key] = value
+                self._stats['disk_hits'] += 1
+                return value
+        self._stats['misses'] += 1
+        raise KeyError('Key {} neither in cache nor on disk'.format(key))
+
+    def get_from_memory(self, key, default=None):
+        """return the item `key` if it is kept in memory, without loading it from `cache_location`"""
+        if key in self._cache:
+            return self._cache[key]
+        return default
+
+    def get_or_compute(self, key, compute):
+        """return the item `key`. If it is not cached, it is computed with `compute()` and stored.
+
+        With `locking` and a `cache_location`, other processes computing the same item wait for
+        the result instead of computing it again.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
 
-    def __setitem__(self, key, value):
+        if self.locking and self.backend is not None:
+            with self.backend.lock(key):
+                # another process might have computed the item while we were waiting for the lock
+                if key in self.backend:
+                    return self[key]
+                return self._store(key, compute())
+
+        return self._store(key, compute())
+
+    def _store(self, key, value):
+        """store `value` and return the value as it will be returned from the cache"""
         if not isinstance(key, str):
             raise TypeError('Only string keys are supported right now!')
-        if self.cache_location is not None:
-            if not os.path.exists(self.cache_location):
-                os.makedirs(self.cache_location)
-            filename = self.filename(key)
-            np.save(filename, value)
+        if self.backend is not None:
+            value = decode_from_storage(self.backend.save(key, encode_for_storage(value, self.storage_dtype)))
         self._cache[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._store(key, value)
 
     def __delitem__(self, key):
-        if self.cache_location is not None:
-            filename = self.filename(key)
-            if os.path.exists(filename):
-                os.remove(filename)
+        if self.backend is not None:
+            self.backend.delete(key)
         del self._cache[key]
 
     def __iter__(self):
-        if self.cache_location is not None:
-            filenames = iglob(self.filename('*'))
-            keys = map(lambda f: os.path.splitext(os.path.basename(f))[0], filenames)
-            new_keys = filterfalse(lambda key: key in self._cache.keys(), keys)
+        if self.backend is not None:
+            new_keys = filterfalse(lambda key: key in self._cache.keys(), self.backend.keys())
             return chain(iter(self._cache.keys()), new_keys)
         else:
             return iter(self._cache.keys())
@@ -366,23 +655,38 @@ class Cache(MutableMapping):
         state = dict(self.__dict__)
         if not self.pickle_cache:
             state.pop('_cache')
+        state['_backend'] = None
         return state
 
     def __setstate__(self, state):
-        if not '_cache' in state:
-            if state.get('memory_cache_size'):
-                state['_cache'] = LRU(max_size=memory_cache_size)
-            else:
-                state['_cache'] = {}
-        self.__dict__ = dict(state)
+        state = dict(state)
+        state.setdefault('memory_cache_bytes', None)
+        state.setdefault('disk_cache_bytes', None)
+        state.setdefault('mmap_mode', None)
+        state.setdefault('cache_backend', 'npy')
+        state.setdefault('locking', False)
+        state.setdefault('storage_dtype', None)
+        state['_backend'] = None
+        self.__dict__ = state
+        if '_stats' not in state:
+            self._reset_stats()
+        if '_cache' not in state:
+            self._cache = self._new_memory_cache()
 
 
 def average_values(values, fixations, average='fixation'):
+    return average_values_by_stimulus(values, fixations.n, average=average)
+
+
+def average_values_by_stimulus(values, ns, average='fixation'):
+    """average values of fixations on the stimuli with indices `ns` either over all
+    fixations (`average='fixation'`) or first over the fixations of each stimulus
+    and then over stimuli (`average='image'`)"""
     if average == 'fixation':
         return np.mean(values)
     elif average == 'image':
         import pandas as pd
-        df = pd.DataFrame({'n': fixations.n, 'value': values})
+        df = pd.DataFrame({'n': ns, 'value': values})
         return df.groupby('n')['value'].mean().mean()
     else:
         raise ValueError(average)
@@ -0,0 +1,503 @@
+"""
+Backends storing the items of `pysaliency.utils.Cache` in its `cache_location`.
+
+`NpyDirectoryBackend` stores each item in its own `.npy` file. `ShardedBackend` packs
+all items into a few append-only shard files and keeps an index of the offsets of the items,
+which avoids millions of small files and directory listings for large caches.
+
+Both backends write atomically, such that processes sharing a location never see partially
+written items, and provide per-key locks (`CacheBackend.lock`) which processes can use to
+avoid computing the same item more than once.
+
+`encode_for_storage` and `decode_from_storage` implement the lossy storage dtypes of `Cache`.
+"""
+
+import json
+import os
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from glob import iglob
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class _FileLock(object):
+    """ the state of a file lock within this process """
+    def __init__(self):
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+
+
+@contextmanager
+def locked_file(filename):
+    """ context manager holding an exclusive lock on `filename`, waiting until other processes release it
+
+    The lock is reentrant: a thread which already holds the lock (e.g. a model computing a parent
+    model with the same cache location) doesn't wait for itself. Other threads of the same
+    process wait like other processes.
+    """
+    if fcntl is None:
+        raise NotImplementedError("Locking files is not supported on this platform")
+
+    filename = os.path.abspath(filename)
+    with _file_locks_lock:
+        file_lock = _file_locks.setdefault(filename, _FileLock())
+
+    with file_lock.thread_lock:
+        if not file_lock.depth:
+            # flock locks belong to the open file, opening the file again would wait for our own lock
+            f = open(filename, 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            except BaseException:
+                f.close()
+                raise
+            file_lock.file = f
+        file_lock.depth += 1
+        try:
+            yield
+        finally:
+            file_lock.depth -= 1
+            if not file_lock.depth:
+                fcntl.flock(file_lock.file, fcntl.LOCK_UN)
+                file_lock.file.close()
+                file_lock.file = None
+
+
+def atomic_save(filename, value):
+    """ save `value` as .npy file to `filename` such that other processes never see a partially written file """
+    directory, basename = os.path.split(filename)
+    # temporary files start with a dot to be excluded from globs
+    temp_filename = os.path.join(directory, '.{}.{}.tmp'.format(basename, uuid.uuid4().hex))
+    # unlike tempfile, respect the umask for the permissions of the final file
+    fd = os.open(temp_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with open(fd, 'wb') as f:
+            np.save(f, value)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+
+
+STORAGE_DTYPES = ['float32', 'float16', 'uint16']
+
+# uint16 codes reserved for non-finite values
+_QUANTIZATION_LEVELS = 65533
+_QUANTIZED_SPECIAL_VALUES = {65533: -np.inf, 65534: np.inf, 65535: np.nan}
+
+
+def encode_for_storage(value, storage_dtype):
+    """ encode a floating point array to store it with less precision.
+
+    `storage_dtype` can be
+      - `'float32'`: each value has a relative error of at most 2**-24 (6e-8),
+      - `'float16'`: each array is scaled by a power of two such that its largest absolute finite value `m` is
+        stored close to the largest float16 value. Values with absolute values of at least `m * 2**-28` have a
+        relative error of at most 2**-11 (4.9e-4). Smaller values end up in the subnormal range of float16 and
+        have an absolute error of at most `m * 2**-39` instead, values below `m * 2**-40` become zero.
+        Without the scaling, e.g. densities below 6.1e-5 would already be subnormal.
+      - `'uint16'`: the finite values of each array are quantized to 65533 equally spaced levels between their
+        minimum and maximum, hence each value has an absolute error of at most `(max - min) / 131064`.
+        Infinite values and NaNs are stored exactly.
+
+    All of them round monotonically: values never change their order, but close values can become equal.
+    With `eps` the maximal error of the stored values and `sigma` the standard deviation of a saliency
+    map, this bounds the error of the metrics computed from stored predictions:
+      - AUC (all variants): at most half the fraction of pairs of fixation and nonfixation values which
+        are stored as the same value, i.e. 0 if they are all more than `2 * eps` apart. For saliency maps
+        with large, almost constant regions (e.g. the tails of a Gaussian) `'uint16'` can result in many
+        such pairs and AUC scores of single fixations can change considerably. `'float32'` is safer there.
+      - NSS: at most `eps * (2 + |NSS|) / sigma` (to first order).
+      - CC: at most `2 * eps / sigma` (to first order).
+      - LL and IG from stored log densities: at most `eps` nats or `eps / log(2)` bits.
+      - image based KL divergence from stored log densities: at most `2 * eps`.
+
+    Other arrays are returned unchanged.
+    """
+    value = np.asarray(value)
+    if storage_dtype is None or not np.issubdtype(value.dtype, np.floating):
+        return value
+    if storage_dtype not in STORAGE_DTYPES:
+        raise ValueError("Unknown storage dtype {}".format(storage_dtype))
+
+    if storage_dtype == 'float32':
+        return value.astype(np.float32)
+
+    finite = np.isfinite(value)
+    finite_values = value[finite]
+
+    if storage_dtype == 'float16':
+        max_value = np.abs(finite_values).max() if len(finite_values) else 0.0
+        if max_value > np.finfo(np.float32).max:
+            raise ValueError("Values are too large to be decoded as float32")
+        scale = 1.0
+        if max_value > 0:
+            # max_value / scale is in [2**14, 2**15). Scaling by powers of two is exact.
+            _, exponent = np.frexp(max_value)
+            scale = np.ldexp(1.0, int(exponent) - 15)
+        encoded = np.zeros((), dtype=[('scale', '<f8'), ('data', '<f2', value.shape)])
+        encoded['scale'] = scale
+        encoded['data'] = value / scale
+        return encoded
+
+    offset = finite_values.min() if len(finite_values) else 0.0
+    scale = (finite_values.max() - offset) / (_QUANTIZATION_LEVELS - 1) if len(finite_values) else 0.0
+    data = np.zeros(value.shape, dtype=np.uint16)
+    if scale > 0:
+        data[finite] = np.round((finite_values - offset) / scale)
+    for code, special_value in _QUANTIZED_SPECIAL_VALUES.items():
+        data[np.isnan(value) if np.isnan(special_value) else value == special_value] = code
+
+    encoded = np.zeros((), dtype=[('offset', '<f8'), ('scale', '<f8'), ('data', '<u2', value.shape)])
+    encoded['offset'] = offset
+    encoded['scale'] = scale
+    encoded['data'] = data
+    return encoded
+
+
+def _is_encoded(value, names, data_dtype):
+    """ whether `value` has the structured dtype which `encode_for_storage` uses to record the scale of the data """
+    return value.dtype.names == names and value.dtype['data'].base == np.dtype(data_dtype)
+
+
+def decode_from_storage(value):
+    """ decode an array encoded with `encode_for_storage`.
+
+    Arrays encoded as float16 are decoded as float32, quantized arrays as float64. All other arrays,
+    including float16 arrays stored without `storage_dtype`, are returned unchanged.
+    """
+    if _is_encoded(value, ('scale', 'data'), '<f2'):
+        return value['data'].astype(np.float32) * np.float32(value['scale'])
+    if not _is_encoded(value, ('offset', 'scale', 'data'), '<u2'):
+        return value
+
+    data = value['data']
+    decoded = data * float(value['scale']) + float(value['offset'])
+    for code, special_value in _QUANTIZED_SPECIAL_VALUES.items():
+        decoded[data == code] = special_value
+    return decoded
+
+
+def _dtype_from_descr(descr):
+    """ inverse of `np.lib.format.dtype_to_descr` after a roundtrip through json """
+    def convert(descr):
+        if isinstance(descr, str):
+            return descr
+        return [(field[0], convert(field[1])) + tuple(tuple(shape) for shape in field[2:]) for field in descr]
+    return np.lib.format.descr_to_dtype(convert(descr))
+
+
+class CacheBackend(object):
+    """ Base class of the backends, storing items in the directory `location`. """
+    lock_count = 1024
+
+    def __init__(self, location):
+        self.location = location
+
+    def _ensure_location(self):
+        if not os.path.exists(self.location):
+            os.makedirs(self.location, exist_ok=True)
+
+    def _lock_filename(self, name):
+        lock_directory = os.path.join(self.location, '.locks')
+        if not os.path.exists(lock_directory):
+            os.makedirs(lock_directory, exist_ok=True)
+        return os.path.join(lock_directory, '{}.lock'.format(name))
+
+    def lock(self, key):
+        """ context manager holding a lock for `key` shared by all processes using the same location.
+
+        The keys are distributed over `lock_count` lock files, hence different keys can share the same lock.
+        """
+        return locked_file(self._lock_filename(zlib.crc32(key.encode()) % self.lock_count))
+
+
+class NpyDirectoryBackend(CacheBackend):
+    """Stores each item as `{key}.npy` in `location`.
+
+    If `max_bytes` is given, the least recently used files are deleted once the files
+    exceed this total size. The usage is tracked in memory and via the modification times
+    of the files, such that it carries over to new processes.
+    """
+    def __init__(self, location, mmap_mode=None, max_bytes=None):
+        super(NpyDirectoryBackend, self).__init__(location)
+        self.mmap_mode = mmap_mode
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._usage = None
+
+    def filename(self, key):
+        return os.path.join(self.location, '{}.npy'.format(key))
+
+    def _get_usage(self):
+        """sizes of the files ordered from least to most recently used"""
+        if self._usage is None:
+            entries = []
+            if os.path.isdir(self.location):
+                for entry in os.scandir(self.location):
+                    if entry.name.endswith('.npy'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, os.path.splitext(entry.name)[0], stat.st_size))
+            self._usage = OrderedDict((key, size) for _, key, size in sorted(entries))
+        return self._usage
+
+    def _touch(self, key, filename):
+        if self.max_bytes is None:
+            return
+        usage = self._get_usage()
+        usage[key] = os.path.getsize(filename)
+        usage.move_to_end(key)
+        os.utime(filename)
+
+    def _evict(self, keep_key):
+        usage = self._get_usage()
+        total_bytes = sum(usage.values())
+        for key in list(usage.keys()):
+            if total_bytes <= self.max_bytes:
+                break
+            if key == keep_key:
+                continue
+            total_bytes -= usage.pop(key)
+            try:
+                os.remove(self.filename(key))
+            except FileNotFoundError:
+                # already removed, e.g. by another process using the same location
+                pass
+            self.evictions += 1
+
+    def __contains__(self, key):
+        return os.path.exists(self.filename(key))
+
+    def load(self, key):
+        filename = self.filename(key)
+        try:
+            value = np.load(filename, mmap_mode=self.mmap_mode)
+        except FileNotFoundError:
+            # might have been evicted by another process in the meantime
+            raise KeyError(key)
+        self._touch(key, filename)
+        return value
+
+    def save(self, key, value):
+        """store `value` and return the value to keep in memory"""
+        self._ensure_location()
+        filename = self.filename(key)
+        atomic_save(filename, value)
+        self._touch(key, filename)
+        if self.max_bytes is not None:
+            self._evict(keep_key=key)
+        if self.mmap_mode is not None:
+            # keep only the memory mapped file, such that the item can be freed from memory
+            return np.load(filename, mmap_mode=self.mmap_mode)
+        return value
+
+    def delete(self, key):
+        filename = self.filename(key)
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+        if self._usage is not None:
+            self._usage.pop(key, None)
+
+    def keys(self):
+        filenames = iglob(self.filename('*'))
+        return map(lambda f: os.path.splitext(os.path.basename(f))[0], filenames)
+
+
+class ShardedBackend(CacheBackend):
+    """Packs the items into append-only shard files `shard-{number}.bin` in `location`.
+
+    The raw data of each item is appended to the current shard, a new shard is started
+    once the current shard would exceed `max_shard_bytes`. `index.jsonl` records the shard,
+    offset, dtype and shape of each item and is read into memory, such that looking up and
+    listing keys doesn't touch the shard files. Index entries appended by other processes
+    are read when a key is not found. Deleting or overwriting items only appends to the index,
+    `compact` removes the unused data.
+
+    Appending is guarded by a lock shared by all processes. The index entry of an item is written
+    only after its data, such that readers never see partially written items.
+
+    With `mmap_mode`, items are memory mapped from the shard files instead of being read into memory.
+    """
+    index_filename = 'index.jsonl'
+
+    def __init__(self, location, mmap_mode=None, max_bytes=None, max_shard_bytes=1024**3):
+        if max_bytes is not None:
+            raise ValueError("ShardedBackend doesn't support limiting the size of the cache on disk")
+        super(ShardedBackend, self).__init__(location)
+        self.mmap_mode = mmap_mode
+        self.max_shard_bytes = max_shard_bytes
+        self.evictions = 0
+        self._index = OrderedDict()
+        self._index_position = 0
+        self._current_shard = self._last_shard_number()
+        self._read_index()
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.location, self.index_filename)
+
+    def _shard_path(self, shard):
+        return os.path.join(self.location, 'shard-{:05d}.bin'.format(shard))
+
+    def _shard_numbers(self):
+        return [int(os.path.basename(filename)[len('shard-'):-len('.bin')])
+                for filename in iglob(os.path.join(self.location, 'shard-*.bin'))]
+
+    def _last_shard_number(self):
+        return max(self._shard_numbers(), default=0)
+
+    def _read_index(self):
+        """read the index entries which have been appended since the last call"""
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, 'rb') as f:
+            f.seek(self._index_position)
+            data = f.read()
+
+        # the last line might not be written completely yet
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            self._apply_entry(json.loads(line.decode('utf-8')))
+        self._index_position += end
+
+    def _apply_entry(self, entry):
+        if entry.get('deleted'):
+            self._index.pop(entry['key'], None)
+        else:
+            self._index[entry['key']] = entry
+            self._current_shard = max(self._current_shard, entry['shard'])
+
+    def _append_entry(self, entry):
+        # read entries of other processes first to keep the file position in sync
+        self._read_index()
+        with open(self._index_path, 'ab') as f:
+            f.write((json.dumps(entry) + '\n').encode('utf-8'))
+        self._read_index()
+
+    def _append_lock(self):
+        return locked_file(self._lock_filename('append'))
+
+    def _entry(self, key):
+        if key not in self._index:
+            self._read_index()
+        return self._index.get(key)
+
+    def __contains__(self, key):
+        return self._entry(key) is not None
+
+    def _load_entry(self, entry):
+        dtype = _dtype_from_descr(entry['dtype'])
+        shape = tuple(entry['shape'])
+        if not np.prod(shape):
+            return np.empty(shape, dtype=dtype)
+        if self.mmap_mode is not None:
+            return np.memmap(self._shard_path(entry['shard']), dtype=dtype, mode=self.mmap_mode,
+                             offset=entry['offset'], shape=shape)
+        with open(self._shard_path(entry['shard']), 'rb') as f:
+            f.seek(entry['offset'])
+            return np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+    def load(self, key):
+        entry = self._entry(key)
+        if entry is None:
+            raise KeyError(key)
+        return self._load_entry(entry)
+
+    def _append_data(self, value):
+        shard_path = self._shard_path(self._current_shard)
+        size = os.path.getsize(shard_path) if os.path.exists(shard_path) else 0
+        if size and size + value.nbytes > self.max_shard_bytes:
+            self._current_shard += 1
+            shard_path = self._shard_path(self._current_shard)
+
+        with open(shard_path, 'ab') as f:
+            offset = f.tell()
+            value.tofile(f)
+
+        return self._current_shard, offset
+
+    def save(self, key, value):
+        """store `value` and return the value to keep in memory"""
+        value = np.asarray(value)
+        if not value.flags.c_contiguous:
+            value = np.ascontiguousarray(value)
+        if value.dtype.hasobject:
+            raise ValueError("ShardedBackend can't store arrays of objects")
+        self._ensure_location()
+
+        with self._append_lock():
+            # other processes might have started a new shard
+            self._read_index()
+            shard, offset = self._append_data(value)
+            entry = {'key': key, 'shard': shard, 'offset': offset, 'dtype': np.lib.format.dtype_to_descr(value.dtype),
+                     'shape': list(value.shape)}
+            self._append_entry(entry)
+
+        if self.mmap_mode is not None:
+            return self._load_entry(entry)
+        return value
+
+    def delete(self, key):
+        if key in self:
+            with self._append_lock():
+                self._append_entry({'key': key, 'deleted': True})
+
+    def keys(self):
+        self._read_index()
+        return iter(list(self._index.keys()))
+
+    def __len__(self):
+        self._read_index()
+        return len(self._index)
+
+    def compact(self):
+        """rewrite all items into new shards, dropping deleted and overwritten data.
+
+        This must not run while other processes use the same location.
+        """
+        with self._append_lock():
+            self._compact()
+
+    def _compact(self):
+        self._read_index()
+        old_shards = self._shard_numbers()
+        self._current_shard = max(old_shards, default=0) + 1
+
+        new_index = OrderedDict()
+        for key, entry in self._index.items():
+            shard, offset = self._append_data(np.asarray(self._load_entry(entry)))
+            new_index[key] = dict(entry, shard=shard, offset=offset)
+
+        new_index_path = self._index_path + '.tmp'
+        with open(new_index_path, 'wb') as f:
+            for entry in new_index.values():
+                f.write((json.dumps(entry) + '\n').encode('utf-8'))
+        os.replace(new_index_path, self._index_path)
+
+        for shard in old_shards:
+            os.remove(self._shard_path(shard))
+
+        self._index = new_index
+        self._index_position = os.path.getsize(self._index_path)
+
+
+CACHE_BACKENDS = {
+    'npy': NpyDirectoryBackend,
+    'sharded': ShardedBackend,
+}
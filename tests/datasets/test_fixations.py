@@ -10,6 +10,7 @@ from test_helpers import TestWithData
 
 import pysaliency
 from pysaliency.datasets import Fixations, FixationTrains, ScanpathFixations, scanpaths_from_fixations
+from pysaliency.datasets.fixations import FixationIndicesByStimulus
 from pysaliency.datasets.scanpaths import Scanpaths
 from pysaliency.utils.variable_length_array import VariableLengthArray
 from tests.datasets.utils import assert_fixation_trains_equal, assert_fixations_equal, assert_scanpath_fixations_equal, assert_scanpaths_equal, assert_variable_length_array_equal, compare_fixations_subset
@@ -630,4 +631,28 @@ def test_scanpaths_from_fixations(fixation_indices):
     new_scanpath_fixations, new_indices = scanpaths_from_fixations(sub_fixations)
     new_sub_fixations = new_scanpath_fixations[new_indices]
 
-    assert_fixations_equal(sub_fixations, new_sub_fixations, crop_length=True)
\ No newline at end of file
+    assert_fixations_equal(sub_fixations, new_sub_fixations, crop_length=True)
+
+@given(st.lists(st.integers(min_value=0, max_value=10), max_size=50))
+def test_fixation_indices_by_stimulus(ns):
+    ns = np.array(ns, dtype=int)
+    fixation_indices = FixationIndicesByStimulus(ns)
+
+    for n in range(12):
+        np.testing.assert_array_equal(fixation_indices[n], np.nonzero(ns == n)[0])
+        assert fixation_indices.count(n) == (ns == n).sum()
+        np.testing.assert_array_equal(np.sort(fixation_indices.other_indices(n)), np.nonzero(ns != n)[0])
+
+
+def test_fixations_fixation_indices_by_stimulus(fixation_trains):
+    fixation_indices = fixation_trains.fixation_indices_by_stimulus
+    assert fixation_trains.fixation_indices_by_stimulus is fixation_indices
+
+    for n in range(fixation_trains.n.max() + 1):
+        np.testing.assert_array_equal(fixation_indices[n], np.nonzero(fixation_trains.n == n)[0])
+
+    fixation_trains.n = fixation_trains.n[::-1].copy()
+    new_fixation_indices = fixation_trains.fixation_indices_by_stimulus
+    assert new_fixation_indices is not fixation_indices
+    for n in range(fixation_trains.n.max() + 1):
+        np.testing.assert_array_equal(new_fixation_indices[n], np.nonzero(fixation_trains.n == n)[0])
@@ -1,7 +1,9 @@
 from __future__ import absolute_import, division, print_function
 
+import os
 import os.path
 import pickle
+import threading
 import unittest
 from copy import deepcopy
 
@@ -187,6 +189,139 @@ def test_stimuli_attributes(stimuli_with_attributes, tmp_path):
 
 
 
+@pytest.mark.parametrize('options', [
+    {},
+    {'compression_opts': 1, 'shuffle': True, 'n_jobs': 2},
+    {'compression': 'lzf'},
+    {'compression': None},
+])
+def test_stimuli_to_hdf5_compression(tmp_path, options):
+    import h5py
+
+    stimuli_data = [
+        np.random.randint(0, 255, size=(40, 50, 3), dtype=np.uint8),
+        np.random.randn(30, 20),
+        np.random.randn(30, 20).astype('>f4'),
+        np.random.randint(0, 2**16, size=(10, 12)).astype(np.uint16),
+        np.zeros((0, 5)),
+    ]
+    stimuli = pysaliency.Stimuli(stimuli_data)
+
+    filename = str(tmp_path / 'stimuli.hdf5')
+    stimuli.to_hdf5(filename, **options)
+
+    new_stimuli = pysaliency.read_hdf5(filename)
+    for stimulus, new_stimulus in zip(stimuli_data, new_stimuli.stimuli):
+        np.testing.assert_array_equal(stimulus, new_stimulus)
+        assert stimulus.dtype == new_stimulus.dtype
+
+    with h5py.File(filename, 'r') as f:
+        assert f['0'].compression == options.get('compression', 'gzip')
+        assert f['0'].shuffle == options.get('shuffle', False)
+        if f['0'].compression is not None:
+            # one chunk per stimulus
+            assert f['0'].chunks == (40, 50, 3)
+
+
+def test_hdf5_stimuli(stimuli_with_attributes, tmp_path):
+    filename = tmp_path / 'stimuli.hdf5'
+    stimuli_with_attributes.to_hdf5(str(filename))
+
+    stimuli = pysaliency.read_hdf5(str(filename), lazy=True)
+    assert isinstance(stimuli, pysaliency.HDF5Stimuli)
+    assert len(stimuli.stimuli._cache) == 0
+    assert stimuli.shapes == [s.shape for s in stimuli_with_attributes.stimuli]
+    assert list(stimuli.sizes) == list(stimuli_with_attributes.sizes)
+    np.testing.assert_array_equal(stimuli.attributes['dva'], stimuli_with_attributes.attributes['dva'])
+
+    np.testing.assert_array_equal(stimuli.stimuli[3], stimuli_with_attributes.stimuli[3])
+    assert len(stimuli.stimuli._cache) == 1
+    assert list(stimuli.stimulus_ids) == list(stimuli_with_attributes.stimulus_ids)
+
+    sub_stimuli = stimuli[[1, 2, 6]]
+    assert isinstance(sub_stimuli, pysaliency.HDF5Stimuli)
+    assert list(sub_stimuli.stimulus_ids._cache.values()) == [stimuli_with_attributes.stimulus_ids[i] for i in [1, 2, 6]]
+    np.testing.assert_array_equal(sub_stimuli.stimuli[2], stimuli_with_attributes.stimuli[6])
+    assert list(sub_stimuli.attributes['some_strings']) == ['b', 'c', 'g']
+    assert list(stimuli[:2].attributes['dva']) == [0, 1]
+
+    # subsets read from the file opened by the full stimuli
+    assert sub_stimuli._file is stimuli._file
+    h5_file = stimuli._file._file
+    np.testing.assert_array_equal(sub_stimuli.load_stimulus(0), stimuli_with_attributes.stimuli[1])
+    assert stimuli._file._file is h5_file
+
+    # other processes open the file again
+    stimuli.close()
+    assert not h5_file
+    pickled_stimuli = pickle.loads(dill.dumps(sub_stimuli))
+    assert pickled_stimuli._file._file is None
+    np.testing.assert_array_equal(pickled_stimuli.stimuli[0], stimuli_with_attributes.stimuli[1])
+    pickled_stimuli._file._pid = -1
+    np.testing.assert_array_equal(pickled_stimuli.load_stimulus(1), stimuli_with_attributes.stimuli[2])
+    assert pickled_stimuli._file._pid == os.getpid()
+
+    np.testing.assert_array_equal(pysaliency.HDF5Stimuli.read_hdf5(str(filename)).stimuli[5], stimuli_with_attributes.stimuli[5])
+    assert not isinstance(pysaliency.read_hdf5(str(filename)), pysaliency.HDF5Stimuli)
+
+
+def test_packed_stimuli(stimuli_with_attributes, tmp_path):
+    # different dtypes and sizes
+    stimuli_with_attributes.stimuli[0] = np.random.randint(0, 255, size=(7, 9, 3), dtype=np.uint8)
+    stimuli_with_attributes.stimuli[1] = np.random.randn(5, 3)
+    stimuli_with_attributes = pysaliency.Stimuli(stimuli_with_attributes.stimuli, attributes=stimuli_with_attributes.attributes)
+    filename = str(tmp_path / 'stimuli.pack')
+
+    stimuli = pysaliency.datasets.pack_stimuli(stimuli_with_attributes, filename)
+    assert isinstance(stimuli, pysaliency.PackedStimuli)
+    assert len(stimuli) == len(stimuli_with_attributes)
+    assert stimuli.shapes == [s.shape for s in stimuli_with_attributes.stimuli]
+    assert list(stimuli.stimulus_ids) == list(stimuli_with_attributes.stimulus_ids)
+    for stimulus, expected_stimulus in zip(stimuli.stimuli, stimuli_with_attributes.stimuli):
+        np.testing.assert_array_equal(stimulus, expected_stimulus)
+        assert stimulus.dtype == expected_stimulus.dtype
+        # views into the memory mapped archive
+        assert isinstance(stimulus.base, np.memmap)
+        assert stimulus.ctypes.data % 64 == 0
+        assert not stimulus.flags.writeable
+
+    np.testing.assert_array_equal(stimuli.attributes['dva'], stimuli_with_attributes.attributes['dva'])
+    np.testing.assert_array_equal(stimuli.attributes['other_stuff'], stimuli_with_attributes.attributes['other_stuff'])
+    assert stimuli.attributes['some_strings'] == stimuli_with_attributes.attributes['some_strings']
+    assert stimuli.__attributes__ == stimuli_with_attributes.__attributes__
+
+    sub_stimuli = stimuli[[6, 2, 0]]
+    assert isinstance(sub_stimuli, pysaliency.PackedStimuli)
+    assert list(sub_stimuli.stimulus_ids) == [stimuli.stimulus_ids[i] for i in [6, 2, 0]]
+    assert sub_stimuli.attributes['some_strings'] == ['g', 'c', 'a']
+    np.testing.assert_array_equal(sub_stimuli.stimuli[1], stimuli_with_attributes.stimuli[2])
+    assert len(stimuli[1:4]) == 3
+
+    # pickling transfers only the filename and indices
+    pickled_stimuli = pickle.dumps(sub_stimuli)
+    assert len(pickled_stimuli) < 500
+    new_stimuli = pickle.loads(pickled_stimuli)
+    np.testing.assert_array_equal(new_stimuli.stimuli[0], stimuli_with_attributes.stimuli[6])
+    assert list(new_stimuli.stimulus_ids) == list(sub_stimuli.stimulus_ids)
+
+    with open(filename, 'ab') as f:
+        f.write(b'garbage')
+    with pytest.raises(ValueError):
+        pysaliency.PackedStimuli(filename)
+
+
+def test_pack_stimuli_errors(tmp_path):
+    # failed archives leave no temporary files behind
+    with pytest.raises(TypeError):
+        pysaliency.pack_stimuli(pysaliency.Stimuli([np.array([[None]])]), str(tmp_path / 'stimuli.pack'))
+    assert os.listdir(str(tmp_path)) == []
+
+    # errors are raised as they are
+    with pytest.raises(FileNotFoundError) as excinfo:
+        pysaliency.pack_stimuli(pysaliency.Stimuli([np.zeros((5, 5))]), str(tmp_path / 'missing_directory' / 'stimuli.pack'))
+    assert excinfo.value.__context__ is None
+
+
 @pytest.fixture
 def file_stimuli_with_attributes(tmpdir):
     filenames = []
@@ -256,6 +391,274 @@ def test_file_stimuli_readhdf5_cached(file_stimuli_with_attributes, tmp_path):
     assert not new_stimuli2.cached
 
 
+@pytest.mark.parametrize(
+        'stimuli',
+        ['stimuli_with_attributes', 'file_stimuli_with_attributes']
+)
+def test_stimulus_index(stimuli, request):
+    _stimuli = request.getfixturevalue(stimuli)
+    stimulus_ids = list(_stimuli.stimulus_ids)
+
+    for n in [5, 2, 5, len(_stimuli) - 1, 0]:
+        assert _stimuli.stimulus_index(stimulus_ids[n]) == n
+
+    with pytest.raises(ValueError):
+        _stimuli.stimulus_index('unknown')
+
+    sub_stimuli = _stimuli[[3, 1, 3]]
+    assert sub_stimuli.stimulus_index(stimulus_ids[3]) == 0
+    assert sub_stimuli.stimulus_index(stimulus_ids[1]) == 1
+
+
+def test_stimulus_index_computes_ids_once():
+    stimuli = pysaliency.Stimuli([np.random.randn(5, 5) for _ in range(10)])
+    stimulus_ids = list(stimuli.stimulus_ids)
+
+    stimuli = pysaliency.Stimuli(stimuli.stimuli)
+    computed_indices = []
+    generator = stimuli.stimulus_ids._cache.on_miss
+
+    def on_miss(n):
+        computed_indices.append(n)
+        return generator(n)
+
+    stimuli.stimulus_ids._cache.on_miss = on_miss
+
+    assert stimuli.stimulus_index(stimulus_ids[3]) == 3
+    assert stimuli.stimulus_index(stimulus_ids[1]) == 1
+    assert stimuli.stimulus_index(stimulus_ids[7]) == 7
+    assert computed_indices == list(range(8))
+
+
+def _fail_loading(n):
+    raise AssertionError("stimulus {} should not be loaded".format(n))
+
+
+def test_file_stimuli_metadata_index(file_stimuli_with_attributes, tmp_path):
+    filenames = file_stimuli_with_attributes.filenames
+    stimulus_ids = list(file_stimuli_with_attributes.stimulus_ids)
+    index_filename = str(tmp_path / 'stimuli.index.jsonl')
+
+    stimuli = pysaliency.FileStimuli(filenames, metadata_index=index_filename)
+    assert stimuli.stimulus_ids[3] == stimulus_ids[3]
+    stimuli.compute_stimulus_ids(n_jobs=2)
+    assert list(stimuli.stimulus_ids) == stimulus_ids
+
+    # later runs don't decode the stimuli to compute the ids
+    new_stimuli = pysaliency.FileStimuli(filenames, metadata_index=index_filename)
+    new_stimuli.load_stimulus = _fail_loading
+    assert list(new_stimuli.stimulus_ids) == stimulus_ids
+    assert list(new_stimuli[[1, 2, 6]].stimulus_ids) == [stimulus_ids[i] for i in [1, 2, 6]]
+
+    # changed files are not looked up in the index
+    new_image = np.random.randint(low=0, high=255, size=(100, 100, 3), dtype=np.uint8)
+    imwrite(filenames[4], new_image)
+    os.utime(filenames[4], ns=(0, 0))
+    new_stimuli = pysaliency.FileStimuli(filenames, metadata_index=index_filename)
+    assert new_stimuli.stimulus_ids[4] == pysaliency.datasets.get_image_hash(new_image)
+    assert new_stimuli.stimulus_ids[5] == stimulus_ids[5]
+
+
+def test_file_stimuli_shapes_metadata_index(file_stimuli_with_attributes, tmp_path, monkeypatch):
+    filenames = file_stimuli_with_attributes.filenames
+    index_filename = str(tmp_path / 'stimuli.index.jsonl')
+
+    stimuli = pysaliency.FileStimuli(filenames, metadata_index=index_filename, n_jobs=4)
+    assert stimuli.shapes == [(100, 100, 3)] * len(filenames)
+
+    # changed files are read again, unchanged files are looked up in the index
+    imwrite(filenames[4], np.zeros((20, 30), dtype=np.uint8))
+    os.utime(filenames[4], ns=(0, 0))
+
+    read_image_shape = pysaliency.datasets.stimuli.read_image_shape
+    read_filenames = []
+
+    def _read_image_shape(filename):
+        read_filenames.append(filename)
+        return read_image_shape(filename)
+
+    monkeypatch.setattr(pysaliency.datasets.stimuli, 'read_image_shape', _read_image_shape)
+
+    new_stimuli = pysaliency.FileStimuli(filenames, metadata_index=index_filename)
+    assert read_filenames == [filenames[4]]
+    assert new_stimuli.shapes[4] == (20, 30)
+    assert new_stimuli.sizes[4] == (20, 30)
+    assert new_stimuli.shapes[5] == (100, 100, 3)
+
+    pysaliency.FileStimuli(filenames, metadata_index=index_filename)
+    assert read_filenames == [filenames[4]]
+
+    # the index entries are validated in the thread pool, not in the calling thread
+    stat = pysaliency.datasets.metadata_index.FileMetadataIndex._stat
+    stat_threads = []
+
+    def _stat(filename):
+        stat_threads.append(threading.get_ident())
+        return stat(filename)
+
+    monkeypatch.setattr(pysaliency.datasets.metadata_index.FileMetadataIndex, '_stat', staticmethod(_stat))
+    pysaliency.FileStimuli(filenames, metadata_index=index_filename, n_jobs=4)
+    assert len(stat_threads) == len(filenames)
+    assert threading.get_ident() not in stat_threads
+
+
+def test_file_stimuli_cache_bytes(file_stimuli_with_attributes):
+    filenames = file_stimuli_with_attributes.filenames
+    stimulus_bytes = 100 * 100 * 3
+
+    stimuli = pysaliency.FileStimuli(filenames, cache_bytes=4 * stimulus_bytes)
+    for n in range(len(stimuli)):
+        stimuli.stimuli[n]
+    assert sorted(stimuli.stimuli._cache) == list(range(len(stimuli) - 4, len(stimuli)))
+    assert stimuli.stimuli._cache.total_bytes == 4 * stimulus_bytes
+
+    sub_stimuli = stimuli[:5]
+    assert sub_stimuli.cache_bytes == 4 * stimulus_bytes
+
+    stimuli = pysaliency.FileStimuli(filenames, cache_bytes=None)
+    for n in range(len(stimuli)):
+        stimuli.stimuli[n]
+    assert len(stimuli.stimuli._cache) == len(stimuli)
+
+
+@pytest.mark.parametrize(
+        'stimuli',
+        ['stimuli_with_attributes', 'file_stimuli_with_attributes']
+)
+def test_iter_stimuli_and_load_batch(stimuli, request):
+    _stimuli = request.getfixturevalue(stimuli)
+    expected_stimuli = [np.asarray(_stimuli.stimuli[n]) for n in range(len(_stimuli))]
+
+    for stimulus, expected_stimulus in zip(_stimuli.iter_stimuli(prefetch_count=3, n_jobs=2), expected_stimuli):
+        np.testing.assert_allclose(stimulus, expected_stimulus)
+    assert len(list(_stimuli.iter_stimuli())) == len(_stimuli)
+
+    indices = [5, 1, 3]
+    for stimulus, n in zip(_stimuli.load_batch(indices, n_jobs=2), indices):
+        np.testing.assert_allclose(stimulus, expected_stimuli[n])
+
+
+def test_file_stimuli_loader(file_stimuli_with_attributes):
+    stimuli = pysaliency.FileStimuli(file_stimuli_with_attributes.filenames, cached=False)
+    stimulus_ids = list(file_stimuli_with_attributes.stimulus_ids)
+    for n, stimulus_id in enumerate(stimulus_ids):
+        stimuli.stimulus_ids._cache[n] = stimulus_id
+
+    loaded_indices = []
+    load_stimulus = stimuli.load_stimulus
+
+    def _load_stimulus(n):
+        loaded_indices.append(n)
+        return load_stimulus(n)
+
+    stimuli.load_stimulus = _load_stimulus
+
+    with stimuli.stimulus_loader([2, 4, 6, 8, 10], prefetch_count=2) as loader:
+        assert [stimulus.stimulus_id for stimulus in loader] == [stimulus_ids[n] for n in [2, 4, 6, 8, 10]]
+        # stimulus ids don't need the images
+        assert loaded_indices == []
+
+        np.testing.assert_allclose(loader[0].stimulus_data, file_stimuli_with_attributes.stimuli[2])
+        loader.wait(2)
+        assert sorted(loaded_indices) == [2, 4, 6]
+
+        np.testing.assert_allclose(loader[1].stimulus_data, file_stimuli_with_attributes.stimuli[4])
+        loader.wait(3)
+        assert sorted(loaded_indices) == [2, 4, 6, 8]
+
+        # random access doesn't decode ahead
+        np.testing.assert_allclose(loader[4].stimulus_data, file_stimuli_with_attributes.stimuli[10])
+        assert sorted(loaded_indices) == [2, 4, 6, 8, 10]
+
+
+def test_file_stimuli_loader_default_starts_no_threads(file_stimuli_with_attributes):
+    loader = file_stimuli_with_attributes.stimulus_loader()
+    assert loader.prefetch_count == 0
+
+    for stimulus, expected_stimulus in zip(loader, file_stimuli_with_attributes.stimuli):
+        np.testing.assert_allclose(stimulus.stimulus_data, expected_stimulus)
+    assert loader._executor is None
+
+    loader = file_stimuli_with_attributes.stimulus_loader(prefetch_count=2)
+    loader[0].stimulus_data
+    assert loader._executor is not None
+    loader.close()
+    assert loader._executor is None
+
+
+def test_file_stimuli_load_stimulus_max_size(tmp_path):
+    yy, xx = np.mgrid[:600, :800]
+    image = np.dstack([xx / 4, yy / 3, (xx + yy) / 8]).astype(np.uint8)
+    filenames = [str(tmp_path / 'stimulus.jpg'), str(tmp_path / 'stimulus.png')]
+    imwrite(filenames[0], image)
+    imwrite(filenames[1], image)
+    stimuli = pysaliency.FileStimuli(filenames)
+
+    assert stimuli.load_stimulus(0, max_size=150).shape == (150, 200, 3)
+    assert stimuli.load_stimulus(0, max_size=201).shape == (300, 400, 3)
+    assert stimuli.load_stimulus(0, max_size=1000).shape == (600, 800, 3)
+    assert stimuli.load_stimulus(1, max_size=150).shape == (600, 800, 3)
+
+    assert stimuli.stimulus_objects[0].downscaled_stimulus_data(100).shape == (75, 100, 3)
+    # stimuli which are decoded already are not decoded again
+    stimuli.stimuli[0]
+    assert stimuli.stimulus_objects[0].downscaled_stimulus_data(100).shape == (600, 800, 3)
+
+
+def test_file_stimuli_readhdf5_metadata_index(file_stimuli_with_attributes, tmp_path):
+    filename = tmp_path / 'stimuli.hdf5'
+    file_stimuli_with_attributes.to_hdf5(str(filename))
+    stimulus_ids = list(file_stimuli_with_attributes.stimulus_ids)
+
+    # the index is opt-in
+    pysaliency.read_hdf5(str(filename)).compute_stimulus_ids()
+    assert not os.path.exists(str(filename) + '.index.jsonl')
+
+    pysaliency.read_hdf5(str(filename), metadata_index=True).compute_stimulus_ids()
+    assert os.path.exists(str(filename) + '.index.jsonl')
+
+    stimuli = pysaliency.FileStimuli.read_hdf5(str(filename), metadata_index=True)
+    stimuli.load_stimulus = _fail_loading
+    assert list(stimuli.stimulus_ids) == stimulus_ids
+
+    assert pysaliency.FileStimuli.read_hdf5(str(filename)).metadata_index is None
+
+
+def test_metadata_index_compaction(tmp_path):
+    filename = tmp_path / 'stimulus.png'
+    imwrite(str(filename), np.zeros((10, 10, 3), dtype=np.uint8))
+    index_filename = tmp_path / 'index.jsonl'
+
+    index = pysaliency.datasets.metadata_index.FileMetadataIndex(str(index_filename))
+    index.update(str(filename), shape=[10, 10, 3])
+    index.update(str(filename), stimulus_id='foo')
+    index.update(str(filename), stimulus_id='bar')
+    assert len(index_filename.read_text().splitlines()) == 3
+
+    index = pysaliency.datasets.metadata_index.FileMetadataIndex(str(index_filename))
+    assert index.get(str(filename), 'stimulus_id') == 'bar'
+    assert index.get(str(filename), 'shape') == [10, 10, 3]
+    assert len(index_filename.read_text().splitlines()) == 1
+    assert sorted(os.listdir(str(tmp_path))) == ['index.jsonl', 'stimulus.png']
+
+    index = pysaliency.datasets.metadata_index.FileMetadataIndex(str(index_filename))
+    assert index.get(str(filename), 'stimulus_id') == 'bar'
+
+
+def test_metadata_index_read_only(tmp_path, recwarn):
+    filename = tmp_path / 'stimulus.png'
+    imwrite(str(filename), np.zeros((10, 10, 3), dtype=np.uint8))
+
+    index = pysaliency.datasets.metadata_index.FileMetadataIndex(str(tmp_path / 'missing_directory' / 'index.jsonl'))
+    index.update(str(filename), stimulus_id='foo')
+    assert index.get(str(filename), 'stimulus_id') == 'foo'
+    assert index.get(str(filename), 'shape') is None
+    assert len(recwarn) == 1
+
+    index = pickle.loads(pickle.dumps(index))
+    assert index.get(str(filename), 'stimulus_id') is None
+
+
 def test_concatenate_stimuli_with_attributes(stimuli_with_attributes, file_stimuli_with_attributes):
     concatenated_stimuli = pysaliency.datasets.concatenate_stimuli([stimuli_with_attributes, file_stimuli_with_attributes])
 
@@ -307,6 +710,21 @@ def test_check_prediction_shape():
     assert str(excinfo.value) == "Prediction shape (10, 10) does not match stimulus shape (10, 11)"
 
 
+@pytest.mark.parametrize(
+        'stimuli',
+        ['stimuli_with_attributes', 'file_stimuli_with_attributes']
+)
+def test_set_stimulus_ids(stimuli, request):
+    _stimuli = request.getfixturevalue(stimuli)
+
+    _stimuli.set_stimulus_ids({1: 'first', 3: 'second'})
+    assert _stimuli.stimulus_ids[1] == 'first'
+    assert _stimuli.stimulus_ids[3] == 'second'
+
+    with pytest.raises(IndexError):
+        _stimuli.set_stimulus_ids({len(_stimuli): 'too_far'})
+
+
 @pytest.mark.parametrize(
         'stimuli',
         ['stimuli_with_attributes', 'file_stimuli_with_attributes']
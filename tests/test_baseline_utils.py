@@ -7,8 +7,10 @@ import pytest
 
 import pysaliency
 from pysaliency.baseline_utils import (
+    CrossvalidatedBaselineModel,
     CrossvalMultipleRegularizations,
     GeneralMixtureKernelDensityEstimator,
+    GoldModel,
     KDEGoldModel,
     MixtureKernelDensityEstimator,
     ScikitLearnImageCrossValidationGenerator,
@@ -80,6 +82,19 @@ def test_kde_gold_model(stimuli, scanpath_fixations):
     np.testing.assert_allclose(spaced_ll, 2.191055750664578)
 
 
+@pytest.mark.parametrize('model_class', [GoldModel, CrossvalidatedBaselineModel])
+def test_baseline_models_group_fixations_once(monkeypatch, stimuli, scanpath_fixations, model_class):
+    model = model_class(stimuli, scanpath_fixations, bandwidth=0.1, caching=False)
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("fixations grouped again")
+
+    monkeypatch.setattr(pysaliency.datasets.fixations.FixationIndicesByStimulus, 'matches', _fail)
+    for stimulus in stimuli:
+        log_density = model.log_density(stimulus)
+        np.testing.assert_allclose(np.exp(log_density).sum(), 1)
+
+
 def test_general_mixture_kernel_density_estimator():
     # Test initialization
     estimator = GeneralMixtureKernelDensityEstimator(bandwidth=1.0, regularizations=[0.2, 0.1], regularizing_log_likelihoods=[[-1, 0.0], [-0.1, -10.0], [-10, -0.1]])
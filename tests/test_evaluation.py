@@ -0,0 +1,190 @@
+import pickle
+
+import numpy as np
+import pytest
+
+import pysaliency
+from pysaliency.evaluation import FixationKLDivergenceAccumulator, FixationMetricAccumulator, accumulate, accumulate_shard, evaluate, merge_accumulators
+
+
+class GaussianDensityModel(pysaliency.Model):
+    def _log_density(self, stimulus):
+        height = stimulus.shape[0]
+        width = stimulus.shape[1]
+        YS, XS = np.mgrid[:height, :width]
+        r_squared = (XS-0.5*width)**2 + (YS-0.5*height)**2
+        size = np.sqrt(width**2+height**2)
+        values = np.ones((stimulus.shape[0], stimulus.shape[1]))*np.exp(-0.5*(r_squared/size))
+        density = values / values.sum()
+        return np.log(density)
+
+
+@pytest.fixture
+def stimuli():
+    return pysaliency.Stimuli([np.random.randn(50, 50, 3),
+                               np.random.randn(50, 50, 3),
+                               np.random.randn(100, 200, 3),
+                               np.random.randn(60, 40, 3)])
+
+
+@pytest.fixture
+def fixations():
+    xs_trains = [
+        [0, 1, 2],
+        [2, 2],
+        [1, 10, 3],
+        [4, 5, 33, 7]]
+    ys_trains = [
+        [10, 11, 12],
+        [12, 12],
+        [21, 25, 33],
+        [41, 42, 43, 44]]
+    ts_trains = [
+        [0, 200, 600],
+        [100, 400],
+        [50, 500, 900],
+        [0, 1, 2, 3]]
+    ns = [0, 0, 1, 2]
+    subjects = [0, 1, 1, 0]
+    return pysaliency.ScanpathFixations(pysaliency.Scanpaths(xs_trains, ys_trains, ts=ts_trains, n=ns, subject=subjects))
+
+
+def test_evaluate_saliency_map_model(stimuli, fixations):
+    model = pysaliency.GaussianSaliencyMapModel(width=0.3)
+    gold_standard = pysaliency.FixationMap(stimuli, fixations, kernel_size=5)
+
+    per_fixation, per_image = evaluate(model, stimuli, fixations, gold_standard=gold_standard)
+
+    np.testing.assert_array_equal(per_fixation['n'], fixations.n)
+    np.testing.assert_array_equal(per_fixation['AUC'], model.AUCs(stimuli, fixations))
+    np.testing.assert_array_equal(per_fixation['sAUC'], model.AUCs(stimuli, fixations, nonfixations='shuffled'))
+    np.testing.assert_array_equal(per_fixation['NSS'], model.NSSs(stimuli, fixations))
+    assert 'LL' not in per_fixation
+
+    assert len(per_image) == len(stimuli)
+    np.testing.assert_array_equal(per_image['CC'], model.CCs(stimuli, gold_standard))
+    np.testing.assert_array_equal(per_image['KLDiv'], model.image_based_kl_divergences(stimuli, gold_standard))
+    np.testing.assert_array_equal(per_image['SIM'], model.SIMs(stimuli, gold_standard))
+
+    np.testing.assert_allclose(per_image['AUC'].mean(), model.AUC(stimuli, fixations, average='image'))
+    assert np.isnan(per_image['NSS'][3])
+
+
+def test_evaluate_model(stimuli, fixations):
+    model = GaussianDensityModel()
+
+    per_fixation, per_image = evaluate(model, stimuli, fixations)
+
+    np.testing.assert_array_equal(per_fixation['LL'], model.log_likelihoods(stimuli, fixations))
+    np.testing.assert_array_equal(per_fixation['IG'], model.information_gains(stimuli, fixations))
+
+    saliency_map_model = pysaliency.DensitySaliencyMapModel(model)
+    np.testing.assert_array_equal(per_fixation['AUC'], saliency_map_model.AUCs(stimuli, fixations))
+    np.testing.assert_array_equal(per_fixation['NSS'], saliency_map_model.NSSs(stimuli, fixations))
+    assert list(per_image.columns) == ['AUC', 'sAUC', 'NSS', 'LL', 'IG']
+
+
+def test_evaluate_invalid_metrics(stimuli, fixations):
+    model = pysaliency.GaussianSaliencyMapModel()
+
+    with pytest.raises(ValueError):
+        evaluate(model, stimuli, fixations, metrics=['LL'])
+
+    with pytest.raises(ValueError):
+        evaluate(model, stimuli, fixations, metrics=['CC'])
+
+    with pytest.raises(ValueError):
+        evaluate(model, stimuli, fixations, metrics=['unknown'])
+
+
+def _saliency_range(model, stimuli):
+    saliency_maps = [model.saliency_map(stimulus) for stimulus in stimuli]
+    return min(s.min() for s in saliency_maps), max(s.max() for s in saliency_maps)
+
+
+@pytest.mark.parametrize('average', ['fixation', 'image'])
+def test_accumulate_shards_saliency_map_model(stimuli, fixations, average):
+    model = pysaliency.GaussianSaliencyMapModel(width=0.3)
+    gold_standard = pysaliency.FixationMap(stimuli, fixations, kernel_size=5)
+    metrics = ['AUC', 'sAUC', 'NSS', 'CC', 'KLDiv', 'SIM', 'FixationKLDiv']
+
+    shard_accumulators = [
+        accumulate_shard(model, stimuli, fixations, start, stop, metrics=metrics, gold_standard=gold_standard,
+                         fixation_kl_range=_saliency_range(model, stimuli))
+        for start, stop in [(2, 4), (0, 1), (1, 2)]
+    ]
+    # accumulators can be sent to other processes
+    shard_accumulators = [pickle.loads(pickle.dumps(accumulators)) for accumulators in shard_accumulators]
+    merged = merge_accumulators(shard_accumulators)
+
+    np.testing.assert_allclose(merged['AUC'].value(average=average),
+                               pysaliency.utils.average_values(model.AUCs(stimuli, fixations), fixations, average=average))
+    np.testing.assert_allclose(merged['sAUC'].value(average=average), pysaliency.utils.average_values(
+        model.AUCs(stimuli, fixations, nonfixations='shuffled'), fixations, average=average))
+    np.testing.assert_allclose(merged['NSS'].value(average=average), model.NSS(stimuli, fixations, average=average))
+
+    np.testing.assert_equal(merged['CC'].value(), model.CC(stimuli, gold_standard))
+    np.testing.assert_equal(merged['KLDiv'].value(), model.image_based_kl_divergence(stimuli, gold_standard))
+    np.testing.assert_equal(merged['SIM'].value(), model.SIM(stimuli, gold_standard))
+
+    assert merged['FixationKLDiv'].value() == model.fixation_based_KL_divergence(stimuli, fixations)
+
+    full_accumulators = accumulate(model, stimuli, fixations, metrics=metrics, gold_standard=gold_standard)
+    np.testing.assert_allclose(merged['NSS'].value(average=average), full_accumulators['NSS'].value(average=average))
+    assert full_accumulators['FixationKLDiv'].value() == model.fixation_based_KL_divergence(stimuli, fixations)
+
+
+def test_accumulate_shards_model(stimuli, fixations):
+    model = GaussianDensityModel()
+
+    merged = merge_accumulators([accumulate_shard(model, stimuli, fixations, 0, 2),
+                                 accumulate_shard(model, stimuli, fixations, 2, 4)])
+
+    for average in ['fixation', 'image']:
+        np.testing.assert_allclose(merged['LL'].value(average=average), model.log_likelihood(stimuli, fixations, average=average))
+        np.testing.assert_allclose(merged['IG'].value(average=average), model.information_gain(stimuli, fixations, average=average))
+
+
+def test_accumulate_n_jobs(stimuli, fixations):
+    model = pysaliency.GaussianSaliencyMapModel(width=0.3)
+
+    with pytest.raises(ValueError):
+        accumulate(model, stimuli, fixations, metrics=['FixationKLDiv'], n_jobs=2)
+
+    accumulators = accumulate(model, stimuli, fixations, metrics=['sAUC', 'NSS', 'FixationKLDiv'], n_jobs=2,
+                              fixation_kl_range=_saliency_range(model, stimuli))
+
+    np.testing.assert_allclose(accumulators['sAUC'].value(average='image'), pysaliency.utils.average_values(
+        model.AUCs(stimuli, fixations, nonfixations='shuffled'), fixations, average='image'))
+    np.testing.assert_allclose(accumulators['NSS'].value(), model.NSS(stimuli, fixations))
+    assert accumulators['FixationKLDiv'].value() == model.fixation_based_KL_divergence(stimuli, fixations)
+
+
+def test_accumulator_size_does_not_depend_on_fixations(stimuli, fixations):
+    model = pysaliency.GaussianSaliencyMapModel()
+
+    accumulators = accumulate_shard(model, stimuli, fixations, 0, 2, metrics=['NSS', 'FixationKLDiv'], fixation_kl_nonfixations='uniform')
+
+    assert isinstance(accumulators['NSS'], FixationMetricAccumulator)
+    assert list(accumulators['NSS'].n) == [0, 1]
+    assert list(accumulators['NSS'].counts) == [len(fixations.fixation_indices_by_stimulus[n]) for n in [0, 1]]
+    assert accumulators['FixationKLDiv'].nonfixation_counts.sum() == sum(np.prod(stimuli.sizes[n]) for n in [0, 1])
+    assert len(accumulators['FixationKLDiv'].nonfixation_counts) == 10
+
+
+def test_merge_fixation_kl_accumulators_with_different_ranges():
+    first = FixationKLDivergenceAccumulator([1, 2], [3, 4], (0, 1))
+    second = FixationKLDivergenceAccumulator([1, 2], [3, 4], (0, 2))
+
+    assert list((first + first).fixation_counts) == [2, 4]
+    with pytest.raises(ValueError):
+        first + second
+
+
+def test_accumulate_overlapping_shards(stimuli, fixations):
+    model = pysaliency.GaussianSaliencyMapModel()
+
+    accumulators = accumulate_shard(model, stimuli, fixations, 0, 2, metrics=['NSS'])
+
+    with pytest.raises(ValueError):
+        (accumulators['NSS'] + accumulators['NSS']).value()
@@ -67,6 +67,95 @@ def test_log_likelihood_gauss(stimuli, scanpath_fixations):
 
 
 
+def test_log_likelihood_parallel(stimuli, scanpath_fixations):
+    gsmm = GaussianSaliencyModel()
+
+    np.testing.assert_array_equal(
+        gsmm.log_likelihoods(stimuli, scanpath_fixations),
+        gsmm.log_likelihoods(stimuli, scanpath_fixations, n_jobs=2),
+    )
+    np.testing.assert_array_equal(
+        pysaliency.ScanpathModel.log_likelihoods(gsmm, stimuli, scanpath_fixations),
+        pysaliency.ScanpathModel.log_likelihoods(gsmm, stimuli, scanpath_fixations, n_jobs=2),
+    )
+    np.testing.assert_array_equal(
+        gsmm.information_gains(stimuli, scanpath_fixations),
+        gsmm.information_gains(stimuli, scanpath_fixations, n_jobs=2),
+    )
+    np.testing.assert_array_equal(
+        gsmm.kl_divergences(stimuli, ConstantSaliencyModel()),
+        gsmm.kl_divergences(stimuli, ConstantSaliencyModel(), n_jobs=2),
+    )
+
+
+def test_kl_divergences_with_list_of_images(stimuli):
+    gsmm = GaussianSaliencyModel()
+    images = list(stimuli.stimuli)
+
+    np.testing.assert_allclose(
+        gsmm.kl_divergences(images, ConstantSaliencyModel()),
+        gsmm.kl_divergences(stimuli, ConstantSaliencyModel()),
+    )
+
+
+def test_fingerprint_cache_keys(tmp_path, stimuli):
+    model = pysaliency.models.GaussianModel(width=0.3, cache_location=str(tmp_path))
+    other_model = pysaliency.models.GaussianModel(width=0.4, cache_location=str(tmp_path))
+    assert model.fingerprint != other_model.fingerprint
+
+    log_density = model.log_density(stimuli[0])
+    other_log_density = other_model.log_density(stimuli[0])
+    assert not np.allclose(log_density, other_log_density)
+
+    other_model.parent_model.width = 0.3
+    assert other_model.fingerprint == model.fingerprint
+    np.testing.assert_allclose(other_model.log_density(stimuli[0]), log_density)
+    assert other_model.cache_stats['disk_hits'] == 1
+
+    mixture_model = pysaliency.MixtureModel([model, other_model], weights=[1, 2])
+    assert mixture_model.fingerprint == pysaliency.MixtureModel([model, model], weights=[1, 2]).fingerprint
+    assert mixture_model.fingerprint != pysaliency.MixtureModel([model, model], weights=[1, 3]).fingerprint
+
+
+@pytest.mark.parametrize('model_type', ['fixed_size', 'dva'])
+def test_downscaled_decoding(tmp_path, model_type):
+    from imageio import imwrite
+
+    yy, xx = np.mgrid[:600, :800]
+    image = np.dstack([xx / 4, yy / 3, (xx + yy) / 8]).astype(np.uint8)
+    filename = str(tmp_path / 'stimulus.jpg')
+    imwrite(filename, image)
+    # computing the stimulus ids decodes the stimuli at full resolution, hence they have to be known already
+    metadata_index = str(tmp_path / 'index.jsonl')
+    pysaliency.FileStimuli([filename], metadata_index=metadata_index).compute_stimulus_ids()
+    stimuli = pysaliency.FileStimuli([filename], metadata_index=metadata_index)
+
+    class MeanIntensityModel(pysaliency.Model):
+        def _log_density(self, stimulus):
+            assert stimulus.shape == (150, 200, 3)
+            return np.log(stimulus.mean(axis=-1) / stimulus.mean(axis=-1).sum())
+
+    def _model(downscaled_decoding):
+        if model_type == 'fixed_size':
+            return pysaliency.models.FixedStimulusSizeModel(200, MeanIntensityModel(), downscaled_decoding=downscaled_decoding)
+        return pysaliency.models.DVAAwareModel(40, MeanIntensityModel(), 10, downscaled_decoding=downscaled_decoding)
+
+    loaded_stimuli = []
+    load_stimulus = stimuli.load_stimulus
+
+    def _load_stimulus(n, max_size=None):
+        stimulus = load_stimulus(n, max_size=max_size)
+        loaded_stimuli.append(stimulus.shape)
+        return stimulus
+
+    stimuli.load_stimulus = _load_stimulus
+
+    log_density = _model(True).log_density(stimuli[0])
+    assert loaded_stimuli == [(150, 200, 3)]
+    assert log_density.shape == (600, 800)
+
+    full_log_density = _model(False).log_density(stimuli[0])
+    np.testing.assert_allclose(np.exp(log_density), np.exp(full_log_density), rtol=0.05, atol=0.05 / log_density.size)
 
 
 def test_sampling(stimuli):
@@ -1,7 +1,15 @@
 from hypothesis import given, strategies as st, assume, settings
 import numpy as np
+import pytest
 
-from pysaliency.numba_utils import auc_for_one_positive, general_roc_numba, general_rocs_per_positive_numba
+from pysaliency.numba_utils import (
+    auc_for_one_positive,
+    auc_for_one_positive_excluding_itself,
+    general_roc_numba,
+    general_rocs_per_positive_batch,
+    general_rocs_per_positive_numba,
+)
+from pysaliency.roc import general_rocs_per_positive_excluding, general_rocs_per_positive_sorted
 from pysaliency.roc_cython import general_roc, general_rocs_per_positive
 
 
@@ -12,6 +20,7 @@ def test_auc_for_one_positive():
     assert auc_for_one_positive(0, [3]) == 0.0
 
 
+@settings(deadline=None)
 @given(st.lists(st.floats(allow_nan=False, allow_infinity=False), min_size=1), st.floats(allow_nan=False, allow_infinity=False))
 def test_simple_auc_hypothesis(negatives, positive):
     old_auc, _, _ = general_roc(np.array([positive]), np.array(negatives))
@@ -50,4 +59,78 @@ def test_numba_rocs_per_positive(positives,negatives):
     negatives = np.array(negatives)
     numba_output = general_rocs_per_positive_numba(positives,negatives)
     cython_output = general_rocs_per_positive(positives,negatives)
-    assert (numba_output == cython_output).all()
\ No newline at end of file
+    assert (numba_output == cython_output).all()
+
+@settings(deadline=None)
+@given(st.lists(st.integers(-5, 5), min_size=1), st.lists(st.integers(-5, 5), min_size=1), st.data())
+def test_general_rocs_per_positive_excluding(positives, negatives, data):
+    positives = np.array(positives, dtype=float)
+    values = np.array(negatives, dtype=float)
+    excluded = data.draw(st.lists(st.integers(0, len(values) - 1), unique=True, max_size=len(values) - 1))
+    remaining_values = np.delete(values, excluded)
+
+    expected = general_rocs_per_positive(positives, remaining_values)
+    np.testing.assert_allclose(general_rocs_per_positive_excluding(positives, values, values[excluded]), expected)
+
+
+@settings(deadline=None)
+@given(st.lists(st.integers(-5, 5), min_size=1), st.lists(st.integers(-5, 5), min_size=1))
+def test_general_rocs_per_positive_sorted(positives, negatives):
+    positives = np.array(positives, dtype=float)
+    negatives = np.array(negatives, dtype=float)
+
+    expected = general_rocs_per_positive(positives, negatives)
+    np.testing.assert_allclose(general_rocs_per_positive_sorted(positives, np.sort(negatives)), expected)
+
+
+@settings(deadline=None)
+@given(st.lists(st.integers(-5, 5), min_size=1), st.lists(st.integers(-5, 5), min_size=1), st.data())
+def test_general_rocs_per_positive_sorted_excluding(positives, negatives, data):
+    positives = np.array(positives, dtype=float)
+    values = np.array(negatives, dtype=float)
+    excluded = data.draw(st.lists(st.integers(0, len(values) - 1), unique=True, max_size=len(values) - 1))
+
+    expected = general_rocs_per_positive(positives, np.delete(values, excluded))
+    np.testing.assert_allclose(general_rocs_per_positive_sorted(positives, np.sort(values), excluded_negatives=values[excluded]), expected)
+
+
+def test_general_rocs_per_positive_without_negatives():
+    # e.g. shuffled nonfixations if only one stimulus has fixations
+    positives = np.array([1.0, 2.0])
+    values = np.array([1.0, 3.0])
+
+    np.testing.assert_array_equal(general_rocs_per_positive_excluding(positives, values, values), [np.nan, np.nan])
+    np.testing.assert_array_equal(general_rocs_per_positive_sorted(positives, values, excluded_negatives=values), [np.nan, np.nan])
+    np.testing.assert_array_equal(general_rocs_per_positive_sorted(positives, np.array([])), [np.nan, np.nan])
+
+
+@settings(deadline=None)
+@given(st.lists(st.integers(-5, 5), min_size=2), st.data())
+def test_auc_for_one_positive_excluding_itself(values, data):
+    values = np.array(values, dtype=float)
+    index = data.draw(st.integers(0, len(values) - 1))
+
+    expected = auc_for_one_positive(values[index], np.delete(values, index))
+    assert auc_for_one_positive_excluding_itself(values[index], values) == expected
+
+
+@settings(deadline=None)
+@given(st.lists(st.tuples(st.lists(st.integers(-5, 5)), st.lists(st.integers(-5, 5), min_size=1)), min_size=1))
+def test_general_rocs_per_positive_batch(groups):
+    positives = [np.array(p, dtype=float) for p, n in groups]
+    negatives = [np.array(n, dtype=float) for p, n in groups]
+
+    rocs = general_rocs_per_positive_batch(
+        np.hstack(positives), np.cumsum([0] + [len(p) for p in positives]),
+        np.hstack(negatives), np.cumsum([0] + [len(n) for n in negatives]),
+    )
+    expected = np.hstack([general_rocs_per_positive(p, n) for p, n in zip(positives, negatives)])
+    np.testing.assert_allclose(rocs, expected)
+
+
+def test_general_rocs_per_positive_batch_invalid_offsets():
+    with pytest.raises(ValueError):
+        general_rocs_per_positive_batch([1.0, 2.0], [0, 1], [1.0], [0, 1])
+
+    with pytest.raises(ValueError):
+        general_rocs_per_positive_batch([1.0, 2.0], [0, 2], [], [0, 0])
@@ -1,11 +1,15 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import os
+import threading
+
 import pytest
 
 import numpy as np
 import pytest
 
 import pysaliency
+import pysaliency.parallel
 import pysaliency.saliency_map_models
 
 
@@ -184,6 +188,181 @@ def test_auc_gauss(stimuli, scanpath_fixations):
     np.testing.assert_allclose(aucs_single, aucs_combined)
 
 
+def test_sorted_saliency_values(stimuli, scanpath_fixations):
+    gsmm = GaussianSaliencyMapModel()
+    stimulus = stimuli.stimulus_objects[0]
+
+    sorted_values = gsmm.sorted_saliency_values(stimulus)
+    np.testing.assert_allclose(sorted_values, np.sort(gsmm.saliency_map(stimulus).flatten()))
+    assert gsmm.sorted_saliency_values(stimulus) is sorted_values
+
+    # sorted values are recomputed if the cached saliency map changes
+    gsmm._cache.clear()
+    assert gsmm.sorted_saliency_values(stimulus) is not sorted_values
+
+    # the sorted values are kept only for saliency maps in the memory cache and for a bounded number of them
+    assert len(gsmm._sorted_saliency_values_cache) == 1
+    gsmm._sorted_saliency_values(stimulus, gsmm.saliency_map(stimulus).copy())
+    assert len(gsmm._sorted_saliency_values_cache) == 1
+    for n in range(pysaliency.saliency_map_models.SORTED_SALIENCY_VALUES_CACHE_SIZE + 5):
+        gsmm.sorted_saliency_values(np.random.randn(10, 10 + n))
+    assert len(gsmm._sorted_saliency_values_cache) == pysaliency.saliency_map_models.SORTED_SALIENCY_VALUES_CACHE_SIZE
+
+    uncached_gsmm = GaussianSaliencyMapModel(caching=False)
+    np.testing.assert_allclose(uncached_gsmm.sorted_saliency_values(stimulus), sorted_values)
+    np.testing.assert_allclose(uncached_gsmm.AUCs(stimuli, scanpath_fixations), gsmm.AUCs(stimuli, scanpath_fixations))
+
+
+def test_memory_cache_bytes(stimuli):
+    # each saliency map of the stimuli has 40*40*8 = 12800 bytes
+    gsmm = GaussianSaliencyMapModel(memory_cache_bytes=20000)
+
+    for stimulus in [stimuli[0], stimuli[0], stimuli[1], stimuli[0]]:
+        gsmm.saliency_map(stimulus)
+
+    stats = gsmm.cache_stats
+    assert stats['memory_hits'] == 1
+    assert stats['misses'] == 3
+    assert stats['evictions'] == 2
+    assert stats['memory_bytes'] <= 20000
+
+
+def test_fingerprint():
+    model = ConstantSaliencyMapModel(value=2.0)
+    other_model = ConstantSaliencyMapModel(value=3.0)
+
+    assert model.fingerprint == ConstantSaliencyMapModel(value=2.0, caching=False).fingerprint
+    assert model.fingerprint != other_model.fingerprint
+    assert model.fingerprint != GaussianSaliencyMapModel().fingerprint
+
+    sum_model = model + other_model
+    assert sum_model.fingerprint == (ConstantSaliencyMapModel(value=2.0) + ConstantSaliencyMapModel(value=3.0)).fingerprint
+    assert sum_model.fingerprint != (model - other_model).fingerprint
+    assert sum_model.fingerprint != (other_model + model).fingerprint
+
+    fingerprint = sum_model.fingerprint
+    other_model.value = 4.0
+    assert sum_model.fingerprint != fingerprint
+    other_model.value = 3.0
+    assert sum_model.fingerprint == fingerprint
+
+    # models with parameters that can't be fingerprinted fall back to caching by stimulus id
+    noise_model = pysaliency.saliency_map_models.RandomNoiseSaliencyMapModel(model)
+    assert noise_model.fingerprint is None
+    assert (noise_model + model).fingerprint is None
+
+
+def test_missing_fingerprint_warns_with_cache_location(tmp_path, stimuli):
+    model = pysaliency.saliency_map_models.RandomNoiseSaliencyMapModel(ConstantSaliencyMapModel(value=2.0))
+    model.saliency_map(stimuli[0])
+
+    model.cache_location = str(tmp_path)
+    with pytest.warns(UserWarning, match="can't be fingerprinted"):
+        model.saliency_map(stimuli[1])
+    assert os.listdir(str(tmp_path)) == ['{}.npy'.format(stimuli.stimulus_ids[1])]
+
+
+def test_fingerprint_invalidates_cache(tmp_path, stimuli):
+    stimulus = stimuli[0]
+    model = ConstantSaliencyMapModel(value=2.0, cache_location=str(tmp_path))
+    np.testing.assert_allclose(model.saliency_map(stimulus), 2.0)
+
+    model.value = 3.0
+    np.testing.assert_allclose(model.saliency_map(stimulus), 3.0)
+
+    # other models sharing the cache location see only their own predictions
+    other_model = ConstantSaliencyMapModel(value=2.0, cache_location=str(tmp_path))
+    np.testing.assert_allclose(other_model.saliency_map(stimulus), 2.0)
+    assert other_model.cache_stats['disk_hits'] == 1
+    assert len(os.listdir(str(tmp_path))) == 2
+
+
+def test_fingerprint_detects_inplace_changes():
+    centerbias = np.ones((40, 40))
+    model = pysaliency.saliency_map_models.LambdaSaliencyMapModel([ConstantSaliencyMapModel(value=1.0)], fn=lambda smaps: smaps[0])
+    model.centerbias = centerbias
+    fingerprint = model.fingerprint
+
+    centerbias[0, 0] = 2.0
+    assert model.fingerprint != fingerprint
+
+
+def test_legacy_cache_keys(tmp_path, stimuli):
+    stimulus = stimuli[0]
+    # earlier versions stored the predictions by stimulus id only
+    np.save(str(tmp_path / '{}.npy'.format(stimulus.stimulus_id)), np.full(stimulus.size, 5.0))
+
+    model = ConstantSaliencyMapModel(value=2.0, cache_location=str(tmp_path))
+    with pytest.warns(UserWarning, match="earlier version"):
+        np.testing.assert_allclose(model.saliency_map(stimulus), 5.0)
+
+    # new predictions are stored with the fingerprint
+    np.testing.assert_allclose(model.saliency_map(stimuli[1]), 2.0)
+    assert '{}-{}.npy'.format(model.fingerprint, stimuli[1].stimulus_id) in os.listdir(str(tmp_path))
+
+
+def test_composed_model_caching(stimuli):
+    stimulus = stimuli[0]
+    model = ConstantSaliencyMapModel(value=2.0)
+    other_model = ConstantSaliencyMapModel(value=3.0, caching=False)
+
+    product_model = model * other_model
+    # composed models don't keep their saliency maps in memory unless asked to
+    assert not product_model.caching
+    product_model.caching = True
+    np.testing.assert_allclose(product_model.saliency_map(stimulus), 6.0)
+    np.testing.assert_allclose(product_model.saliency_map(stimulus), 6.0)
+    assert product_model.cache_stats['memory_hits'] == 1
+
+    other_model.value = 4.0
+    np.testing.assert_allclose(product_model.saliency_map(stimulus), 8.0)
+    # predictions for the old parameters are dropped from memory
+    assert len(product_model._cache) == 1
+
+
+@pytest.mark.parametrize('nonfixations', ['uniform', 'shuffled'])
+def test_aucs_binned(more_stimuli, more_scanpath_fixations, nonfixations):
+    gsmm = GaussianSaliencyMapModel()
+
+    aucs = gsmm.AUCs(more_stimuli, more_scanpath_fixations, nonfixations=nonfixations)
+    binned_aucs, error_bounds = gsmm.AUCs(more_stimuli, more_scanpath_fixations, nonfixations=nonfixations,
+                                          thresholds='binned', bins=20, return_error_bounds=True)
+    assert np.all(np.abs(binned_aucs - aucs) <= error_bounds + 1e-12)
+
+    auc = gsmm.AUC(more_stimuli, more_scanpath_fixations, nonfixations=nonfixations)
+    binned_auc, error_bound = gsmm.AUC(more_stimuli, more_scanpath_fixations, nonfixations=nonfixations,
+                                       thresholds='binned', bins=20, return_error_bound=True)
+    assert abs(binned_auc - auc) <= error_bound + 1e-12
+    assert error_bound > 0
+
+
+def test_aucs_negatives_sample(more_stimuli, more_scanpath_fixations):
+    gsmm = GaussianSaliencyMapModel()
+
+    aucs, error_bounds = gsmm.AUCs(more_stimuli, more_scanpath_fixations, negatives_sample=100, return_error_bounds=True)
+    np.testing.assert_allclose(error_bounds, np.sqrt(np.log(2 / 0.05) / 200))
+    np.testing.assert_allclose(aucs, gsmm.AUCs(more_stimuli, more_scanpath_fixations), atol=error_bounds[0])
+
+    # samples depend only on the seed and the stimulus
+    np.testing.assert_array_equal(gsmm.AUCs(more_stimuli, more_scanpath_fixations, negatives_sample=100), aucs)
+    from pysaliency.parallel import fixations_for_shard, stimuli_for_shard
+    subset_aucs = gsmm.AUCs(stimuli_for_shard(more_stimuli, 1, 3), fixations_for_shard(more_scanpath_fixations, 1, 3),
+                            negatives_sample=100)
+    np.testing.assert_array_equal(subset_aucs, aucs[more_scanpath_fixations.n > 0])
+
+    # without sampling the results are exact
+    auc, error_bound = gsmm.AUC(more_stimuli, more_scanpath_fixations, nonfixations='shuffled',
+                                negatives_sample=10000, return_error_bound=True)
+    assert auc == gsmm.AUC(more_stimuli, more_scanpath_fixations, nonfixations='shuffled')
+    assert error_bound == 0
+
+    auc_judd, error_bound = gsmm.AUC_Judd(more_stimuli, more_scanpath_fixations, negatives_sample=100, return_error_bound=True)
+    assert abs(auc_judd - gsmm.AUC_Judd(more_stimuli, more_scanpath_fixations)) <= error_bound
+
+    with pytest.raises(ValueError):
+        gsmm.AUCs(more_stimuli, more_scanpath_fixations, thresholds='fixations')
+
+
 def test_auc_per_image(stimuli, scanpath_fixations):
     gsmm = GaussianSaliencyMapModel()
 
@@ -410,6 +589,46 @@ def test_shuffled_nonfixation_provider(more_stimuli, more_scanpath_fixations):
     np.testing.assert_allclose(ys, [21, 25, 33, 20, 21, 21, 22])
 
 
+@pytest.mark.parametrize('max_cache_bytes', [0, 1024**3])
+def test_shuffled_auc_engine(more_stimuli, more_scanpath_fixations, max_cache_bytes):
+    from pysaliency.roc import general_rocs_per_positive
+    from pysaliency.saliency_map_models import ShuffledAUCEngine
+    engine = ShuffledAUCEngine(more_stimuli, more_scanpath_fixations, max_cache_bytes=max_cache_bytes)
+    if max_cache_bytes:
+        assert engine.cache is not None
+    else:
+        assert engine.cache is None
+
+    model = GaussianSaliencyMapModel()
+    for n, stimulus in enumerate(more_stimuli):
+        saliency_map = model.saliency_map(stimulus)
+        inds = more_scanpath_fixations.n == n
+        positives = saliency_map[more_scanpath_fixations.y_int[inds], more_scanpath_fixations.x_int[inds]].astype(float)
+
+        xs, ys = engine.nonfixations_for_image(n)
+        negatives = saliency_map[ys, xs].astype(float)
+        np.testing.assert_allclose(engine.negative_values(saliency_map, n), negatives)
+        np.testing.assert_allclose(engine.rocs_per_positive(saliency_map, n, positives),
+                                   general_rocs_per_positive(positives, negatives))
+
+    if max_cache_bytes:
+        assert len(engine.cache) == len(set(more_stimuli.sizes))
+
+
+def test_shuffled_nonfixation_provider_pickle(more_stimuli, more_scanpath_fixations):
+    import dill
+    from pysaliency.saliency_map_models import FullShuffledNonfixationProvider
+    prov = FullShuffledNonfixationProvider(more_stimuli, more_scanpath_fixations)
+    shard_prov = dill.loads(dill.dumps(prov.for_shard(1)))
+
+    assert shard_prov.stimuli is None
+    for n in range(len(more_stimuli) - 1):
+        xs1, ys1 = prov.nonfixations_for_image(n + 1)
+        xs2, ys2 = shard_prov.nonfixations_for_image(n)
+        np.testing.assert_allclose(xs1, xs2)
+        np.testing.assert_allclose(ys1, ys2)
+
+
 def test_lambda_saliency_map_model():
     stimuli = pysaliency.Stimuli([np.random.randn(50, 50, 3),
                                   np.random.randn(50, 50, 3),
@@ -468,6 +687,50 @@ def test_get_unfixated_values():
     assert set(pysaliency.saliency_map_models._get_unfixated_values(smap, ys, xs)) == set([1, 3, 6])
 
 
+def test_unfixated_values_reuses_mask():
+    unfixated_values = pysaliency.saliency_map_models._UnfixatedValues()
+    smap = np.array([[1, 2], [3, 4], [5, 6]])
+
+    np.testing.assert_array_equal(unfixated_values(smap, [0, 1, 1, 2], [1, 1, 1, 0]), [1, 3, 6])
+    mask = unfixated_values.masks[smap.shape]
+    np.testing.assert_array_equal(unfixated_values(smap, [2], [1]), [1, 2, 3, 4, 5])
+    assert unfixated_values.masks[smap.shape] is mask
+    assert mask.all()
+
+    with pytest.raises(ValueError):
+        unfixated_values(smap, [3], [0])
+
+
+def test_auc_unfixated_with_ties(more_stimuli, more_scanpath_fixations):
+    from pysaliency.roc import general_roc, general_rocs_per_positive
+    model = pysaliency.saliency_map_models.DigitizeMapModel(GaussianSaliencyMapModel(), bins=3)
+
+    fixation_indices = more_scanpath_fixations.fixation_indices_by_stimulus
+    aucs = model.AUCs(more_stimuli, more_scanpath_fixations, nonfixations='unfixated')
+    aucs_per_image = model.AUC_per_image(more_stimuli, more_scanpath_fixations, nonfixations='unfixated')
+    for n, stimulus in enumerate(more_stimuli):
+        inds = fixation_indices[n]
+        if not len(inds):
+            continue
+        smap = model.saliency_map(stimulus)
+        ys = more_scanpath_fixations.y_int[inds]
+        xs = more_scanpath_fixations.x_int[inds]
+        fixation_map = np.zeros(smap.shape)
+        fixation_map[ys, xs] = 1
+        positives = smap[ys, xs].astype(float)
+        negatives = smap[fixation_map == 0].astype(float)
+
+        np.testing.assert_array_equal(aucs[inds], general_rocs_per_positive(positives, negatives))
+        assert aucs_per_image[n] == general_roc(positives, negatives)[0]
+
+    scanpath_aucs = pysaliency.ScanpathSaliencyMapModel.AUCs(model, more_stimuli, more_scanpath_fixations, nonfixations='unfixated')
+    for i in range(len(more_scanpath_fixations)):
+        smap = model.saliency_map(more_stimuli.stimulus_objects[more_scanpath_fixations.n[i]])
+        y, x = more_scanpath_fixations.y_int[i], more_scanpath_fixations.x_int[i]
+        negatives = np.delete(smap.flatten(), y * smap.shape[1] + x)
+        assert scanpath_aucs[i] == general_roc(np.array([smap[y, x]], dtype=float), negatives.astype(float))[0]
+
+
 def test_density_map_model(stimuli):
     model = GaussianDensityModel()
     smap_model = pysaliency.saliency_map_models.DensitySaliencyMapModel(model)
@@ -551,3 +814,160 @@ def test_stimulus_dependent_saliency_map_model(stimuli, scanpath_fixations):
     sdsmm.fallback_model = None
     with pytest.raises(ValueError):
         sdsmm.saliency_map(np.random.randn(50, 50, 3))
+
+
+@pytest.mark.parametrize('nonfixations', ['uniform', 'unfixated', 'shuffled', 'fixations'])
+def test_auc_parallel(more_stimuli, more_scanpath_fixations, nonfixations):
+    gsmm = GaussianSaliencyMapModel()
+    if nonfixations == 'fixations':
+        nonfixations = more_scanpath_fixations[::-1]
+
+    aucs = gsmm.AUCs(more_stimuli, more_scanpath_fixations, nonfixations=nonfixations)
+    parallel_aucs = gsmm.AUCs(more_stimuli, more_scanpath_fixations, nonfixations=nonfixations, n_jobs=2)
+    np.testing.assert_array_equal(aucs, parallel_aucs)
+
+    aucs_per_image = gsmm.AUC_per_image(more_stimuli, more_scanpath_fixations, nonfixations=nonfixations)
+    parallel_aucs_per_image = gsmm.AUC_per_image(more_stimuli, more_scanpath_fixations, nonfixations=nonfixations, n_jobs=2)
+    np.testing.assert_array_equal(aucs_per_image, parallel_aucs_per_image)
+
+
+def test_auc_parallel_images_without_fixations(more_stimuli, more_scanpath_fixations):
+    gsmm = GaussianSaliencyMapModel()
+    fixations = more_scanpath_fixations[more_scanpath_fixations.n != 1]
+
+    aucs_per_image = gsmm.AUC_per_image(more_stimuli, fixations, n_jobs=3)
+    np.testing.assert_array_equal(aucs_per_image, gsmm.AUC_per_image(more_stimuli, fixations))
+    assert np.isnan(aucs_per_image[1])
+
+
+def test_stimulus_shards_executor(more_stimuli):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from pysaliency.parallel import stimuli_for_shard, stimulus_shards
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert stimulus_shards(10, executor) == [(0, 5), (5, 10)]
+
+    # shards know the stimulus ids without computing them again
+    sub_stimuli = stimuli_for_shard(more_stimuli, 1, 3)
+    assert dict(sub_stimuli.stimulus_ids._cache) == {0: more_stimuli.stimulus_ids[1], 1: more_stimuli.stimulus_ids[2]}
+
+
+def test_auc_parallel_custom_nonfixations(more_stimuli, more_scanpath_fixations):
+    gsmm = GaussianSaliencyMapModel()
+
+    def nonfixations(stimuli, fixations, i):
+        return np.array([0, 1]), np.array([0, 1])
+
+    with pytest.raises(ValueError):
+        gsmm.AUCs(more_stimuli, more_scanpath_fixations, nonfixations=nonfixations, n_jobs=2)
+
+
+def test_metrics_parallel(more_stimuli, more_scanpath_fixations):
+    gsmm = GaussianSaliencyMapModel()
+    constant_model = ConstantSaliencyMapModel()
+
+    np.testing.assert_array_equal(
+        gsmm.NSSs(more_stimuli, more_scanpath_fixations),
+        gsmm.NSSs(more_stimuli, more_scanpath_fixations, n_jobs=2),
+    )
+    np.testing.assert_array_equal(
+        gsmm.CCs(more_stimuli, constant_model + gsmm),
+        gsmm.CCs(more_stimuli, constant_model + gsmm, n_jobs=2),
+    )
+    np.testing.assert_array_equal(
+        gsmm.SIMs(more_stimuli, constant_model),
+        gsmm.SIMs(more_stimuli, constant_model, n_jobs=2),
+    )
+    np.testing.assert_array_equal(
+        gsmm.image_based_kl_divergences(more_stimuli, constant_model),
+        gsmm.image_based_kl_divergences(more_stimuli, constant_model, n_jobs=2),
+    )
+
+
+@pytest.mark.parametrize('prefetch_count', [0, 2])
+def test_image_metrics_with_list_of_images(monkeypatch, more_stimuli, prefetch_count):
+    monkeypatch.setattr(pysaliency.parallel, 'PREFETCH_COUNT', prefetch_count)
+    gsmm = GaussianSaliencyMapModel()
+    other_model = ConstantSaliencyMapModel() + gsmm
+    images = list(more_stimuli.stimuli)
+
+    np.testing.assert_allclose(gsmm.CCs(images, other_model), gsmm.CCs(more_stimuli, other_model))
+    np.testing.assert_allclose(gsmm.SIMs(images, other_model), gsmm.SIMs(more_stimuli, other_model))
+
+
+def test_prefetch():
+    calls = []
+    prefetched = threading.Event()
+
+    def function(item):
+        calls.append(item)
+        if item == 3:
+            prefetched.set()
+        return item ** 2
+
+    results = pysaliency.parallel.prefetch(function, range(10), prefetch_count=3)
+    assert next(results) == 0
+    assert prefetched.wait(timeout=10)
+    assert calls == [0, 1, 2, 3]
+    assert list(results) == [item ** 2 for item in range(1, 10)]
+
+    # stopping early doesn't compute all items. Closing the generator
+    # waits for the background thread, so the calls are final afterwards.
+    calls.clear()
+    results = pysaliency.parallel.prefetch(function, range(100), prefetch_count=2)
+    for result in results:
+        if result == 4:
+            break
+    results.close()
+    assert len(calls) <= 5
+
+    def failing_function(item):
+        if item == 3:
+            raise ValueError(item)
+        return item
+
+    with pytest.raises(ValueError):
+        list(pysaliency.parallel.prefetch(failing_function, range(5)))
+
+
+@pytest.mark.parametrize('prefetch_count', [0, 1, 4])
+def test_metrics_prefetch(monkeypatch, more_stimuli, more_scanpath_fixations, prefetch_count):
+    gsmm = GaussianSaliencyMapModel(caching=False)
+    constant_model = ConstantSaliencyMapModel(caching=False)
+
+    aucs = gsmm.AUCs(more_stimuli, more_scanpath_fixations)
+    nsss = gsmm.NSSs(more_stimuli, more_scanpath_fixations)
+    ccs = gsmm.CCs(more_stimuli, constant_model + gsmm)
+
+    monkeypatch.setattr(pysaliency.parallel, 'PREFETCH_COUNT', prefetch_count)
+    np.testing.assert_array_equal(gsmm.AUCs(more_stimuli, more_scanpath_fixations), aucs)
+    np.testing.assert_array_equal(gsmm.NSSs(more_stimuli, more_scanpath_fixations), nsss)
+    np.testing.assert_array_equal(gsmm.CCs(more_stimuli, constant_model + gsmm), ccs)
+
+
+def test_storage_dtype_metric_errors(tmp_path, more_stimuli, more_scanpath_fixations):
+    gsmm = GaussianSaliencyMapModel()
+    quantized_gsmm = GaussianSaliencyMapModel(cache_location=str(tmp_path), storage_dtype='uint16')
+
+    # error bounds as documented in `pysaliency.utils.cache_backends.encode_for_storage`
+    for stimulus in more_stimuli:
+        saliency_map = gsmm.saliency_map(stimulus)
+        eps = (saliency_map.max() - saliency_map.min()) / 131064
+        np.testing.assert_allclose(quantized_gsmm.saliency_map(stimulus), saliency_map, atol=eps * (1 + 1e-10), rtol=0)
+
+    nsss = gsmm.NSSs(more_stimuli, more_scanpath_fixations)
+    quantized_nsss = quantized_gsmm.NSSs(more_stimuli, more_scanpath_fixations)
+    for n, stimulus in enumerate(more_stimuli):
+        saliency_map = gsmm.saliency_map(stimulus)
+        eps = (saliency_map.max() - saliency_map.min()) / 131064
+        inds = more_scanpath_fixations.n == n
+        assert np.all(np.abs(quantized_nsss[inds] - nsss[inds]) <= 1.01 * eps * (2 + np.abs(nsss[inds])) / saliency_map.std())
+
+    aucs = gsmm.AUCs(more_stimuli, more_scanpath_fixations)
+    quantized_aucs = quantized_gsmm.AUCs(more_stimuli, more_scanpath_fixations)
+    for i, n in enumerate(more_scanpath_fixations.n):
+        quantized_saliency_map = quantized_gsmm.saliency_map(more_stimuli[n])
+        positive = quantized_saliency_map[more_scanpath_fixations.y_int[i], more_scanpath_fixations.x_int[i]]
+        tie_fraction = np.mean(quantized_saliency_map == positive)
+        assert abs(quantized_aucs[i] - aucs[i]) <= 0.5 * tie_fraction + 1e-12
@@ -7,7 +7,7 @@ import os
 
 import numpy as np
 
-from pysaliency.utils import LazyList, Cache, get_minimal_unique_filenames, atomic_directory_setup, build_padded_2d_array
+from pysaliency.utils import LazyList, Cache, MMAP_MEMORY_CACHE_SIZE, get_minimal_unique_filenames, atomic_directory_setup, build_padded_2d_array
 from test_helpers import TestWithData
 
 
@@ -73,6 +73,31 @@ class TestLazyList(TestWithData):
         self.assertEqual(dict(lazy_list._cache), {i: i**2 for i in range(length)})
         self.assertEqual(list(lazy_list), [i**2 for i in range(length)])
 
+    def test_cache_bytes(self):
+        calls = []
+
+        def gen(i):
+            calls.append(i)
+            return np.full(100, i, dtype=np.float64)
+
+        lazy_list = LazyList(gen, 20, cache_bytes=3000)
+
+        for i in range(20):
+            np.testing.assert_allclose(lazy_list[i], i)
+
+        self.assertEqual(sorted(lazy_list._cache), [17, 18, 19])
+        self.assertEqual(lazy_list._cache.total_bytes, 2400)
+
+        np.testing.assert_allclose(lazy_list[18], 18)
+        np.testing.assert_allclose(lazy_list[0], 0)
+        self.assertEqual(sorted(lazy_list._cache), [0, 18, 19])
+        self.assertEqual(calls, list(range(20)) + [0])
+
+        lazy_list = self.pickle_and_reload(lazy_list, pickler=dill)
+        self.assertEqual(len(lazy_list._cache), 0)
+        np.testing.assert_allclose(lazy_list[5], 5)
+        self.assertEqual(lazy_list._cache.max_bytes, 3000)
+
 
 def test_atomic_directory_setup_success(tmp_path):
     directory = tmp_path / 'testdirectory'
@@ -218,6 +243,87 @@ class TestCache(TestWithData):
         self.assertEqual(len(cache2), 1)
         np.testing.assert_allclose(cache2['foo'], data)
 
+    def test_memory_cache_bytes(self):
+        cache = Cache(memory_cache_bytes=2000)
+
+        data = [np.random.randn(10, 10) for _ in range(3)]  # 800 bytes each
+        cache['foo'] = data[0]
+        cache['bar'] = data[1]
+        np.testing.assert_allclose(cache['foo'], data[0])
+        cache['baz'] = data[2]
+
+        self.assertEqual(sorted(cache.keys()), ['baz', 'foo'])
+        with self.assertRaises(KeyError):
+            cache['bar']
+
+        cache['large'] = np.random.randn(100, 100)
+        self.assertEqual(sorted(cache.keys()), ['baz', 'foo'])
+
+        stats = cache.stats
+        self.assertEqual(stats['memory_hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 2)
+        self.assertEqual(stats['memory_bytes'], 1600)
+
+    def test_disk_cache_bytes(self):
+        cache = Cache(cache_location=self.data_path, memory_cache_size=1, disk_cache_bytes=2000)
+
+        data = [np.random.randn(10, 10) for _ in range(3)]  # about 930 bytes per file
+        cache['foo'] = data[0]
+        cache['bar'] = data[1]
+        cache.clear()
+        np.testing.assert_allclose(cache['foo'], data[0])
+        cache['baz'] = data[2]
+
+        self.assertEqual(sorted(os.path.basename(f) for f in glob.glob(os.path.join(self.data_path, '*.npy'))),
+                         ['baz.npy', 'foo.npy'])
+        self.assertEqual(cache.stats['disk_hits'], 1)
+        self.assertEqual(cache.stats['disk_evictions'], 1)
+
+        # new caches use the modification times of the files to find the least recently used files
+        mtime = os.path.getmtime(os.path.join(self.data_path, 'baz.npy')) + 10
+        os.utime(os.path.join(self.data_path, 'baz.npy'), (mtime, mtime))
+        cache = Cache(cache_location=self.data_path, disk_cache_bytes=2000)
+        cache['bar'] = data[1]
+        self.assertEqual(sorted(os.path.basename(f) for f in glob.glob(os.path.join(self.data_path, '*.npy'))),
+                         ['bar.npy', 'baz.npy'])
+
+    def test_mmap_mode(self):
+        cache = Cache(cache_location=self.data_path, mmap_mode='r', memory_cache_bytes=1000)
+
+        data = np.random.randn(10, 10, 3)
+        cache['foo'] = data
+
+        self.assertIsInstance(cache['foo'], np.memmap)
+        np.testing.assert_allclose(cache['foo'], data)
+        self.assertEqual(cache.stats['memory_bytes'], 0)
+
+        cache = Cache(cache_location=self.data_path, mmap_mode='r')
+        value = cache['foo']
+        self.assertIsInstance(value, np.memmap)
+        self.assertFalse(value.flags.writeable)
+        np.testing.assert_allclose(value, data)
+        self.assertEqual(cache.stats['disk_hits'], 1)
+
+    def test_mmap_mode_bounds_memory_cache(self):
+        cache = Cache(cache_location=self.data_path, mmap_mode='r', memory_cache_size=2)
+        for i in range(5):
+            cache['foo{}'.format(i)] = np.random.randn(10, 10)
+        self.assertEqual(len(cache._cache), 2)
+        self.assertEqual(len(cache), 5)
+
+        # the default limits the number of open memory maps as well
+        cache = Cache(cache_location=self.data_path, mmap_mode='r')
+        for i in range(5):
+            cache['foo{}'.format(i)]
+        self.assertEqual(cache._cache.max_size, MMAP_MEMORY_CACHE_SIZE)
+
+        # copy-on-write maps can be modified without changing the files
+        cache = Cache(cache_location=self.data_path, mmap_mode='c')
+        value = cache['foo0']
+        value[:] = 0
+        self.assertFalse(np.all(np.load(os.path.join(self.data_path, 'foo0.npy')) == 0))
+
 
 def test_build_padded_2d_array():
     arrays = [
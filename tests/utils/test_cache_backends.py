@@ -0,0 +1,241 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from pysaliency.utils import Cache
+from pysaliency.utils.cache_backends import NpyDirectoryBackend, ShardedBackend, decode_from_storage, encode_for_storage
+
+
+def test_sharded_backend(tmp_path):
+    backend = ShardedBackend(str(tmp_path))
+
+    data = {
+        'foo': np.random.randn(10, 10),
+        'bar': np.random.randint(0, 10, size=(3, 4, 5)).astype(np.uint8),
+        'empty': np.zeros((0, 3)),
+    }
+    for key, value in data.items():
+        backend.save(key, value)
+
+    assert sorted(backend.keys()) == sorted(data)
+    assert len(backend) == 3
+    assert 'foo' in backend
+    assert 'baz' not in backend
+    for key, value in data.items():
+        loaded = backend.load(key)
+        assert loaded.dtype == value.dtype
+        np.testing.assert_array_equal(loaded, value)
+
+    with pytest.raises(KeyError):
+        backend.load('baz')
+
+    new_foo = np.random.randn(5)
+    backend.save('foo', new_foo)
+    backend.delete('bar')
+
+    reopened_backend = ShardedBackend(str(tmp_path))
+    assert sorted(reopened_backend.keys()) == ['empty', 'foo']
+    np.testing.assert_array_equal(reopened_backend.load('foo'), new_foo)
+
+    # lock files are stored in `.locks`
+    assert sorted(os.listdir(str(tmp_path))) == ['.locks', 'index.jsonl', 'shard-00000.bin']
+
+
+def test_sharded_backend_sees_other_writers(tmp_path):
+    backend = ShardedBackend(str(tmp_path))
+    other_backend = ShardedBackend(str(tmp_path))
+
+    data = np.random.randn(10, 10)
+    other_backend.save('foo', data)
+
+    assert 'foo' in backend
+    np.testing.assert_array_equal(backend.load('foo'), data)
+
+
+def test_sharded_backend_shards_and_compaction(tmp_path):
+    backend = ShardedBackend(str(tmp_path), max_shard_bytes=2000)
+
+    data = {str(i): np.random.randn(10, 10) for i in range(5)}  # 800 bytes each
+    for key, value in data.items():
+        backend.save(key, value)
+    backend.save('0', data['0'])
+    backend.delete('1')
+    del data['1']
+
+    assert len([f for f in os.listdir(str(tmp_path)) if f.startswith('shard-')]) == 3
+
+    ShardedBackend(str(tmp_path), max_shard_bytes=10000).compact()
+
+    assert sorted(os.listdir(str(tmp_path))) == ['.locks', 'index.jsonl', 'shard-00003.bin']
+    assert os.path.getsize(str(tmp_path / 'shard-00003.bin')) == 4 * 800
+
+    backend = ShardedBackend(str(tmp_path))
+    assert sorted(backend.keys()) == sorted(data)
+    for key, value in data.items():
+        np.testing.assert_array_equal(backend.load(key), value)
+
+
+def test_sharded_backend_mmap(tmp_path):
+    backend = ShardedBackend(str(tmp_path), mmap_mode='r')
+
+    data = np.random.randn(10, 10)
+    backend.save('foo', np.random.randn(3))
+    value = backend.save('bar', data)
+
+    assert isinstance(value, np.memmap)
+    assert isinstance(backend.load('bar'), np.memmap)
+    np.testing.assert_array_equal(backend.load('bar'), data)
+
+
+def test_cache_with_sharded_backend(tmp_path):
+    cache = Cache(cache_location=str(tmp_path), cache_backend='sharded')
+
+    data = np.random.randn(10, 10, 3)
+    cache['foo'] = data
+
+    cache = Cache(cache_location=str(tmp_path), cache_backend='sharded')
+    assert list(cache.keys()) == ['foo']
+    np.testing.assert_array_equal(cache['foo'], data)
+    assert cache.stats['disk_hits'] == 1
+
+    del cache['foo']
+    assert len(cache) == 0
+
+    with pytest.raises(ValueError):
+        Cache(cache_location=str(tmp_path), cache_backend='sharded', disk_cache_bytes=1000)['foo'] = data
+
+
+@pytest.mark.parametrize('cache_backend', ['npy', 'sharded'])
+def test_cache_locking(tmp_path, cache_backend):
+    calls = []
+
+    def compute():
+        calls.append(None)
+        time.sleep(0.2)
+        return np.random.randn(10, 10)
+
+    def get_item(_):
+        # each cache stands for a separate process using the same location
+        cache = Cache(cache_location=str(tmp_path), cache_backend=cache_backend, locking=True)
+        return cache.get_or_compute('foo', compute)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        values = list(executor.map(get_item, range(4)))
+
+    assert len(calls) == 1
+    for value in values[1:]:
+        np.testing.assert_array_equal(value, values[0])
+
+
+@pytest.mark.parametrize('cache_backend', ['npy', 'sharded'])
+def test_cache_locking_nested(tmp_path, cache_backend):
+    # e.g. a model computing its parent model, both using the same key in the same location
+    cache = Cache(cache_location=str(tmp_path), cache_backend=cache_backend, locking=True)
+    parent_cache = Cache(cache_location=str(tmp_path), cache_backend=cache_backend, locking=True)
+    data = np.random.randn(10, 10)
+    values = []
+
+    def get_item():
+        values.append(cache.get_or_compute('foo', lambda: parent_cache.get_or_compute('foo', lambda: data) + 1))
+
+    thread = threading.Thread(target=get_item, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    np.testing.assert_array_equal(values[0], data + 1)
+
+
+def test_npy_backend_writes_atomically(tmp_path):
+    backend = NpyDirectoryBackend(str(tmp_path))
+
+    data = np.random.randn(10, 10)
+    backend.save('foo', data)
+    backend.save('foo', data + 1)
+
+    assert sorted(os.listdir(str(tmp_path))) == ['foo.npy']
+    np.testing.assert_array_equal(backend.load('foo'), data + 1)
+
+
+@pytest.mark.parametrize('storage_dtype,relative_error', [('float32', 2**-24), ('float16', 2**-11)])
+def test_float_storage_dtypes(storage_dtype, relative_error):
+    value = np.random.randn(20, 30) * 100
+    value[0, 0] = -np.inf
+
+    decoded = decode_from_storage(encode_for_storage(value, storage_dtype))
+
+    assert decoded.dtype == np.float32
+    assert decoded[0, 0] == -np.inf
+    np.testing.assert_array_less(np.abs(decoded[1:] - value[1:]), relative_error * np.abs(value[1:]) + 1e-300)
+
+
+def test_float16_storage_dtype_small_values():
+    # e.g. densities, which are mostly in the subnormal range of float16
+    value = np.array([1e-3, 1e-6, 1e-8, 1e-11, 0.0, -1e-7, np.nan])
+
+    decoded = decode_from_storage(encode_for_storage(value, 'float16'))
+
+    np.testing.assert_array_less(np.abs(decoded[:4] - value[:4]), 2**-11 * np.abs(value[:4]))
+    assert decoded[4] == 0
+    assert np.isnan(decoded[6])
+    np.testing.assert_allclose(decoded[5], -1e-7, rtol=2**-11)
+
+    # values far below the largest value lose their relative precision
+    value = np.array([1.0, 2**-30, 2**-45])
+    decoded = decode_from_storage(encode_for_storage(value, 'float16'))
+    assert abs(decoded[1] - value[1]) <= 2**-39
+    assert decoded[2] == 0
+
+    with pytest.raises(ValueError):
+        encode_for_storage(np.array([1e300]), 'float16')
+
+
+@pytest.mark.parametrize('cache_backend', ['npy', 'sharded'])
+def test_float16_without_storage_dtype(tmp_path, cache_backend):
+    # arrays which haven't been encoded keep their dtype
+    value = np.random.randn(20, 30).astype(np.float16)
+    cache = Cache(cache_location=str(tmp_path), cache_backend=cache_backend)
+    cache['foo'] = value
+
+    cache = Cache(cache_location=str(tmp_path), cache_backend=cache_backend)
+    assert cache['foo'].dtype == np.float16
+    np.testing.assert_array_equal(cache['foo'], value)
+    assert decode_from_storage(value) is value
+
+
+def test_quantized_storage_dtype(tmp_path):
+    value = np.random.randn(20, 30) * 100
+    value[0, :3] = [-np.inf, np.inf, np.nan]
+    finite_values = value[np.isfinite(value)]
+
+    encoded = encode_for_storage(value, 'uint16')
+    decoded = decode_from_storage(encoded)
+
+    assert decoded.shape == value.shape
+    np.testing.assert_array_equal(decoded[0, :3], value[0, :3])
+    max_error = (finite_values.max() - finite_values.min()) / 131064
+    finite = np.isfinite(value)
+    assert np.all(np.abs(decoded[finite] - value[finite]) <= max_error * (1 + 1e-10))
+
+    # rounding is monotonous
+    order = np.argsort(finite_values)
+    assert np.all(np.diff(decoded[finite][order]) >= 0)
+
+    np.testing.assert_array_equal(decode_from_storage(encode_for_storage(np.ones(5), 'uint16')), np.ones(5))
+    np.testing.assert_array_equal(encode_for_storage(np.arange(5), 'uint16'), np.arange(5))
+
+
+@pytest.mark.parametrize('cache_backend', ['npy', 'sharded'])
+@pytest.mark.parametrize('mmap_mode', [None, 'r'])
+def test_cache_storage_dtype(tmp_path, cache_backend, mmap_mode):
+    cache = Cache(cache_location=str(tmp_path), cache_backend=cache_backend, mmap_mode=mmap_mode, storage_dtype='uint16')
+
+    value = np.random.randn(20, 30)
+    stored_value = cache.get_or_compute('foo', lambda: value)
+    np.testing.assert_allclose(stored_value, value, atol=(value.max() - value.min()) / 131064 * (1 + 1e-10), rtol=0)
+
+    cache = Cache(cache_location=str(tmp_path), cache_backend=cache_backend, mmap_mode=mmap_mode)
+    np.testing.assert_array_equal(cache['foo'], stored_value)